@@ -0,0 +1,59 @@
+"""
+Measures parse_json_to_type on large synthetic responses.
+
+    python3 benchmarks/bench_type_parser.py
+"""
+from dataclasses import dataclass
+from enum import Enum
+import time
+from typing import Optional
+
+from fructose import type_parser
+
+class Color(Enum):
+    LAVENDER = "lavender"
+    INDIGO = "indigo"
+    TERRACOTTA = "terracotta"
+
+@dataclass
+class House:
+    color: Color
+    size: int
+    is_occupied: bool
+
+@dataclass
+class Person:
+    name: str
+    age: int
+    city: Optional[str]
+    home: House
+    tags: list[str]
+    scores: dict[str, float]
+    location: tuple[float, float]
+
+def make_payload(n):
+    colors = [member.name for member in Color]
+    return [
+        {
+            "name": f"person {i}",
+            "age": i % 90,
+            "city": None if i % 3 else "Paris",
+            "home": {"color": colors[i % len(colors)], "size": i, "is_occupied": bool(i % 2)},
+            "tags": ["a", "b", "c"],
+            "scores": {"x": 1.5, "y": 2.5},
+            "location": [48.85, 2.35],
+        }
+        for i in range(n)
+    ]
+
+def main(n=10_000, repeats=5):
+    payload = make_payload(n)
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        type_parser.parse_json_to_type(payload, list[Person])
+        best = min(best, time.perf_counter() - start)
+    print(f"parse_json_to_type list[Person] x {n}: {best * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
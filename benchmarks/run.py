@@ -0,0 +1,125 @@
+"""
+Measures the client-side overhead of fructose against an in-process fake client, no API key needed.
+
+    python3 benchmarks/run.py                  # print timings
+    python3 benchmarks/run.py --save           # record them as the baseline
+    python3 benchmarks/run.py --check          # fail if anything got slower than the baseline allows
+"""
+import argparse
+from dataclasses import dataclass
+import json
+import os
+import sys
+import time
+from typing import Callable
+
+from fructose import Fructose, function_helpers, type_parser
+from fructose.testing import FakeClient, completion, cycle, tool_call
+
+from bench_type_parser import Person, make_payload
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+# the check allows this much slowdown, since timings are noisy
+DEFAULT_TOLERANCE = 0.5
+
+@dataclass
+class Invoice:
+    customer: str
+    amount: float
+    lines: list[tuple[str, int]]
+
+def lookup_customer(name: str, region: str = "eu", include_history: bool = False) -> dict[str, str]:
+    return {"name": name, "region": region}
+
+def lookup_invoices(customer: str, statuses: list[str], limit: int = 10) -> list[Invoice]:
+    return []
+
+def _make_ai():
+    answer = json.dumps({"response": make_payload(20)})
+    responses = cycle([
+        completion(tool_calls=[tool_call("call_1", "lookup_customer", {"name": "Ann"})]),
+        answer,
+    ])
+    return Fructose(client=FakeClient(default=responses))
+
+def _define(ai):
+    @ai(uses=[lookup_customer, lookup_invoices])
+    def find_people(query: str, limit: int = 20) -> list[Person]:
+        """
+        Find the people matching the query.
+        """
+    return find_people
+
+def _benchmarks() -> dict[str, tuple[Callable[[], object], int]]:
+    """
+    Returns each benchmark's function and how many times to call it per measurement.
+    """
+    ai = _make_ai()
+    find_people = _define(ai)
+    find_people("everyone")
+    arguments = (("everyone",), {"limit": 5})
+    payload = make_payload(1_000)
+
+    handler = find_people.stream.__self__
+
+    return {
+        "decorate": (lambda: _define(ai), 100),
+        "load_templates": (lambda: ai(), 100),
+        "collect_arguments": (lambda: function_helpers.collect_arguments(find_people.__wrapped__, *arguments), 10_000),
+        "prepare": (handler._prepare, 100),
+        "parse_json_to_type": (lambda: type_parser.parse_json_to_type(payload, list[Person]), 10),
+        "tool_schemas": (lambda: [function_helpers.convert_function_to_openai_function(f) for f in (lookup_customer, lookup_invoices)], 1_000),
+        "round_trip": (lambda: find_people("everyone"), 100),
+    }
+
+def measure(func: Callable[[], object], number: int, repeats: int) -> float:
+    """
+    Returns the best time per call in seconds, over `repeats` runs of `number` calls.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def run(repeats: int) -> dict[str, float]:
+    return {name: measure(func, number, repeats) for name, (func, number) in _benchmarks().items()}
+
+def check(results: dict[str, float], baseline: dict[str, float], tolerance: float) -> list[str]:
+    regressions = []
+    for name, seconds in results.items():
+        if name in baseline and seconds > baseline[name] * (1 + tolerance):
+            regressions.append(f"{name}: {seconds * 1e6:.1f} us, baseline {baseline[name] * 1e6:.1f} us")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit with an error on regressions against the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run(args.repeats)
+    for name, seconds in results.items():
+        print(f"{name:>20}: {seconds * 1e6:10.1f} us")
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+            f.write("\n")
+
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = check(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"\033[91mRegression: {regression}\033[0m")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
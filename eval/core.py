@@ -1,71 +1,234 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+import json
+import math
+import os
 import sys
-from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
+from typing import Any, Callable, Optional
 
-from pydantic_core.core_schema import time_schema
-from fructose import Fructose
-
-ai = Fructose()
+from fructose import Fructose, cassette
+from fructose.ai import DEFAULT_MODEL
+from fructose.concurrency import ConcurrencyPolicy
+from fructose.metrics import MetricsRegistry
+from fructose.scheduler import Scheduler
 
-thread_pool = ThreadPoolExecutor(max_workers=100)
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TRIALS = 1
+DEFAULT_TIMEOUT = 120.0
+TOKEN_COUNTERS = ["prompt_tokens", "completion_tokens", "cached_tokens"]
 
-DEBUG = True
-
-@dataclass
-class EvalResult:
-    execution_time: float
-    score: int
+# every FructoseEval subclass, in definition order
+EVAL_SUITES = []
 
 class FructoseEval():
+    """
+    Subclass to define evals: each static method named eval_* takes (ai, debug) and raises if the eval fails.
+    Subclasses are only registered, run them with main().
+    """
     def __init_subclass__(cls):
-        # list all functions on cls
-        functions = [
-            attr
-            for attr in dir(cls)
-            if callable(getattr(cls, attr)) and attr.startswith("eval_")
-        ]
-
-        if len(sys.argv) > 1:
-            functions = [f for f in functions if f == sys.argv[1]]
-
-
-        score = 0
-
-        total_execution_time = 0
-        num_execuations = 0
+        EVAL_SUITES.append(cls)
 
-        futures = []
-        for func in functions:
-            print(f"running {func}")
-
-            def run(func):
-                start_time = time.time()
-                result = 1
-                try:
-                    getattr(cls, func)(ai, DEBUG)
-                    print(f"\033[92m{func} passed\033[0m")
-                except Exception as e:
-                    print(f"\033[91m{func} failed\033[0m")
-                    print(e)
-                    result = 0
-
-                execution_time = time.time() - start_time
-
-                return EvalResult(execution_time, result)
-
-            futures.append(thread_pool.submit(run, func))
-
-        for future in futures:
-            result = future.result()
-            score += result.score
-            total_execution_time += result.execution_time
-            num_execuations += 1
-
-        avg_execution_time = total_execution_time / num_execuations
+@dataclass
+class EvalCase:
+    suite: type
+    name: str
 
-        print("\n\n#########\nEvaluation complete\n#########")
-        print(f"Score: {score}/{len(functions)}")
-        print(f"Average execution time: {avg_execution_time} seconds")
-        print(f"Percentage: {score/len(functions) * 100}%")
+    @property
+    def func(self) -> Callable[[Fructose, bool], Any]:
+        return getattr(self.suite, self.name)
 
+@dataclass
+class TrialResult:
+    name: str
+    passed: bool
+    execution_time: float
+    error: Optional[str] = None
+
+def collect_evals(names: Optional[list[str]] = None) -> list[EvalCase]:
+    cases = [
+        EvalCase(suite, attr)
+        for suite in EVAL_SUITES
+        for attr in dir(suite)
+        if attr.startswith("eval_") and callable(getattr(suite, attr))
+    ]
+    if names:
+        cases = [case for case in cases if case.name in names]
+    return cases
+
+def _call_with_timeout(func: Callable[[], Any], timeout: Optional[float]):
+    # a daemon thread, so that a hung eval can't keep the process alive
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = func()
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise TimeoutError(f"timed out after {timeout} seconds")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("result")
+
+def run_trial(case: EvalCase, ai: Fructose, debug: bool, timeout: Optional[float]) -> TrialResult:
+    start_time = time.perf_counter()
+    try:
+        _call_with_timeout(lambda: case.func(ai, debug), timeout)
+        passed, error = True, None
+        print(f"\033[92m{case.name} passed\033[0m")
+    except Exception as e:
+        passed, error = False, f"{type(e).__name__}: {e}"
+        print(f"\033[91m{case.name} failed\033[0m")
+        print(error)
+    return TrialResult(case.name, passed, time.perf_counter() - start_time, error)
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    """
+    Nearest-rank percentile, p in [0, 100].
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def _latency_stats(times: list[float]) -> dict[str, Optional[float]]:
+    return {
+        "mean": sum(times) / len(times) if times else None,
+        "p50": percentile(times, 50),
+        "p95": percentile(times, 95),
+        "p99": percentile(times, 99),
+    }
+
+def _token_totals(snapshots: list[dict[str, Any]], prefix: str = "") -> dict[str, int]:
+    totals = dict.fromkeys(TOKEN_COUNTERS, 0)
+    for snapshot in snapshots:
+        if snapshot["function"].startswith(prefix):
+            for counter in TOKEN_COUNTERS:
+                totals[counter] += snapshot["counters"][counter]
+    return totals
+
+def run_evals(cases: list[EvalCase], ai: Fructose, metrics: MetricsRegistry, trials: int = DEFAULT_TRIALS, concurrency: int = DEFAULT_CONCURRENCY, timeout: Optional[float] = DEFAULT_TIMEOUT, debug: bool = False) -> dict[str, Any]:
+    """
+    Runs every case `trials` times, at most `concurrency` at once, and returns a JSON-serializable report.
+    """
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            (case, executor.submit(run_trial, case, ai, debug, timeout))
+            for _ in range(trials)
+            for case in cases
+        ]
+        results = [(case, future.result()) for case, future in futures]
+    wall_time = time.perf_counter() - start_time
+
+    snapshots = metrics.snapshot()
+    evals = {}
+    for case in cases:
+        case_results = [result for result_case, result in results if result_case is case]
+        passed = sum(result.passed for result in case_results)
+        evals[case.name] = {
+            "passed": passed,
+            "trials": len(case_results),
+            "pass_rate": passed / len(case_results),
+            "latency": _latency_stats([result.execution_time for result in case_results]),
+            # functions defined inside an eval are named after it, e.g. ElderberryEval.eval_x.<locals>.x
+            "tokens": _token_totals(snapshots, f"{case.suite.__module__}.{case.suite.__qualname__}.{case.name}.<locals>"),
+            "errors": sorted({result.error for result in case_results if result.error is not None}),
+        }
+
+    passed = sum(result.passed for _, result in results)
+    return {
+        "trials": trials,
+        "concurrency": concurrency,
+        "timeout": timeout,
+        "evals": evals,
+        "summary": {
+            "passed": passed,
+            "total": len(results),
+            "pass_rate": passed / len(results) if results else None,
+            "wall_time": wall_time,
+            "latency": _latency_stats([result.execution_time for _, result in results]),
+            "tokens": _token_totals(snapshots),
+        },
+    }
+
+def _format_seconds(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds:.2f}s"
+
+def print_report(report: dict[str, Any]):
+    summary = report["summary"]
+    latency = summary["latency"]
+    print("\n\n#########\nEvaluation complete\n#########")
+    print(f"Score: {summary['passed']}/{summary['total']}")
+    print(f"Percentage: {(summary['pass_rate'] or 0) * 100:.1f}%")
+    print(f"Latency: mean {_format_seconds(latency['mean'])}, p50 {_format_seconds(latency['p50'])}, "
+          f"p95 {_format_seconds(latency['p95'])}, p99 {_format_seconds(latency['p99'])}")
+    print(f"Wall time: {_format_seconds(summary['wall_time'])}")
+    print("Tokens: " + ", ".join(f"{counter} {count}" for counter, count in summary["tokens"].items()))
+
+def _change(new: Optional[float], old: Optional[float], format: Callable[[float], str]) -> str:
+    if new is None or old is None:
+        return f"{'-' if old is None else format(old)} -> {'-' if new is None else format(new)}"
+    return f"{format(old)} -> {format(new)} ({new - old:+.2f})"
+
+def print_comparison(report: dict[str, Any], previous: dict[str, Any]):
+    """
+    Prints how pass rates, latencies and tokens changed since a previous report.
+    """
+    print("\n\n#########\nComparison\n#########")
+    rows = [("summary", report["summary"], previous["summary"])]
+    rows += [(name, evals, previous["evals"].get(name)) for name, evals in report["evals"].items()]
+    for name, new, old in rows:
+        if old is None:
+            print(f"{name}: new")
+            continue
+        pass_rate = _change(new["pass_rate"], old["pass_rate"], lambda rate: f"{rate * 100:.0f}%")
+        p50 = _change(new["latency"]["p50"], old["latency"]["p50"], _format_seconds)
+        p95 = _change(new["latency"]["p95"], old["latency"]["p95"], _format_seconds)
+        new_tokens = new["tokens"]["prompt_tokens"] + new["tokens"]["completion_tokens"]
+        old_tokens = old["tokens"]["prompt_tokens"] + old["tokens"]["completion_tokens"]
+        print(f"{name}: pass rate {pass_rate}, p50 {p50}, p95 {p95}, tokens {old_tokens} -> {new_tokens}")
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Runs the fructose evals.")
+    parser.add_argument("names", nargs="*", help="the evals to run, e.g. eval_get_avg_len (default: all)")
+    parser.add_argument("--trials", type=int, default=DEFAULT_TRIALS, help="how many times to run each eval")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="how many evals to run at once")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds before an eval counts as failed")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--report", help="write a JSON report to this path")
+    parser.add_argument("--compare", help="compare against a previous JSON report")
+    parser.add_argument("--cassette", help=f"the cassette to use when {cassette.CASSETTE_MODE_ENV_VAR} is set (default: eval/cassettes/<model>.json)")
+    parser.add_argument("--adaptive", action="store_true", help="let an adaptive limit decide how many completions run at once, instead of --concurrency alone")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args(argv)
+
+    cases = collect_evals(args.names)
+    if not cases:
+        sys.exit(f"No evals match {args.names}")
+
+    cassette_path = args.cassette or os.path.join(os.path.dirname(__file__), "cassettes", f"{args.model}.json")
+    metrics = MetricsRegistry()
+    scheduler = Scheduler(concurrency=ConcurrencyPolicy()) if args.adaptive else None
+    ai = Fructose(client=cassette.client_from_env(cassette_path), model=args.model, metrics=metrics, scheduler=scheduler)
+    report = run_evals(cases, ai, metrics, args.trials, args.concurrency, args.timeout, args.debug)
+    report["model"] = args.model
+    if scheduler is not None:
+        report["concurrency"] = scheduler.concurrency_limits()
+        report["concurrency_decisions"] = scheduler.decisions()
+    print_report(report)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
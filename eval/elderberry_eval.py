@@ -1,5 +1,5 @@
 from enum import Enum
-from core import FructoseEval
+from core import FructoseEval, main
 from dataclasses import dataclass
 
 class Color(Enum):
@@ -194,3 +194,7 @@ class ElderberryEval(FructoseEval):
 
         makeup_marriage()
 
+
+
+if __name__ == "__main__":
+    main()
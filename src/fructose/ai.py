@@ -1,43 +1,119 @@
-from functools import wraps
+from functools import partial, wraps
+import inspect
 import os
+import threading
+import weakref
 from typing import Any, Callable, Optional
 from pathlib import Path
-from .llm_function_handler import LLMFunctionHandler
+from .llm_function_handler import AsyncLLMFunctionHandler, LLMFunctionHandler
+from . import batch, cascade as cascading, mapping, packing
+from .llm_function_handler import DEFAULT_RETRIES
+from . import scheduler as scheduling
+from .client_pool import default_pool
+from concurrent.futures import ThreadPoolExecutor
 import openai
-from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from jinja2 import ChoiceLoader, Environment, FileSystemBytecodeCache, FileSystemLoader, StrictUndefined
 
 DEFAULT_MODEL = "gpt-4-turbo-preview"
 # DEFAULT_MODEL = "gpt-3.5-turbo"
 
 LabeledArguments = dict[str, Any]
 
+# a directory for jinja's compiled template bytecode, so new processes skip compiling the templates
+TEMPLATE_BYTECODE_CACHE_ENV = "FRUCTOSE_TEMPLATE_CACHE_DIR"
+TEMPLATE_CACHE_SIZE = 400
+
+_template_env = None
+_template_dirs = ["./"]
+_bytecode_cache_dir = None
+_template_env_lock = threading.Lock()
+
+def configure_templates(template_dirs=("./",), bytecode_cache_dir=None):
+    """
+    Sets where templates are looked up, after the package templates, and where compiled templates are cached on
+    disk, replacing the previous settings. Templates already loaded keep working.
+
+    Usage:
+        configure_templates(template_dirs=["./prompts"], bytecode_cache_dir="/tmp/fructose-templates")
+    """
+    global _template_env, _template_dirs, _bytecode_cache_dir
+    with _template_env_lock:
+        _template_dirs = [str(template_dir) for template_dir in template_dirs]
+        _bytecode_cache_dir = None if bytecode_cache_dir is None else str(bytecode_cache_dir)
+        _template_env = None
+
 def get_base_template_env():
-    p = Path(__file__).parent / 'templates'
-    loader = FileSystemLoader(p)
+    """
+    The environment shared by the whole process, so each template is loaded and compiled once.
+    """
+    global _template_env
+    env = _template_env
+    if env is not None:
+        return env
+    with _template_env_lock:
+        if _template_env is None:
+            bytecode_cache_dir = _bytecode_cache_dir or os.environ.get(TEMPLATE_BYTECODE_CACHE_ENV)
+            if bytecode_cache_dir:
+                os.makedirs(bytecode_cache_dir, exist_ok=True)
+            _template_env = Environment(
+                loader=ChoiceLoader([FileSystemLoader(Path(__file__).parent / 'templates'), _local_template_loader()]),
+                undefined=StrictUndefined,
+                cache_size=TEMPLATE_CACHE_SIZE,
+                bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir) if bytecode_cache_dir else None,
+            )
+        return _template_env
 
-    return Environment(
-        loader=loader,
-        undefined=StrictUndefined
-    )
+def _local_template_loader():
+    """
+    Loads the user's templates, relative to the working directory or from the directories of configure_templates.
+    """
+    return FileSystemLoader(searchpath=_template_dirs)
 
 def get_local_template_loader():
-    loader = FileSystemLoader(searchpath="./")
+    """
+    An environment of only the user's templates, see _local_template_loader.
+    """
     return Environment(
-        loader=loader,
+        loader=_local_template_loader(),
         undefined=StrictUndefined
     )
 
 class Fructose():
-    def __init__(self, client=None, model=DEFAULT_MODEL, system_template_path=None, chain_of_thought_template_path=None, debug=False):
+    def __init__(self, client=None, model=DEFAULT_MODEL, system_template_path=None, chain_of_thought_template_path=None, debug=False, async_client=None, cache=None, tool_executor=None, tool_timeout=None, fail_fast=False, max_output_chars=None, structured_outputs=False, repair='strict', retry_strategy='compact', max_argument_tokens=None, metrics=None, tracer=None, pack=False, client_pool=None, scheduler=None, hedging=None):
+        # clients are shared through the pool, so every instance reuses the same connections
+        self._client_pool = default_pool if client_pool is None else client_pool
+        # a custom client's settings can't be carried over to an async client, see _get_async_client
+        self._custom_client = client is not None and async_client is None
         if client is None:
-            client = openai.Client(
-                api_key=os.environ['OPENAI_API_KEY']
-            )
+            client = self._client_pool.get()
+        if scheduler is not None:
+            # the scheduler retries 429s itself, after pausing the model
+            client = scheduling.without_retries(client)
+            if async_client is not None:
+                async_client = scheduling.without_retries(async_client)
         self._client = client
+        self._async_client = async_client
+        self._cache = cache
+        self._tool_executor = tool_executor
+        self._tool_timeout = tool_timeout
+        self._fail_fast = fail_fast
+        self._max_output_chars = max_output_chars
+        self._structured_outputs = structured_outputs
+        self._repair = repair
+        self._retry_strategy = retry_strategy
+        self._max_argument_tokens = max_argument_tokens
+        self._metrics = metrics
+        self._tracer = tracer
+        # shared by every function of this instance, so they draw from the same rate limits
+        self._scheduler = scheduler
+        self._pack = pack
+        self._hedging = hedging
         self._model = model
         self._system_template_path = system_template_path
         self._chain_of_thought_template_path = chain_of_thought_template_path
         self._debug = debug
+        # the handlers of every live function this instance decorated, for warmup()
+        self._handlers = weakref.WeakSet()
 
     def __call__(
             self,
@@ -49,6 +125,20 @@ class Fructose():
             chain_of_thought_template_path=None,
             model=None,
             debug=None,
+            cache=None,
+            tool_executor=None,
+            tool_timeout=None,
+            fail_fast=None,
+            max_output_chars=None,
+            structured_outputs=None,
+            repair=None,
+            retry_strategy=None,
+            max_argument_tokens=None,
+            pack=None,
+            max_concurrency=None,
+            hedging=None,
+            validator=None,
+            cascade=None,
         ):
 
         if func is not None and callable(func):
@@ -59,41 +149,182 @@ class Fructose():
                 system_template_path=system_template_path,
                 chain_of_thought_template_path=chain_of_thought_template_path,
                 model=model,
-                debug=debug
+                debug=debug,
+                cache=cache,
+                tool_executor=tool_executor,
+                tool_timeout=tool_timeout,
+                fail_fast=fail_fast,
+                max_output_chars=max_output_chars,
+                structured_outputs=structured_outputs,
+                repair=repair,
+                retry_strategy=retry_strategy,
+                max_argument_tokens=max_argument_tokens,
+                pack=pack,
+                max_concurrency=max_concurrency,
+                hedging=hedging,
+                validator=validator,
+                cascade=cascade
             )(func)
 
         if debug is None:
             debug = self._debug
         model = model or self._model
+        if cache is None:
+            cache = self._cache
+        tool_executor = tool_executor or self._tool_executor
+        if tool_timeout is None:
+            tool_timeout = self._tool_timeout
+        if fail_fast is None:
+            fail_fast = self._fail_fast
+        if max_output_chars is None:
+            max_output_chars = self._max_output_chars
+        if structured_outputs is None:
+            structured_outputs = self._structured_outputs
+        repair = repair or self._repair
+        retry_strategy = retry_strategy or self._retry_strategy
+        if max_argument_tokens is None:
+            max_argument_tokens = self._max_argument_tokens
+        if pack is None:
+            pack = self._pack
+        if pack is True:
+            pack = packing.PackingPolicy()
+        hedging = hedging or self._hedging
+        # a list of models is a cascade, tried cheapest first
+        models = list(model) if isinstance(model, (list, tuple)) else [model]
+        cascaded = len(models) > 1 or validator is not None
+        if cascaded and pack:
+            raise ValueError("Packing doesn't support model cascades or validators")
+        cascade = cascade or cascading.CascadePolicy()
+        if max_concurrency is not None and self._scheduler is None:
+            raise ValueError("max_concurrency is enforced by the scheduler, pass Fructose(scheduler=...)")
 
         system_template_path = system_template_path or self._system_template_path
         chain_of_thought_template_path = chain_of_thought_template_path or self._chain_of_thought_template_path
 
-        if system_template_path is not None:
-            system_template = get_base_template_env().get_template(system_template_path)
-        else:
-            system_template = get_base_template_env().get_template("default_prompt.jinja")
-
-        if chain_of_thought_template_path is not None:
-            chain_of_thought_template = get_base_template_env().get_template(chain_of_thought_template_path)
-        else:
-            chain_of_thought_template = get_base_template_env().get_template("chain_of_thought_prompt.jinja")
+        template_env = get_base_template_env()
+        system_template = template_env.get_template(system_template_path or "default_prompt.jinja")
+        chain_of_thought_template = template_env.get_template(chain_of_thought_template_path or "chain_of_thought_prompt.jinja")
 
         def decorator(func):
-            llm_function_handler = LLMFunctionHandler(
-                client=self._client,
+            is_async = self._is_async(func)
+            handler_class = AsyncLLMFunctionHandler if is_async else LLMFunctionHandler
+            handlers = [
+                # models escalate instead of retrying, except the last one
+                build_handler(handler_class, is_async, func, model, cascade.early_retries if i < len(models) - 1 else DEFAULT_RETRIES)
+                for i, model in enumerate(models)
+            ]
+            llm_function_handler = handlers[0]
+            self._handlers.update(handlers)
+            if cascaded:
+                # one repairs counter for the whole function
+                for handler in handlers[1:]:
+                    handler.repairs = llm_function_handler.repairs
+                model_cascade = cascading.Cascade(handlers, validator, cascade)
+
+            if is_async:
+                if pack:
+                    raise ValueError(f"Packing is only supported for sync functions, {func.__name__} is async")
+                call = model_cascade.acall if cascaded else llm_function_handler
+
+                @wraps(func)
+                async def wrapper(*args, **kwargs):
+                    return await call(*args, **kwargs)
+                map_calls = mapping.amap_calls
+            else:
+                call = model_cascade if cascaded else llm_function_handler
+                if pack:
+                    packed_template = template_env.get_template(packing.PACKED_TEMPLATE)
+                    call = packing.Packer(llm_function_handler, packed_template, pack)
+
+                @wraps(func)
+                def wrapper(*args, **kwargs):
+                    return call(*args, **kwargs)
+                map_calls = mapping.map_calls
+
+            wrapper.stream = llm_function_handler.stream
+            wrapper.repairs = llm_function_handler.repairs
+            if cascaded:
+                wrapper.cascade_stats = model_cascade.stats
+            # bulk calls queue behind interactive ones when there's a scheduler
+            bulk_wrapper = scheduling.with_priority(wrapper, scheduling.BATCH_PRIORITY)
+            wrapper.map = partial(map_calls, bulk_wrapper)
+            wrapper.imap = partial(map_calls, bulk_wrapper, ordered=False)
+            wrapper.batch_submit = partial(batch.submit, llm_function_handler)
+            wrapper.batch_collect = partial(batch.collect, llm_function_handler)
+            if cascaded:
+                # these would only use the first model, skipping escalation and the validator
+                def unsupported(*args, **kwargs):
+                    raise ValueError(f"{func.__name__} is a model cascade or has a validator, which stream, batch_submit and batch_collect don't support")
+                wrapper.stream = wrapper.batch_submit = wrapper.batch_collect = unsupported
+
+            return wrapper
+
+        def build_handler(handler_class, is_async, func, model, retries):
+            return handler_class(
+                client=self._get_async_client() if is_async else self._client,
                 model=model,
+                retries=retries,
                 func=func,
                 uses=uses,
                 flavors=flavors,
                 system_template=system_template,
                 chain_of_thought_template=chain_of_thought_template,
-                debug=debug)
-
-            @wraps(func)
-            def wrapper(*args, **kwargs):
-                return llm_function_handler(*args, **kwargs)
-           
-            return wrapper
+                debug=debug,
+                response_cache=cache or None,
+                tool_executor=tool_executor,
+                tool_timeout=tool_timeout,
+                fail_fast=fail_fast,
+                max_output_chars=max_output_chars,
+                structured_outputs=structured_outputs,
+                repair_level=repair,
+                retry_strategy=retry_strategy,
+                max_argument_tokens=max_argument_tokens,
+                metrics_registry=self._metrics,
+                tracer=self._tracer,
+                scheduler=self._scheduler,
+                max_concurrency=max_concurrency,
+                hedging_policy=hedging)
         
         return decorator
+
+    def warmup(self, max_workers=None):
+        """
+        Prepares every function decorated so far, resolving its return type and rendering its prompts, so the
+        first calls don't pay for it. Returns how many handlers were prepared, one per model of a cascade.
+
+        Usage:
+            ai.warmup()
+        """
+        handlers = [handler for handler in self._handlers if handler._system_message is None]
+        if not handlers:
+            return 0
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fructose-warmup") as executor:
+            # _prepare assigns its results at once, so a call racing it is harmless
+            for _ in executor.map(lambda handler: handler._prepare(), handlers):
+                pass
+        return len(handlers)
+
+    def _is_async(self, func):
+        return inspect.iscoroutinefunction(func)
+
+    def _get_async_client(self):
+        if self._async_client is None:
+            if self._custom_client:
+                raise ValueError("async def functions need an async client too, pass Fructose(client=..., async_client=...) with the same settings")
+            self._async_client = self._client_pool.get_async()
+            if self._scheduler is not None:
+                self._async_client = scheduling.without_retries(self._async_client)
+        return self._async_client
+
+class AsyncFructose(Fructose):
+    """
+    A Fructose whose decorated functions are all awaitable, backed by an openai.AsyncClient.
+    Takes the same arguments as Fructose.
+    """
+    def __init__(self, client=None, client_pool=None, **kwargs):
+        if client is None:
+            client = (default_pool if client_pool is None else client_pool).get_async()
+        super().__init__(client=client, async_client=client, client_pool=client_pool, **kwargs)
+
+    def _is_async(self, func):
+        return True
@@ -0,0 +1,133 @@
+import json
+from typing import Any, Iterable, Iterator, Optional
+from . import mapping
+
+BATCH_METHOD = "POST"
+BATCH_URL = "/v1/chat/completions"
+
+class BatchItemError(Exception):
+    """
+    A batch request that failed at the provider, or whose response didn't parse.
+    """
+    def __init__(self, custom_id: str, message: str):
+        super().__init__(f"{custom_id}: {message}")
+        self.custom_id = custom_id
+
+def _check_supported(handler):
+    if len(handler._tool_registry) > 0:
+        raise ValueError(f"{handler._func.__name__} uses tools, which need several round trips and can't be batched")
+    if "chain_of_thought" in handler._flavors:
+        raise ValueError(f"{handler._func.__name__} uses chain_of_thought, which needs two round trips and can't be batched")
+
+def _custom_id(handler, index: int) -> str:
+    return f"{handler._func.__name__}-{index}"
+
+def request_line(handler, custom_id: str, item: Any) -> dict[str, Any]:
+    """
+    The batch request for calling the handler's function on item, with the messages a regular call would send.
+    """
+    messages, _ = handler._build_messages((item,), {})
+    return {
+        "custom_id": custom_id,
+        "method": BATCH_METHOD,
+        "url": BATCH_URL,
+        "body": {
+            "model": handler._model,
+            "messages": messages,
+            "response_format": handler._response_format,
+        },
+    }
+
+def submit(handler, inputs: Iterable[Any], path: str) -> int:
+    """
+    Writes a Batch API input file with one request per input, each passed as the function's argument like in
+    `map`. Custom ids are the function name and the input's index. Returns the number of requests written.
+
+    Usage:
+        classify.batch_submit(texts, "requests.jsonl")
+        # upload requests.jsonl as a batch job, download its output file, then
+        for custom_id, label in classify.batch_collect("results.jsonl", "requests.jsonl", "retry.jsonl"):
+            ...
+    """
+    _check_supported(handler)
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for index, item in enumerate(inputs):
+            f.write(json.dumps(request_line(handler, _custom_id(handler, index), item)) + "\n")
+            count += 1
+    return count
+
+def _parse_result_line(handler, line: dict[str, Any]) -> Any:
+    custom_id = line.get("custom_id")
+    if line.get("error"):
+        raise BatchItemError(custom_id, f"request failed: {line['error']}")
+    response = line.get("response") or {}
+    if response.get("status_code") != 200:
+        raise BatchItemError(custom_id, f"request failed with status {response.get('status_code')}: {response.get('body')}")
+    try:
+        content = response["body"]["choices"][0]["message"]["content"]
+        return handler._parse_raw_result(content)
+    except (ValueError, TypeError, KeyError, IndexError) as e:
+        raise BatchItemError(custom_id, f"invalid response: {e}")
+
+def collect(handler, results_path: str, requests_path: Optional[str] = None, retry_path: Optional[str] = None) -> Iterator[tuple[str, Any]]:
+    """
+    Reads a Batch API output file line by line, in constant memory, and yields (custom_id, result) pairs with
+    results typed like a regular call's. A failed item yields a BatchItemError as its result instead.
+    Once the results are exhausted, the requests of failed items are copied from requests_path to retry_path,
+    ready to be submitted again.
+    """
+    if handler._system_message is None:
+        # collecting can happen in a fresh process, where the function was never called or submitted
+        handler._prepare()
+    failed = set()
+    with open(results_path, encoding="utf-8") as f:
+        for raw_line in f:
+            if not raw_line.strip():
+                continue
+            line = json.loads(raw_line)
+            try:
+                result = _parse_result_line(handler, line)
+            except BatchItemError as e:
+                failed.add(line.get("custom_id"))
+                result = e
+            yield line.get("custom_id"), result
+
+    if retry_path is not None:
+        if requests_path is None:
+            raise ValueError("requests_path is needed to write a retry file")
+        _write_retry_file(requests_path, retry_path, failed)
+
+def _write_retry_file(requests_path: str, retry_path: str, failed: set[str]):
+    with open(requests_path, encoding="utf-8") as requests, open(retry_path, "w", encoding="utf-8") as retry:
+        for raw_line in requests:
+            if raw_line.strip() and json.loads(raw_line)["custom_id"] in failed:
+                retry.write(raw_line if raw_line.endswith("\n") else raw_line + "\n")
+
+class LocalBatchProvider():
+    """
+    A local stand-in for a provider's batch endpoint: runs the requests of a Batch API input file through a
+    client and writes a Batch API output file. Useful for tests and for backends without a batch API.
+    """
+    def __init__(self, client, concurrency: int = mapping.DEFAULT_CONCURRENCY):
+        self._client = client
+        self._concurrency = concurrency
+
+    def _run_line(self, raw_line: str) -> dict[str, Any]:
+        request = json.loads(raw_line)
+        result = {"id": f"batch_req_{request['custom_id']}", "custom_id": request["custom_id"], "response": None, "error": None}
+        try:
+            chat_completion = self._client.chat.completions.create(**request["body"])
+        except Exception as e:
+            result["error"] = {"code": type(e).__name__, "message": str(e)}
+            return result
+        result["response"] = {"status_code": 200, "request_id": result["id"], "body": chat_completion.model_dump(mode="json")}
+        return result
+
+    def run(self, requests_path: str, results_path: str):
+        with open(requests_path, encoding="utf-8") as requests, open(results_path, "w", encoding="utf-8") as results:
+            lines = (raw_line for raw_line in requests if raw_line.strip())
+            for result in mapping.map_calls(self._run_line, lines, self._concurrency, ordered=False):
+                if isinstance(result, Exception):
+                    raise result
+                results.write(json.dumps(result) + "\n")
@@ -0,0 +1,139 @@
+from collections import deque
+import threading
+from typing import Any, Callable, Optional
+
+# retries of every model but the last, escalating to the next model takes the place of retrying
+DEFAULT_EARLY_RETRIES = 0
+DEFAULT_SKIP_THRESHOLD = 0.9
+DEFAULT_MIN_SAMPLES = 20
+# while a model is skipped, every this many calls still try it, so that it can come back
+DEFAULT_PROBE_EVERY = 20
+DEFAULT_STATS_WINDOW = 100
+
+class CascadeValidationError(ValueError):
+    """
+    Raised when a model's answer parsed, but the cascade's validator rejected it.
+    """
+
+class CascadePolicy():
+    """
+    How a cascade of models escalates. Models before the last get early_retries parse retries each.
+    A model whose recent calls escalated at least skip_threshold of the time (over at least min_samples calls)
+    is skipped, except for one call in probe_every.
+    """
+    def __init__(self, early_retries: int = DEFAULT_EARLY_RETRIES, skip_threshold: float = DEFAULT_SKIP_THRESHOLD, min_samples: int = DEFAULT_MIN_SAMPLES, probe_every: int = DEFAULT_PROBE_EVERY, window: int = DEFAULT_STATS_WINDOW):
+        self.early_retries = early_retries
+        self.skip_threshold = skip_threshold
+        self.min_samples = min_samples
+        self.probe_every = probe_every
+        self.window = window
+
+class _ModelStats():
+    def __init__(self, window: int):
+        self.calls = 0
+        self.escalations = 0
+        self.skipped = 0
+        self.skip_checks = 0
+        # whether each recent call escalated
+        self.recent = deque(maxlen=window)
+
+    def escalation_rate(self) -> Optional[float]:
+        if not self.recent:
+            return None
+        return sum(self.recent) / len(self.recent)
+
+class Cascade():
+    """
+    Calls an LLM function with a cheap model first, and with the next model only when the answer fails to
+    parse or the validator rejects it. validator takes the parsed result and returns False (or raises ValueError)
+    to reject it.
+    """
+    def __init__(self, handlers: list[Any], validator: Optional[Callable[[Any], bool]] = None, policy: Optional[CascadePolicy] = None):
+        self._handlers = handlers
+        for handler in handlers[:-1]:
+            handler._escalate_on_failure = True
+        self._validator = validator
+        self._policy = policy or CascadePolicy()
+        self._stats = [_ModelStats(self._policy.window) for _ in handlers]
+        self._lock = threading.Lock()
+
+    def _should_skip(self, index: int) -> bool:
+        stats = self._stats[index]
+        rate = stats.escalation_rate()
+        if len(stats.recent) < self._policy.min_samples or rate < self._policy.skip_threshold:
+            return False
+        stats.skip_checks += 1
+        if stats.skip_checks % self._policy.probe_every == 0:
+            return False
+        stats.skipped += 1
+        return True
+
+    def _plan(self) -> list[int]:
+        """
+        The models to try, in order. The last one is never skipped.
+        """
+        last = len(self._handlers) - 1
+        with self._lock:
+            return [index for index in range(last) if not self._should_skip(index)] + [last]
+
+    def _record(self, index: int, escalated: bool):
+        with self._lock:
+            stats = self._stats[index]
+            stats.calls += 1
+            stats.recent.append(escalated)
+            if escalated:
+                stats.escalations += 1
+        if escalated:
+            self._handlers[index].metrics.increment("escalations")
+
+    def _check(self, result: Any):
+        if self._validator is not None and self._validator(result) is False:
+            raise CascadeValidationError(f"The validator rejected {result!r}")
+
+    def _escalate(self, index: int, error: Exception, last: bool):
+        handler = self._handlers[index]
+        if last:
+            self._record(index, False)
+            raise error
+        self._record(index, True)
+        if handler._debug:
+            print(f"\033[93m{handler._model} failed ({error}), escalating to the next model\033[0m")
+
+    def __call__(self, *args, **kwargs):
+        plan = self._plan()
+        for position, index in enumerate(plan):
+            try:
+                result = self._handlers[index](*args, **kwargs)
+                self._check(result)
+            except ValueError as e:
+                self._escalate(index, e, position == len(plan) - 1)
+                continue
+            self._record(index, False)
+            return result
+
+    async def acall(self, *args, **kwargs):
+        plan = self._plan()
+        for position, index in enumerate(plan):
+            try:
+                result = await self._handlers[index](*args, **kwargs)
+                self._check(result)
+            except ValueError as e:
+                self._escalate(index, e, position == len(plan) - 1)
+                continue
+            self._record(index, False)
+            return result
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """
+        Per model: calls answered or escalated, escalations, calls that skipped it, and the recent escalation rate.
+        """
+        with self._lock:
+            return {
+                handler._model: {
+                    "calls": stats.calls,
+                    "escalations": stats.escalations,
+                    "skipped": stats.skipped,
+                    "escalation_rate": stats.escalation_rate(),
+                }
+                for handler, stats in zip(self._handlers, self._stats)
+            }
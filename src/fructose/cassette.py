@@ -0,0 +1,202 @@
+import copy
+import json
+import os
+import re
+import threading
+from types import SimpleNamespace
+from typing import Any, Optional
+import openai
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from . import cache, client_pool
+from .testing import _FakeAsyncStream, _FakeStream
+
+CASSETTE_MODES = ['record', 'replay', 'auto']
+# set to one of CASSETTE_MODES to run tests and evals against cassettes
+CASSETTE_MODE_ENV_VAR = "FRUCTOSE_CASSETTE"
+
+# the seed LLMFunctionHandler._prepare appends to the system message of random functions
+_RANDOM_SEED = re.compile(r"\s*Random seed: .*$", re.DOTALL)
+
+class CassetteMissError(Exception):
+    pass
+
+def _normalize_message(message: Any) -> Any:
+    if type(message) != dict or message.get("role") != "system" or type(message.get("content")) != str:
+        return message
+    return {**message, "content": _RANDOM_SEED.sub("", message["content"])}
+
+def request_key(kwargs: dict[str, Any]) -> str:
+    """
+    Hashes a chat completion request, ignoring the random seed so that random functions replay too.
+    """
+    normalized = {**kwargs, "messages": [_normalize_message(message) for message in kwargs.get("messages", [])]}
+    return cache.fingerprint(**normalized)
+
+class Cassette():
+    """
+    A JSON file of recorded responses, keyed by request_key. A request made several times replays its
+    responses in order, repeating the last one.
+    """
+    def __init__(self, path: str, clear: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._interactions = {}
+        self._replayed = {}
+        if not clear and os.path.exists(path):
+            with open(path) as f:
+                self._interactions = json.load(f)["interactions"]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._interactions
+
+    def play(self, key: str) -> dict[str, Any]:
+        with self._lock:
+            responses = self._interactions[key]["responses"]
+            index = self._replayed.get(key, 0)
+            self._replayed[key] = index + 1
+            return responses[min(index, len(responses) - 1)]
+
+    def record(self, key: str, kwargs: dict[str, Any], response: dict[str, Any]):
+        with self._lock:
+            interaction = self._interactions.setdefault(key, {"request": _describe(kwargs), "responses": []})
+            interaction["responses"].append(response)
+            self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"version": 1, "interactions": self._interactions}, f, indent=1, sort_keys=True, default=repr)
+        os.replace(temporary_path, self.path)
+
+def _describe(kwargs: dict[str, Any]) -> dict[str, Any]:
+    # kept next to the responses, to make cassettes readable and diffable
+    return json.loads(json.dumps(kwargs, default=repr))
+
+class _RecordedStream():
+    """
+    Passes a stream's chunks through and records them once it is exhausted or closed.
+    """
+    def __init__(self, stream, on_done):
+        self._stream = stream
+        self._on_done = on_done
+        self._chunks = []
+        self._done = False
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            self._on_done({"chunks": self._chunks})
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._stream)
+        except StopIteration:
+            self._finish()
+            raise
+        self._chunks.append(chunk.model_dump(mode="json"))
+        return chunk
+
+    def close(self):
+        self._finish()
+        return self._stream.close()
+
+class _RecordedAsyncStream(_RecordedStream):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            self._finish()
+            raise
+        self._chunks.append(chunk.model_dump(mode="json"))
+        return chunk
+
+    async def close(self):
+        self._finish()
+        return await self._stream.close()
+
+class RecordingClient():
+    """
+    Wraps an openai.Client, recording each chat completion to a cassette file and serving them back locally.
+
+    - record: always call the API, starting a fresh cassette
+    - replay: only serve recorded responses, raising CassetteMissError for unknown requests (no client needed)
+    - auto: serve recorded responses, calling the API and recording the ones that are missing
+
+    Usage:
+        ai = Fructose(client=RecordingClient(openai.Client(), "cassettes/my_tests.json"))
+    """
+    def __init__(self, client: Optional[openai.Client], path: str, mode: str = 'auto'):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode {mode}, expected one of {CASSETTE_MODES}")
+        if client is None and mode != 'replay':
+            raise ValueError(f"A client is needed to {mode}")
+        self._client = client
+        self.mode = mode
+        self.cassette = Cassette(path, clear=mode == 'record')
+        self.chat = SimpleNamespace(completions=self)
+
+    def _lookup(self, kwargs: dict[str, Any]) -> tuple[str, Optional[dict[str, Any]]]:
+        key = request_key(kwargs)
+        if self.mode != 'record' and key in self.cassette:
+            return key, self.cassette.play(key)
+        if self.mode == 'replay':
+            raise CassetteMissError(f"No recorded response in {self.cassette.path} for this request, record it with {CASSETTE_MODE_ENV_VAR}=auto")
+        return key, None
+
+    def _replay(self, recorded: dict[str, Any], async_stream: bool = False):
+        if "chunks" in recorded:
+            chunks = [ChatCompletionChunk.model_validate(chunk) for chunk in recorded["chunks"]]
+            return _FakeAsyncStream(chunks) if async_stream else _FakeStream(chunks)
+        return ChatCompletion.model_validate(recorded["completion"])
+
+    def _record(self, key: str, kwargs: dict[str, Any], response: Any, async_stream: bool = False):
+        if kwargs.get("stream"):
+            stream_class = _RecordedAsyncStream if async_stream else _RecordedStream
+            return stream_class(response, lambda recorded: self.cassette.record(key, kwargs, recorded))
+        self.cassette.record(key, kwargs, {"completion": response.model_dump(mode="json")})
+        return response
+
+    def create(self, **kwargs):
+        kwargs = copy.deepcopy(kwargs)
+        key, recorded = self._lookup(kwargs)
+        if recorded is not None:
+            return self._replay(recorded)
+        return self._record(key, kwargs, self._client.chat.completions.create(**kwargs))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._client, name)
+
+class AsyncRecordingClient(RecordingClient):
+    """
+    The async version of RecordingClient, wrapping an openai.AsyncClient.
+    """
+    async def create(self, **kwargs):
+        kwargs = copy.deepcopy(kwargs)
+        key, recorded = self._lookup(kwargs)
+        if recorded is not None:
+            return self._replay(recorded, async_stream=True)
+        response = await self._client.chat.completions.create(**kwargs)
+        return self._record(key, kwargs, response, async_stream=True)
+
+def client_from_env(path: str, client: Optional[openai.Client] = None) -> Optional[Any]:
+    """
+    Wraps client in a RecordingClient if FRUCTOSE_CASSETTE is set to a cassette mode, otherwise returns it as is.
+    Outside of replay mode, a missing client is taken from the default client pool.
+    """
+    mode = os.environ.get(CASSETTE_MODE_ENV_VAR)
+    if not mode:
+        return client
+    if client is None and mode != 'replay':
+        client = client_pool.default_pool.get()
+    return RecordingClient(client, path, mode)
@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+import contextvars
+import importlib.util
+import os
+import threading
+from typing import Any, Optional
+import openai
+
+try:
+    import httpx
+except ImportError:
+    # newer openai releases are built on httpx2, which keeps httpx's API
+    import httpx2 as httpx
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+# seconds an idle connection is kept open for reuse
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+# (client, api_key, base_url, pool) set by use_client for the calls made inside it
+_override = contextvars.ContextVar("fructose_client_override", default=None)
+
+def http2_available() -> bool:
+    """
+    Whether the h2 package, which httpx needs for HTTP/2, is installed.
+    """
+    return importlib.util.find_spec("h2") is not None
+
+class ClientPool():
+    """
+    Shares openai clients, and so their connection pools and TLS sessions, between every Fructose instance and
+    decorated function of a process. One sync and one async client is kept per (base_url, api_key).
+    HTTP/2 is used when the h2 package is installed, unless http2 is set.
+
+    Usage:
+        pool = ClientPool(max_connections=200, keepalive_expiry=60)
+        ai = Fructose(client=pool.get(api_key=tenant_key), async_client=pool.get_async(api_key=tenant_key), client_pool=pool)
+    """
+    def __init__(self, max_connections: int = DEFAULT_MAX_CONNECTIONS, max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS, keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY, http2: Optional[bool] = None, **client_kwargs: Any):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2_available() if http2 is None else http2
+        # passed on to openai.Client / openai.AsyncClient, e.g. timeout or max_retries
+        self._client_kwargs = client_kwargs
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def limits(self) -> "httpx.Limits":
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+    def _key(self, api_key: Optional[str], base_url: Optional[str], is_async: bool) -> tuple:
+        if api_key is None:
+            api_key = os.environ['OPENAI_API_KEY']
+        if base_url is None:
+            base_url = os.environ.get("OPENAI_BASE_URL")
+        return (base_url, api_key, is_async)
+
+    def _create(self, key: tuple):
+        base_url, api_key, is_async = key
+        if is_async:
+            http_client = openai.DefaultAsyncHttpxClient(limits=self.limits(), http2=self.http2)
+            return openai.AsyncClient(api_key=api_key, base_url=base_url, http_client=http_client, **self._client_kwargs)
+        http_client = openai.DefaultHttpxClient(limits=self.limits(), http2=self.http2)
+        return openai.Client(api_key=api_key, base_url=base_url, http_client=http_client, **self._client_kwargs)
+
+    def _get(self, api_key: Optional[str], base_url: Optional[str], is_async: bool):
+        key = self._key(api_key, base_url, is_async)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = self._create(key)
+        return client
+
+    def get(self, api_key: Optional[str] = None, base_url: Optional[str] = None) -> openai.Client:
+        """
+        The shared openai.Client for base_url and api_key, by default OPENAI_BASE_URL and OPENAI_API_KEY.
+        """
+        return self._get(api_key, base_url, False)
+
+    def get_async(self, api_key: Optional[str] = None, base_url: Optional[str] = None) -> openai.AsyncClient:
+        """
+        The shared openai.AsyncClient for base_url and api_key. Like any httpx async client, it should only be
+        used from one event loop.
+        """
+        return self._get(api_key, base_url, True)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def close(self):
+        """
+        Closes the sync clients and forgets every client. Async clients are dropped without being closed,
+        since that needs their event loop; await their close() first if it matters.
+        """
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for (_, _, is_async), client in clients.items():
+            if not is_async:
+                client.close()
+
+default_pool = ClientPool()
+
+@contextmanager
+def use_client(client: Any = None, *, api_key: Optional[str] = None, base_url: Optional[str] = None, pool: Optional[ClientPool] = None):
+    """
+    Makes the LLM function calls inside the block use client, or the pool's client for api_key and base_url,
+    instead of their Fructose's client. For multi-tenant services, where each request brings its own key.
+    The override follows contextvars, so it applies to the current thread or task and to `map` calls.
+
+    Usage:
+        with use_client(api_key=tenant.api_key):
+            summary = summarize(text)
+    """
+    if client is not None and (api_key is not None or base_url is not None):
+        raise ValueError("Pass either a client or an api_key and base_url, not both")
+    token = _override.set((client, api_key, base_url, pool))
+    try:
+        yield
+    finally:
+        _override.reset(token)
+
+def resolve(default: Any, is_async: bool = False) -> Any:
+    """
+    The client a call should use: the one set by use_client, if any, otherwise default.
+    """
+    override = _override.get()
+    if override is None:
+        return default
+    client, api_key, base_url, pool = override
+    if client is not None:
+        return client
+    if pool is None:
+        pool = default_pool
+    return pool.get_async(api_key, base_url) if is_async else pool.get(api_key, base_url)
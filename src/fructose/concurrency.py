@@ -0,0 +1,89 @@
+from collections import deque
+import time
+from typing import Any, Optional
+
+DEFAULT_INITIAL_LIMIT = 8
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 256
+DEFAULT_BACKOFF = 0.5
+# how many times slower than the baseline the smoothed latency may get before the limit backs off
+DEFAULT_LATENCY_TOLERANCE = 2.0
+DEFAULT_SMOOTHING = 0.2
+DEFAULT_MAX_DECISIONS = 100
+# how fast the baseline latency drifts up towards slower observations, so it follows a backend that got slower
+BASELINE_DRIFT = 0.01
+
+class ConcurrencyPolicy():
+    """
+    How an AdaptiveLimit moves: it adds one to the limit per limit's worth of healthy calls, and multiplies it
+    by backoff on a 429, a 5xx, or when the smoothed latency exceeds latency_tolerance times the baseline.
+    """
+    def __init__(self, initial_limit: int = DEFAULT_INITIAL_LIMIT, min_limit: int = DEFAULT_MIN_LIMIT, max_limit: int = DEFAULT_MAX_LIMIT, backoff: float = DEFAULT_BACKOFF, latency_tolerance: float = DEFAULT_LATENCY_TOLERANCE, smoothing: float = DEFAULT_SMOOTHING, max_decisions: int = DEFAULT_MAX_DECISIONS):
+        if not min_limit <= initial_limit <= max_limit:
+            raise ValueError("initial_limit must be between min_limit and max_limit")
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.max_decisions = max_decisions
+
+class AdaptiveLimit():
+    """
+    An AIMD limit on the in-flight calls to one backend, driven by the latency and errors of finished calls.
+    Not thread safe, the scheduler calls it under its lock.
+    """
+    def __init__(self, policy: ConcurrencyPolicy):
+        self.policy = policy
+        self._limit = float(policy.initial_limit)
+        self.latency = None
+        self.baseline_latency = None
+        self._last_decrease = None
+        # the most recent changes of the limit, as dicts of time, action, limit and reason
+        self.decisions = deque(maxlen=policy.max_decisions)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _decide(self, action: str, reason: str, now: float):
+        self.decisions.append({"time": now, "action": action, "limit": self.limit, "reason": reason})
+
+    def on_success(self, latency: float, in_flight: int, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += (latency - self.latency) * self.policy.smoothing
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency += (latency - self.baseline_latency) * BASELINE_DRIFT
+
+        if self.latency > self.policy.latency_tolerance * self.baseline_latency:
+            self._decrease(f"latency {self.latency:.3f}s over baseline {self.baseline_latency:.3f}s", now)
+        elif in_flight >= self.limit - 1 and self._limit < self.policy.max_limit:
+            # only grow a limit that is actually used
+            previous = self.limit
+            self._limit = min(float(self.policy.max_limit), self._limit + 1 / self._limit)
+            if self.limit > previous:
+                self._decide("increase", "healthy", now)
+
+    def on_overload(self, reason: str, now: Optional[float] = None):
+        self._decrease(reason, time.monotonic() if now is None else now)
+
+    def _decrease(self, reason: str, now: float):
+        # calls sent together fail together, so back off at most once per smoothed latency
+        if self._last_decrease is not None and now - self._last_decrease < (self.latency or 0.0):
+            return
+        self._last_decrease = now
+        self._limit = max(float(self.policy.min_limit), self._limit * self.policy.backoff)
+        self._decide("decrease", reason, now)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "latency": self.latency,
+            "baseline_latency": self.baseline_latency,
+        }
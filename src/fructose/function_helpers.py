@@ -1,6 +1,7 @@
 import inspect
 from typing import Any, Callable
 import typing
+from . import type_parser
 
 ALLOWED_PARAMETER_KINDS = [
     inspect.Parameter.POSITIONAL_OR_KEYWORD,
@@ -29,51 +30,25 @@ def collect_arguments(func, args, kwargs) -> dict[str, Any]:
 
     return arguments
 
-def _convert_type_to_openai_type(type_: type) -> dict[str, Any]:
-    _lookup = {
-        str: "string",
-        int: "number",
-        float: "number",
-        list: "array",
-        dict: "object",
-        bool: "boolean"
-    }
-
-    openai_type = {}
-
-    origined_type = typing.get_origin(type_) or type_
-    if origined_type in _lookup:
-        name = _lookup[origined_type]
-        openai_type["type"] = name
-    else:
-        raise ValueError(f"Unsupported type: {type_}")
-
-    if origined_type == list:
-        args = typing.get_args(type_)
-        openai_type["items"] = _convert_type_to_openai_type(args[0])
-
-    if origined_type == dict:
-        args = typing.get_args(type_)
-        openai_type["additionalProperties"] = _convert_type_to_openai_type(args[1])
-
-    return openai_type
-
-
 def convert_function_to_openai_function(func: Callable) -> dict[str, Any]:
     """
     Converts a function to an OpenAI function.
     """
+    type_hints = typing.get_type_hints(func)
+    parameters = inspect.signature(func).parameters
+    try:
+        # the same schema as the function's own structured output would use for these types
+        schema = type_parser.object_json_schema(
+            {name: type_hints.get(name, param.annotation) for name, param in parameters.items()},
+            required=[name for name, param in parameters.items() if param.default is inspect.Parameter.empty],
+        )
+    except type_parser.InvalidTypeException as e:
+        raise ValueError(f"Unsupported parameter type in {func.__name__}: {e}")
     return {
         "type": "function",
         "function": {
             "name": func.__name__,
             "description": func.__doc__,
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    name: _convert_type_to_openai_type(param.annotation)
-                    for name, param in inspect.signature(func).parameters.items()
-                }
-            }
+            "parameters": schema,
         }
     }
@@ -0,0 +1,225 @@
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextvars
+import math
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+DEFAULT_HEDGE_PERCENTILE = 95
+# completions observed before a HedgePolicy starts hedging
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_LATENCY_WINDOW = 200
+DEFAULT_MAX_ATTEMPTS = 2
+DEFAULT_SPECULATIVE_ATTEMPTS = 2
+# threads running the attempts of sync hedged calls, shared by every function
+MAX_HEDGE_THREADS = 64
+
+class LatencyWindow():
+    """
+    The latencies of a function's most recent completions.
+    """
+    def __init__(self, size: int = DEFAULT_LATENCY_WINDOW):
+        self._latencies = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def observe(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Nearest-rank percentile, p in [0, 100].
+        """
+        ordered = sorted(self._latencies)
+        if not ordered:
+            return None
+        return ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1]
+
+class HedgePolicy():
+    """
+    Sends a duplicate request once a completion has taken longer than `percentile` of the function's recent
+    completions, up to max_attempts in all, and keeps whichever valid answer arrives first.
+    Nothing is hedged until min_samples completions were observed.
+    """
+    def __init__(self, percentile: float = DEFAULT_HEDGE_PERCENTILE, max_attempts: int = DEFAULT_MAX_ATTEMPTS, min_samples: int = DEFAULT_MIN_SAMPLES):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        if not 0 <= percentile <= 100:
+            raise ValueError("percentile must be in [0, 100]")
+        self.percentile = percentile
+        self.max_attempts = max_attempts
+        self.min_samples = min_samples
+
+    def delays(self, latencies: LatencyWindow) -> list[float]:
+        """
+        The seconds after the start of the call at which each attempt is sent.
+        """
+        if len(latencies) < self.min_samples:
+            return [0.0]
+        delay = latencies.percentile(self.percentile)
+        return [attempt * delay for attempt in range(self.max_attempts)]
+
+class SpeculativePolicy():
+    """
+    Sends `attempts` requests at once and keeps the first valid answer.
+    """
+    def __init__(self, attempts: int = DEFAULT_SPECULATIVE_ATTEMPTS):
+        if attempts < 1:
+            raise ValueError("attempts must be at least 1")
+        self.attempts = attempts
+
+    def delays(self, latencies: LatencyWindow) -> list[float]:
+        return [0.0] * self.attempts
+
+class Race():
+    """
+    The attempts of one hedged completion: when each is sent, which results are acceptable, and
+    on_finished(index, seconds, result, won), called for every attempt that completes, even after the race.
+    won is whether the call uses the result, and result is None when the attempt raised.
+    """
+    def __init__(self, delays: list[float], accept: Callable[[Any], bool], on_finished: Callable[[int, float, Any, bool], None]):
+        self.delays = delays
+        self.accept = accept
+        self.on_finished = on_finished
+        # how many attempts were sent, set once the race is over
+        self.launched = 0
+        # the first unacceptable result, used if no attempt is acceptable
+        self._fallback = None
+
+    def _finished(self, index: int, seconds: float, result: Any) -> bool:
+        """
+        Reports a completed attempt, returning whether it wins the race.
+        """
+        if self.accept(result):
+            self.on_finished(index, seconds, result, True)
+            if self._fallback is not None:
+                self.on_finished(*self._fallback, False)
+                self._fallback = None
+            return True
+        if self._fallback is None:
+            self._fallback = (index, seconds, result)
+        else:
+            self.on_finished(index, seconds, result, False)
+        return False
+
+    def _use_fallback(self, error: Optional[Exception]) -> Any:
+        if self._fallback is None:
+            raise error
+        self.on_finished(*self._fallback, True)
+        return self._fallback[2]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_HEDGE_THREADS, thread_name_prefix="fructose-hedge")
+        return _executor
+
+def _timed(create: Callable[[], Any]) -> tuple[Any, float]:
+    start = time.perf_counter()
+    return create(), time.perf_counter() - start
+
+def _finish_late(race: Race, index: int):
+    def finish(future):
+        if future.cancelled():
+            return
+        try:
+            result, seconds = future.result()
+        except Exception:
+            race.on_finished(index, 0.0, None, False)
+            return
+        race.on_finished(index, seconds, result, False)
+    return finish
+
+def run(race: Race, create: Callable[[], Any]) -> Any:
+    """
+    Runs the attempts of a race on threads and returns the first acceptable result. If none is acceptable,
+    returns the first result, or raises the first error if every attempt failed. Losers that haven't started are
+    cancelled; running ones finish in the background, since a sync request can't be interrupted.
+    """
+    if len(race.delays) == 1:
+        try:
+            result, seconds = _timed(create)
+        except Exception:
+            race.launched = 1
+            race.on_finished(0, 0.0, None, False)
+            raise
+        race.launched = 1
+        race.on_finished(0, seconds, result, True)
+        return result
+
+    start = time.monotonic()
+    executor = _get_executor()
+    pending = {}
+    launched = 0
+    error = None
+    try:
+        while True:
+            elapsed = time.monotonic() - start
+            # the next attempt goes out on schedule, or right away once the earlier ones all failed
+            while launched < len(race.delays) and (race.delays[launched] <= elapsed or not pending):
+                # a copy of the caller's context, so use_client and priorities apply to every attempt
+                pending[executor.submit(contextvars.copy_context().run, _timed, create)] = launched
+                launched += 1
+            timeout = None if launched == len(race.delays) else max(0.0, race.delays[launched] - elapsed)
+            done, _ = wait(pending, timeout, FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    result, seconds = future.result()
+                except Exception as e:
+                    error = error or e
+                    race.on_finished(index, 0.0, None, False)
+                    continue
+                if race._finished(index, seconds, result):
+                    return result
+            if not pending and launched == len(race.delays):
+                return race._use_fallback(error)
+    finally:
+        race.launched = launched
+        for future, index in pending.items():
+            if not future.cancel():
+                future.add_done_callback(_finish_late(race, index))
+
+async def arun(race: Race, create: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    The async version of run. Losing attempts are cancelled.
+    """
+    async def timed():
+        start = time.perf_counter()
+        return await create(), time.perf_counter() - start
+
+    start = time.monotonic()
+    pending = {}
+    launched = 0
+    error = None
+    try:
+        while True:
+            elapsed = time.monotonic() - start
+            while launched < len(race.delays) and (race.delays[launched] <= elapsed or not pending):
+                pending[asyncio.ensure_future(timed())] = launched
+                launched += 1
+            timeout = None if launched == len(race.delays) else max(0.0, race.delays[launched] - elapsed)
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                try:
+                    result, seconds = task.result()
+                except Exception as e:
+                    error = error or e
+                    race.on_finished(index, 0.0, None, False)
+                    continue
+                if race._finished(index, seconds, result):
+                    return result
+            if not pending and launched == len(race.delays):
+                return race._use_fallback(error)
+    finally:
+        race.launched = launched
+        for task in pending:
+            task.cancel()
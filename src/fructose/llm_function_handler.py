@@ -1,16 +1,25 @@
-
+from collections import Counter
+from concurrent.futures import Executor
+from functools import partial
 import inspect
 import json
 import os
-from typing import Any, Callable, Optional, Type, TypeVar, get_type_hints
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Optional, TypeVar, get_args, get_origin, get_type_hints
 import openai
 import jinja2
 from openai.types.chat import ChatCompletionAssistantMessageParam, ChatCompletionSystemMessageParam, ChatCompletionToolMessageParam, ChatCompletionUserMessageParam
-from . import function_helpers, type_parser, types
+from . import cache, client_pool, function_helpers, hedging, metrics, repair, serializer, streaming, tools, tracing, type_parser, types
+from . import scheduler as scheduling
 
 
 T = TypeVar('T')
 DEFAULT_RETRIES = 3
+RETRY_STRATEGIES = ['compact', 'full']
+JSON_OBJECT_RESPONSE_FORMAT = {
+    "type": "json_object",
+}
 
 def _validate_return_type_for_function(func_name, return_type):
     """
@@ -22,13 +31,121 @@ def _validate_return_type_for_function(func_name, return_type):
     if not type_parser.is_supported_return_type(return_type):
         raise NotImplementedError("Fructose does not support return type " + type_parser.type_to_string(return_type) + " yet. Please use int, str, float, bool, or generic types.")
 
-def _parse_llm_result(result: str, return_type: Type[T]) -> T:
+def random_seed_message() -> str:
+    """
+    Appended to the system message of 'random' functions, so that their answers vary.
+    """
+    return "\n\nRandom seed: " + str(os.urandom(16)) + "\n\n"
+
+def _parse_llm_result(result: str, parse_result: Callable[[Any], T]) -> T:
     json_result = json.loads(result)
+    if type(json_result) != dict:
+        raise ValueError(f"Expected a json object with a response, got {result}")
     if 'response' not in json_result:
         raise ValueError("response not in json_result")
     res = json_result['response']
 
-    return type_parser.parse_json_to_type(res, return_type) 
+    return parse_result(res)
+
+def _rejects_structured_outputs(error: openai.BadRequestError) -> bool:
+    """
+    Whether a 400 is about the json_schema response format, rather than e.g. the context length or a tool.
+    """
+    if error.param is not None:
+        return error.param.startswith("response_format")
+    message = str(error.message).lower()
+    return "response_format" in message or "json_schema" in message
+
+class _Completion():
+    """
+    A chat completion request, yielded by the handler's steps and executed by the driver.
+    """
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        # a hedging.Race when the completion is hedged
+        self.race = None
+
+class _ToolCalls():
+    """
+    A batch of tool calls from a single model turn, yielded by the handler's steps and executed by the driver.
+    """
+    def __init__(self, tool_calls, on_done=None):
+        self.tool_calls = tool_calls
+        self.on_done = on_done
+
+class _NextChunk():
+    """
+    A request for the next chunk of a streamed completion, or None once it is exhausted.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+class _CloseStream():
+    """
+    A request to cancel a streamed completion.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+class _Emit():
+    """
+    A streamed result to hand to the caller.
+    """
+    def __init__(self, value):
+        self.value = value
+
+class _StreamedToolCall():
+    """
+    A tool call assembled from the deltas of a streamed completion.
+    """
+    def __init__(self):
+        self.id = None
+        self.function = SimpleNamespace(name="", arguments="")
+
+    def add(self, delta):
+        if delta.id:
+            self.id = delta.id
+        if delta.function is not None:
+            self.function.name += delta.function.name or ""
+            self.function.arguments += delta.function.arguments or ""
+
+def _tool_call_param(tool_call):
+    return {
+        "id": tool_call.id,
+        "type": "function",
+        "function": {
+            "name": tool_call.function.name,
+            "arguments": tool_call.function.arguments,
+        },
+    }
+
+def _failing_element(raw_result, error, return_type):
+    """
+    Finds the shallowest list or dict element containing a parse error, returning the parsed response, the
+    element's path and its type, or None if the error isn't inside an element.
+    """
+    path = getattr(error, "path", ())
+    try:
+        response = json.loads(raw_result)['response']
+    except (ValueError, TypeError, KeyError):
+        return None
+
+    for depth in range(len(path)):
+        container_type = type_parser.type_at_path(return_type, path[:depth])
+        if type_parser._is_optional(container_type):
+            container_type = next(arg for arg in get_args(container_type) if arg is not type(None))
+        if get_origin(container_type) in (list, dict):
+            element_path = path[:depth + 1]
+            return response, element_path, type_parser.type_at_path(return_type, element_path)
+    return None
+
+def _record_usage(span, usage):
+    if usage is None:
+        return
+    span.set_attribute("prompt_tokens", getattr(usage, "prompt_tokens", None))
+    span.set_attribute("completion_tokens", getattr(usage, "completion_tokens", None))
+    details = getattr(usage, "prompt_tokens_details", None)
+    span.set_attribute("cached_tokens", getattr(details, "cached_tokens", None))
 
 class LLMFunctionHandler():
     def __init__(
@@ -41,13 +158,54 @@ class LLMFunctionHandler():
         system_template: jinja2.Template,
         chain_of_thought_template: jinja2.Template,
         debug: bool,
-        retries: int = DEFAULT_RETRIES
+        retries: int = DEFAULT_RETRIES,
+        response_cache: Optional[cache.ResponseCache] = None,
+        tool_executor: Optional[Executor] = None,
+        tool_timeout: Optional[float] = None,
+        fail_fast: bool = False,
+        max_output_chars: Optional[int] = None,
+        structured_outputs: bool = False,
+        repair_level: repair.RepairLevel = 'strict',
+        retry_strategy: str = 'compact',
+        max_argument_tokens: Optional[int] = None,
+        metrics_registry: Optional[metrics.MetricsRegistry] = None,
+        tracer: Optional[tracing.Tracer] = None,
+        scheduler: Optional[scheduling.Scheduler] = None,
+        max_concurrency: Optional[int] = None,
+        hedging_policy: Optional[Any] = None
     ):
         self._client = client
         self._model = model
         self._func = func
+        # names the function in metrics and the scheduler's bulkheads, unique across modules
+        self._function_key = f"{func.__module__}.{func.__qualname__}"
         self._uses = uses
-        self._uses_lookup = {func.__name__: func for func in uses} if uses else {}
+        self._tool_registry = tools.ToolRegistry(uses)
+        self._tool_executor = tool_executor
+        self._tool_timeout = tool_timeout
+        self._fail_fast = fail_fast
+        self._max_output_chars = max_output_chars
+        self._structured_outputs = structured_outputs
+        self._response_format = JSON_OBJECT_RESPONSE_FORMAT
+        if repair_level not in repair.REPAIR_LEVELS:
+            raise ValueError(f"Unknown repair level {repair_level}, expected one of {repair.REPAIR_LEVELS}")
+        self._repair_level = repair_level
+        if retry_strategy not in RETRY_STRATEGIES:
+            raise ValueError(f"Unknown retry strategy {retry_strategy}, expected one of {RETRY_STRATEGIES}")
+        self._retry_strategy = retry_strategy
+        self._max_argument_tokens = max_argument_tokens
+        self._metrics_registry = metrics_registry or metrics.registry
+        self._tracer = tracer
+        self._scheduler = scheduler
+        # the most calls of this function the scheduler lets run at once
+        self._max_concurrency = max_concurrency
+        # a hedging.HedgePolicy or hedging.SpeculativePolicy for the answer's completions
+        self._hedging_policy = hedging_policy
+        self._latencies = hedging.LatencyWindow()
+        # set by a cascade on every model but the last, so a failed parse escalates instead of returning None
+        self._escalate_on_failure = False
+        # how often each local repair was applied, see repair.repair_llm_result
+        self.repairs = Counter()
         self._flavors = flavors
         self._debug = debug
         self._system_template = system_template
@@ -55,43 +213,74 @@ class LLMFunctionHandler():
         self._system_message = None
         self._chain_of_thought_message = None
         self._return_annotation = None
+        self._result_parser = None
+        self._return_type_string = None
         self._retries = retries
+        self._response_cache = response_cache
 
         # if the return annotation is a string, then it's a forward reference and we can't validate it
         return_annotation = inspect.signature(func).return_annotation
         if not isinstance(return_annotation, str):
             _validate_return_type_for_function(func.__name__, return_annotation)
-            
-        
+
+
     def _prepare(self):
+        """
+        Resolves the return type and renders the prompts. Everything is built first and assigned at once, with
+        the system message last since it marks the handler as prepared, so concurrent first calls and warmup()
+        can all run it without a lock.
+        """
         type_hints = get_type_hints(self._func)
-        self._return_annotation = type_hints.get('return', inspect.Signature.empty)
-        _validate_return_type_for_function(self._func.__name__, self._return_annotation)
-
-        return_type_str = type_parser.type_to_string(self._return_annotation)
-    
-        self._system_message = self._system_template.render(
+        return_annotation = type_hints.get('return', inspect.Signature.empty)
+        _validate_return_type_for_function(self._func.__name__, return_annotation)
+        result_parser = type_parser.compile_parser(return_annotation)
+        return_type_str = type_parser.type_to_string(return_annotation)
+
+        response_format = self._response_format
+        if self._structured_outputs:
+            schema = type_parser.response_json_schema(return_annotation)
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": self._func.__name__,
+                    "schema": schema,
+                    "strict": type_parser.is_strict_json_schema(schema),
+                },
+            }
+
+        system_message = self._system_template.render(
             func_doc_string=self._func.__doc__,
             return_type_string=return_type_str
         ).strip()
 
         if 'random' in self._flavors:
-            self._system_message += "\n\nRandom seed: " + str(os.urandom(16)) + "\n\n"
+            system_message += random_seed_message()
 
-        self._chain_of_thought_message = self._chain_of_thought_template.render(
+        chain_of_thought_message = self._chain_of_thought_template.render(
             func_doc_string=self._func.__doc__,
             return_type_string=return_type_str,
             available_tools_string=str(self._tools)
         ).strip()
 
+        self._return_annotation = return_annotation
+        self._result_parser = result_parser
+        self._return_type_string = return_type_str
+        self._response_format = response_format
+        self._chain_of_thought_message = chain_of_thought_message
+        self._system_message = system_message
+
+    @property
+    def metrics(self) -> metrics.FunctionMetrics:
+        return self._metrics_registry.get(self._function_key, self._model)
+
+    def _span(self, name, **attributes):
+        if self._tracer is None:
+            return tracing.NOOP_SPAN
+        return tracing.start_active_span(self._tracer, name, **attributes)
+
     @property
     def _tools(self):
-        if self._uses == None or self._uses == []:
-            return None
-        return [
-            function_helpers.convert_function_to_openai_function(func)
-            for func in self._uses
-        ]
+        return self._tool_registry.schemas
 
     def _call_chain_of_thought(self, messages):
         assert self._chain_of_thought_message is not None
@@ -110,81 +299,236 @@ class LLMFunctionHandler():
                 last_non_tool_message = i
         messages = messages[:last_non_tool_message + 1]
 
-        chat_completion = self._client.chat.completions.create(
-            model=self._model,
-            messages=messages,
-        )
+        chat_completion = yield from self._request(phase="chain_of_thought", messages=messages)
 
         message = chat_completion.choices[0].message
 
         return message.content
 
+    def _print_messages(self, messages):
+        for message in messages:
+            if message['role'] == "system":
+                # print color: blue
+                print(f"\033[94mSystem: {message['content']}\033[0m")
+            elif message['role'] == "user":
+                # print color: green
+                print(f"\033[92mUser: {message['content']}\033[0m")
+            elif message['role'] == "assistant" and 'tool_calls' in message:
+                # print color: red
+                print(f"\033[91mTools: {message['tool_calls']}\033[0m")
+            else:
+                # purple other
+                print(f"\033[95mOther: {message}\033[0m")
+
+    def _add_chain_of_thought(self, messages):
+        if "chain_of_thought" not in self._flavors:
+            return messages
+
+        with self._span("chain_of_thought"):
+            result = yield from self._call_chain_of_thought(messages)
+        return [
+            *messages,
+            ChatCompletionAssistantMessageParam(
+                role="assistant",
+                content=result,
+            ),
+            ChatCompletionUserMessageParam(
+                role="user",
+                content="using the above reasoning, either call a function or reply in the format requested"
+            )
+        ]
 
-    # TODO this function is way too long
-    def _perform_llm_reasoning(self, messages):
-        if "chain_of_thought" in self._flavors:
-            result = self._call_chain_of_thought(messages)
-            messages = [
-                *messages,
-                ChatCompletionAssistantMessageParam(
-                    role="assistant",
-                    content=result,
-                ),
-                ChatCompletionUserMessageParam(
-                    role="user",
-                    content="using the above reasoning, either call a function or reply in the format requested"
-                )
-            ]
-
+    def _call_tools(self, messages, tool_calls):
+        messages = [*messages, {
+            "role": "assistant",
+            "tool_calls": [_tool_call_param(tool_call) for tool_call in tool_calls],
+        }]
         if self._debug:
-            for message in messages:
-                if message['role'] == "system":
-                    # print color: blue
-                    print(f"\033[94mSystem: {message['content']}\033[0m")
-                elif message['role'] == "user":
-                    # print color: green
-                    print(f"\033[92mUser: {message['content']}\033[0m")
-                elif message['role'] == "assistant" and 'tool_calls' in message:
-                    # print color: red
-                    print(f"\033[91mTools: {message['tool_calls']}\033[0m")
-                else:
-                    # purple other
-                    print(f"\033[95mOther: {message}\033[0m")
+            print(f"\033[91mTool Calls: {tool_calls}\033[0m")
+
+        start = time.perf_counter()
+        with self._span("tools", tool_calls=len(tool_calls)) as span:
+            results = yield _ToolCalls(tool_calls, self._tool_span_recorder(span, tool_calls))
+        self.metrics.observe("tools", time.perf_counter() - start)
+        self.metrics.increment("tool_calls", len(tool_calls))
+        for tool_call, result in zip(tool_calls, results):
+            tool_message = ChatCompletionToolMessageParam(
+                role="tool",
+                content=json.dumps(result),
+                tool_call_id=tool_call.id,
+            )
+            messages = [*messages, tool_message]
 
-        chat_completion = self._client.chat.completions.create(
-            model=self._model,
-            messages=messages,
-            tools=self._tools,
-            response_format={
-                "type":"json_object",
-            },
-        )
+        return messages
 
-        message = chat_completion.choices[0].message
-        result = message.content
-        tool_calls = message.tool_calls
+    def _tool_span_recorder(self, parent, tool_calls):
+        """
+        Returns an on_done callback for ToolRegistry.run that records a span for each tool call.
+        """
+        if self._tracer is None:
+            return None
 
-        if tool_calls:
-            messages = [*messages, {
-                "role": "assistant",
-                "tool_calls": tool_calls,
-            }]
+        def record(index, duration, result):
+            end_time = time.time()
+            span = self._tracer.start_span(
+                "tool",
+                parent,
+                end_time - duration,
+                tool=tool_calls[index].function.name,
+                tool_call_id=tool_calls[index].id,
+            )
+            if type(result) == dict and "error" in result:
+                span.outcome = "error"
+                span.set_attribute("error", result["error"])
+            span.end(end_time)
+        return record
+
+    def _read_stream(self, consume, phase="completion", **kwargs):
+        """
+        Requests a streamed completion and passes its content to consume as it arrives, emitting whatever consume
+        returns. If consume raises StreamValidationError, the stream is cancelled and the partial content returned.
+        """
+        with self._span("completion", phase=phase, model=self._model, stream=True) as span:
+            return (yield from self._read_stream_in_span(span, consume, phase, **kwargs))
+
+    def _read_stream_in_span(self, span, consume, phase, **kwargs):
+        start = time.perf_counter()
+        stream = yield from self._request_with_fallback(stream=True, stream_options={"include_usage": True}, **kwargs)
+
+        content = []
+        tool_calls = {}
+        while True:
+            chunk = yield _NextChunk(stream)
+            if chunk is None:
+                break
+            usage = getattr(chunk, "usage", None)
+            self.metrics.record_usage(usage)
+            _record_usage(span, usage)
+            if not chunk.choices:
+                continue
+
+            delta = chunk.choices[0].delta
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(tool_call_delta.index, _StreamedToolCall())
+                tool_call.add(tool_call_delta)
+            if delta.content:
+                content.append(delta.content)
+                try:
+                    items = consume(delta.content)
+                except streaming.StreamValidationError as e:
+                    if self._debug:
+                        print(f"\033[91mCancelled generation: {e}\033[0m")
+                    span.set_attribute("cancelled", str(e))
+                    yield _CloseStream(stream)
+                    break
+                for item in items:
+                    yield _Emit(item)
+
+        self.metrics.observe(phase, time.perf_counter() - start)
+        tool_calls = [tool_calls[index] for index in sorted(tool_calls)] or None
+        return "".join(content) or None, tool_calls
+
+    def _complete(self, phase="completion", **kwargs):
+        """
+        Requests a completion for the final answer, returning its content and tool calls.
+        With fail_fast, the answer is streamed and validated against the return type as it is generated.
+        """
+        if self._fail_fast:
+            validator = streaming.StreamValidator(self._return_annotation, self._max_output_chars)
+            return (yield from self._read_stream(validator.feed, phase, **kwargs))
+
+        chat_completion = yield from self._request(phase=phase, hedged=self._hedging_policy is not None, **kwargs)
+        message = chat_completion.choices[0].message
+        return message.content, message.tool_calls
+
+    def _request(self, phase="completion", hedged=False, **kwargs):
+        """
+        Requests a completion, recording its latency and token usage under phase.
+        """
+        start = time.perf_counter()
+        with self._span("completion", phase=phase, model=self._model) as span:
+            chat_completion = yield from self._request_with_fallback(hedged, **kwargs)
+            usage = getattr(chat_completion, "usage", None)
+            _record_usage(span, usage)
+        self.metrics.observe(phase, time.perf_counter() - start)
+        self.metrics.record_usage(usage)
+        return chat_completion
+
+    def _completion_request(self, hedged, kwargs):
+        request = _Completion(model=self._model, **kwargs)
+        if hedged:
+            delays = self._hedging_policy.delays(self._latencies)
+            request.race = hedging.Race(delays, self._acceptable, self._attempt_finished)
+        return request
+
+    def _acceptable(self, chat_completion):
+        """
+        Whether a hedged attempt's answer is usable: it calls tools, or it parses, possibly after local repairs.
+        """
+        message = chat_completion.choices[0].message
+        if message.tool_calls:
+            return True
+        if message.content is None:
+            return False
+        try:
+            _parse_llm_result(message.content, self._result_parser)
+            return True
+        except (ValueError, TypeError):
+            if self._repair_level == 'strict':
+                return False
+        try:
+            repair.repair_llm_result(message.content, self._return_annotation, self._repair_level)
+            return True
+        except ValueError:
+            return False
+
+    def _attempt_finished(self, index, seconds, chat_completion, won):
+        """
+        Accounts for a hedged attempt: its latency feeds the hedging delay, and the tokens of attempts whose answer
+        wasn't used are counted as hedge_tokens. The used answer's tokens are recorded like any completion's.
+        """
+        if chat_completion is None:
+            return
+        self._latencies.observe(seconds)
+        if won:
+            if index > 0:
+                self.metrics.increment("hedge_wins")
+            return
+        usage = getattr(chat_completion, "usage", None)
+        self.metrics.record_usage(usage)
+        self.metrics.increment("hedge_tokens", getattr(usage, "total_tokens", None) or 0)
+
+    def _request_with_fallback(self, hedged=False, **kwargs):
+        try:
+            return (yield self._completion_request(hedged, kwargs))
+        except openai.BadRequestError as e:
+            if kwargs.get("response_format", {}).get("type") != "json_schema" or not _rejects_structured_outputs(e):
+                raise
+            # the backend doesn't support structured outputs, fall back to JSON mode from now on
             if self._debug:
-                print(f"\033[91mTool Calls: {tool_calls}\033[0m")
-            for tool_call in tool_calls:
-                name = tool_call.function.name
-                result = self._uses_lookup[name](**json.loads(tool_call.function.arguments))
+                print(f"\033[91mStructured outputs rejected, falling back to JSON mode: {e}\033[0m")
+            self._response_format = JSON_OBJECT_RESPONSE_FORMAT
+            kwargs["response_format"] = self._response_format
+            return (yield self._completion_request(hedged, kwargs))
+
+    def _reasoning_kwargs(self, messages):
+        return {
+            "messages": messages,
+            "tools": self._tools,
+            "response_format": self._response_format,
+        }
 
-                tool_message = ChatCompletionToolMessageParam(
-                    role="tool",
-                    content=json.dumps(result),
-                    tool_call_id=tool_call.id,
-                )
-                messages = [*messages, tool_message]
+    def _perform_llm_reasoning(self, messages):
+        messages = yield from self._add_chain_of_thought(messages)
 
-            return self._perform_llm_reasoning(messages)
+        if self._debug:
+            self._print_messages(messages)
 
+        result, tool_calls = yield from self._complete(**self._reasoning_kwargs(messages))
 
+        if tool_calls:
+            messages = yield from self._call_tools(messages, tool_calls)
+            return (yield from self._perform_llm_reasoning(messages))
 
         if result is None:
             raise Exception("OpenAI chat completion failed")
@@ -199,11 +543,60 @@ class LLMFunctionHandler():
 
         return result, messages
 
-    def __call__(self, *args, **kwargs):
+    def _stream_llm_reasoning(self, messages, stream_parser):
+        messages = yield from self._add_chain_of_thought(messages)
+
+        if self._debug:
+            self._print_messages(messages)
+
+        _, tool_calls = yield from self._read_stream(stream_parser.feed, **self._reasoning_kwargs(messages))
+
+        if tool_calls:
+            messages = yield from self._call_tools(messages, tool_calls)
+            return (yield from self._stream_llm_reasoning(messages, stream_parser))
+
+        for item in stream_parser.close():
+            yield _Emit(item)
+
+    def _cache_key(self, rendered_prompt: str) -> Optional[str]:
+        # random functions are expected to answer differently every time
+        if self._response_cache is None or 'random' in self._flavors:
+            return None
+
+        return cache.fingerprint(
+            model=self._model,
+            system_message=self._system_message,
+            doc_string=self._func.__doc__,
+            return_type=self._return_type_string,
+            tools=self._tools,
+            flavors=sorted(self._flavors),
+            arguments=rendered_prompt,
+        )
+
+    def _cache_lookup(self, cache_key: str) -> tuple[bool, Any]:
+        """
+        Returns whether the cache holds a valid answer for the key, and the parsed answer.
+        """
+        with self._span("cache_lookup") as span:
+            cached_result = self._response_cache.get(cache_key)
+            span.set_attribute("hit", cached_result is not None)
+        if cached_result is None:
+            return False, None
+        try:
+            result = self._parse_raw_result(cached_result)
+        except ValueError:
+            return False, None
+        self.metrics.increment("cache_hits")
+        return True, result
+
+    def _build_messages(self, args, kwargs):
         if self._system_message is None:
-            self._prepare()
-        labeled_arguments = function_helpers.collect_arguments(self._func, args, kwargs)
-        rendered_prompt = f"{labeled_arguments}"
+            with self._span("prepare"):
+                self._prepare()
+        with self._span("collect_arguments") as span:
+            labeled_arguments = function_helpers.collect_arguments(self._func, args, kwargs)
+            rendered_prompt = serializer.serialize_arguments(labeled_arguments, self._max_argument_tokens)
+            span.set_attribute("prompt_chars", len(rendered_prompt))
 
         messages = [
             ChatCompletionSystemMessageParam(
@@ -216,36 +609,303 @@ class LLMFunctionHandler():
             )
         ]
 
-        raw_result, messages = self._perform_llm_reasoning(messages)
-        result = None
-        
+        return messages, rendered_prompt
+
+    def _parse_raw_result(self, raw_result):
+        start = time.perf_counter()
+        try:
+            with self._span("parse") as span:
+                return self._parse_or_repair(raw_result, span)
+        finally:
+            self.metrics.observe("parse", time.perf_counter() - start)
+
+    def _parse_or_repair(self, raw_result, span):
+        if raw_result is None:
+            raise ValueError("The response was empty")
+        try:
+            if self._fail_fast:
+                # replaying the validator over a cancelled generation reports the violation that cancelled it
+                validator = streaming.StreamValidator(self._return_annotation, self._max_output_chars)
+                validator.feed(raw_result)
+                validator.close()
+            return _parse_llm_result(raw_result, self._result_parser)
+        except ValueError as e:
+            if self._repair_level == 'strict':
+                raise
+            error = e
+
+        try:
+            result, repairs = repair.repair_llm_result(raw_result, self._return_annotation, self._repair_level)
+        except ValueError:
+            raise error
+
+        self.repairs.update(repairs)
+        self.metrics.increment("repairs", len(repairs))
+        span.set_attribute("repairs", repairs)
+        if self._debug:
+            print(f"\033[93mRepaired result: {', '.join(repairs)}\033[0m")
+        return result
+
+    def _call_steps(self, args, kwargs):
+        """
+        The body of an LLM function call, written as a generator so that the sync and async
+        handlers share it. It yields _Completion and _ToolCalls requests and receives their results.
+        """
+        messages, rendered_prompt = self._build_messages(args, kwargs)
+
+        cache_key = self._cache_key(rendered_prompt)
+        if cache_key is not None:
+            hit, result = self._cache_lookup(cache_key)
+            if hit:
+                return result
+
+        prompt_messages = messages
+        raw_result, messages = yield from self._perform_llm_reasoning(messages)
+
         # retry logic is only necessary when not using Banana Brain
-        for _ in range(self._retries):
+        for attempt in range(self._retries + 1):
             if self._debug:
                 print(f"\033[94mRaw Result: {raw_result}\033[0m")
 
             try:
-                result = _parse_llm_result(raw_result, self._return_annotation)
-                break
+                result = self._parse_raw_result(raw_result)
+                if cache_key is not None:
+                    self._response_cache.set(cache_key, raw_result)
+                return result
             except ValueError as e:
-                if self._debug:
-                    print(f"\033[91mParse Error: {e}. Retrying...\033[0m")
-                messages = [
-                    *messages,
-                    ChatCompletionUserMessageParam(
-                        role="user",
-                        content="Parse Error: " + str(e) + ". Please try again."
-                    )
-                ]
-
-                chat_completion = self._client.chat.completions.create(
-                    model=self._model,
-                    messages=messages,
-                )
-
-                raw_result = chat_completion.choices[0].message.content
-
-        if result is None and not type_parser._is_optional(self._return_annotation):
+                error = e
+
+            if attempt == self._retries:
+                break
+            if self._debug:
+                print(f"\033[91mParse Error: {error}. Retrying...\033[0m")
+            self.metrics.increment("retries")
+
+            with self._span("retry", attempt=attempt + 1, strategy=self._retry_strategy, error=str(error)):
+                if self._retry_strategy == 'full':
+                    messages = [
+                        *messages,
+                        ChatCompletionUserMessageParam(
+                            role="user",
+                            content="Parse Error: " + str(error) + ". Please try again."
+                        )
+                    ]
+                    raw_result, _ = yield from self._complete(phase="retry", messages=messages)
+                    messages = [*messages, ChatCompletionAssistantMessageParam(role="assistant", content=raw_result or "")]
+                else:
+                    raw_result = yield from self._compact_retry(prompt_messages, raw_result, error)
+
+        if self._escalate_on_failure or not type_parser._is_optional(self._return_annotation):
             raise ValueError("Parsing Failed after retries")
-        return result
+        return None
+
+    def _compact_retry(self, prompt_messages, raw_result, error):
+        """
+        Asks for a corrected answer with only the system message, the arguments, the invalid answer and the error,
+        leaving out the chain of thought and tool calls. If the error is inside a list or dict element, only that
+        element is requested again and spliced back into the answer.
+        """
+        messages = [
+            *prompt_messages,
+            ChatCompletionAssistantMessageParam(role="assistant", content=raw_result or ""),
+        ]
+
+        element = _failing_element(raw_result, error, self._return_annotation)
+        if element is None:
+            messages.append(ChatCompletionUserMessageParam(
+                role="user",
+                content="Parse Error: " + str(error) + ". Please try again."
+            ))
+            new_result, _ = yield from self._complete(phase="retry", messages=messages, response_format=self._response_format)
+            return new_result
+
+        response, element_path, element_type = element
+        messages.append(ChatCompletionUserMessageParam(
+            role="user",
+            content=(
+                f"Parse Error: {error}. Reply with only a corrected "
+                f"{type_parser.format_json_path(('response', *element_path))}, as JSON in the format "
+                f"{{\"response\": {type_parser.type_to_string(element_type)}}}"
+            )
+        ))
+        chat_completion = yield from self._request(phase="retry", messages=messages, response_format=JSON_OBJECT_RESPONSE_FORMAT)
+        element_result = chat_completion.choices[0].message.content
+        try:
+            # parsed only to check it, the spliced answer is parsed as a whole
+            _parse_llm_result(element_result, type_parser.compile_parser(element_type))
+        except (ValueError, TypeError) as e:
+            if self._debug:
+                print(f"\033[91mCorrected element is invalid: {e}\033[0m")
+            return raw_result
+
+        container = response
+        for step in element_path[:-1]:
+            container = container[step]
+        container[element_path[-1]] = json.loads(element_result)['response']
+        return json.dumps({"response": response})
+
+    def _stream_steps(self, args, kwargs):
+        messages, _ = self._build_messages(args, kwargs)
+        stream_parser = streaming.ResponseStreamParser(self._return_annotation)
+        yield from self._stream_llm_reasoning(messages, stream_parser)
+
+    def _create(self, kwargs):
+        create = partial(client_pool.resolve(self._client).chat.completions.create, **kwargs)
+        if self._scheduler is None:
+            return create()
+        return self._scheduler.call(create, kwargs["model"], self._function_key, scheduling.estimate_tokens(kwargs), self._max_concurrency)
+
+    def _count_attempts(self, race):
+        if race.launched > 1:
+            self.metrics.increment("hedged_attempts", race.launched - 1)
+
+    def _execute(self, request):
+        if isinstance(request, _Completion) and request.race is not None:
+            try:
+                return hedging.run(request.race, partial(self._create, request.kwargs))
+            finally:
+                self._count_attempts(request.race)
+        if isinstance(request, _Completion):
+            return self._create(request.kwargs)
+        if isinstance(request, _NextChunk):
+            return next(request.stream, None)
+        if isinstance(request, _CloseStream):
+            return request.stream.close()
+        if isinstance(request, _ToolCalls):
+            return self._tool_registry.run(request.tool_calls, self._tool_executor, self._tool_timeout, request.on_done)
+        raise TypeError(f"Unknown request {request}")
+
+    def _resume(self, steps, trace, value, error):
+        """
+        Runs the steps up to their next request. While they run, trace holds the call's open spans.
+        """
+        if trace is None:
+            return steps.throw(error) if error is not None else steps.send(value)
+        token = tracing.active_spans.set(trace)
+        try:
+            return steps.throw(error) if error is not None else steps.send(value)
+        finally:
+            tracing.active_spans.reset(token)
+
+    def _drive(self, steps):
+        trace = [] if self._tracer is not None else None
+        value, error = None, None
+        while True:
+            try:
+                request = self._resume(steps, trace, value, error)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                value = self._execute(request)
+            except Exception as e:
+                error = e
+
+    def _drive_stream(self, steps):
+        trace = [] if self._tracer is not None else None
+        value, error = None, None
+        while True:
+            try:
+                request = self._resume(steps, trace, value, error)
+            except StopIteration:
+                return
+            value, error = None, None
+            if isinstance(request, _Emit):
+                yield request.value
+                continue
+            try:
+                value = self._execute(request)
+            except Exception as e:
+                error = e
+
+    def _measured(self, steps):
+        """
+        Wraps the steps of a call, counting it and recording its total latency and errors.
+        """
+        self.metrics.increment("calls")
+        start = time.perf_counter()
+        try:
+            with self._span("call", function=self._func.__qualname__, model=self._model):
+                return (yield from steps)
+        except Exception:
+            self.metrics.increment("errors")
+            raise
+        finally:
+            self.metrics.observe("call", time.perf_counter() - start)
+
+    def __call__(self, *args, **kwargs):
+        return self._drive(self._measured(self._call_steps(args, kwargs)))
+
+    def stream(self, *args, **kwargs):
+        """
+        Calls the function with a streamed completion. For list[T] returns, yields each element as soon as it is
+        complete. For str returns, yields the text as it arrives. Other return types yield the whole result once.
+        """
+        return self._drive_stream(self._measured(self._stream_steps(args, kwargs)))
+
+class AsyncLLMFunctionHandler(LLMFunctionHandler):
+    """
+    Runs the same steps as LLMFunctionHandler, but awaits an openai.AsyncClient and async tools.
+    """
+
+    async def _create(self, kwargs):
+        create = partial(client_pool.resolve(self._client, is_async=True).chat.completions.create, **kwargs)
+        if self._scheduler is None:
+            return await create()
+        return await self._scheduler.acall(create, kwargs["model"], self._function_key, scheduling.estimate_tokens(kwargs), self._max_concurrency)
+
+    async def _execute(self, request):
+        if isinstance(request, _Completion) and request.race is not None:
+            try:
+                return await hedging.arun(request.race, partial(self._create, request.kwargs))
+            finally:
+                self._count_attempts(request.race)
+        if isinstance(request, _Completion):
+            return await self._create(request.kwargs)
+        if isinstance(request, _NextChunk):
+            try:
+                return await request.stream.__anext__()
+            except StopAsyncIteration:
+                return None
+        if isinstance(request, _CloseStream):
+            return await request.stream.close()
+        if isinstance(request, _ToolCalls):
+            return await self._tool_registry.arun(request.tool_calls, self._tool_executor, self._tool_timeout, request.on_done)
+        raise TypeError(f"Unknown request {request}")
+
+    async def _drive(self, steps):
+        trace = [] if self._tracer is not None else None
+        value, error = None, None
+        while True:
+            try:
+                request = self._resume(steps, trace, value, error)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                value = await self._execute(request)
+            except Exception as e:
+                error = e
+
+    async def __call__(self, *args, **kwargs):
+        return await self._drive(self._measured(self._call_steps(args, kwargs)))
+
+    async def _drive_stream(self, steps):
+        trace = [] if self._tracer is not None else None
+        value, error = None, None
+        while True:
+            try:
+                request = self._resume(steps, trace, value, error)
+            except StopIteration:
+                return
+            value, error = None, None
+            if isinstance(request, _Emit):
+                yield request.value
+                continue
+            try:
+                value = await self._execute(request)
+            except Exception as e:
+                error = e
 
+    def stream(self, *args, **kwargs):
+        return self._drive_stream(self._measured(self._stream_steps(args, kwargs)))
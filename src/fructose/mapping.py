@@ -0,0 +1,97 @@
+import asyncio
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator
+
+DEFAULT_CONCURRENCY = 16
+
+def map_calls(func: Callable[[Any], Any], iterable: Iterable[Any], concurrency: int = DEFAULT_CONCURRENCY, ordered: bool = True) -> Iterator[Any]:
+    """
+    Lazily calls func on each item of iterable on a thread pool, keeping at most `concurrency` calls in flight.
+    Yields results (in input order if ordered, otherwise as they finish). A call that raises yields its exception instead.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    items = iter(iterable)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque()
+
+    def submit_next():
+        for item in items:
+            # each call runs in a copy of the caller's context, so contextvar settings like use_client carry over
+            pending.append(executor.submit(contextvars.copy_context().run, func, item))
+            return True
+        return False
+
+    try:
+        while len(pending) < concurrency and submit_next():
+            pass
+
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [future for future in pending if future in finished]
+                for future in done:
+                    pending.remove(future)
+
+            for future in done:
+                submit_next()
+                exception = future.exception()
+                yield exception if exception is not None else future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def amap_calls(func: Callable[[Any], Any], iterable: Any, concurrency: int = DEFAULT_CONCURRENCY, ordered: bool = True) -> AsyncIterator[Any]:
+    """
+    Async version of map_calls for awaitable functions. iterable may be a regular or an async iterable.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    if hasattr(iterable, "__aiter__"):
+        items = iterable.__aiter__()
+        async def next_item():
+            return await items.__anext__()
+    else:
+        sync_items = iter(iterable)
+        async def next_item():
+            try:
+                return next(sync_items)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    pending = deque()
+
+    async def submit_next():
+        try:
+            item = await next_item()
+        except StopAsyncIteration:
+            return False
+        pending.append(asyncio.ensure_future(func(item)))
+        return True
+
+    try:
+        while len(pending) < concurrency and await submit_next():
+            pass
+
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+                await asyncio.wait(done)
+            else:
+                finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                done = [task for task in pending if task in finished]
+                for task in done:
+                    pending.remove(task)
+
+            for task in done:
+                await submit_next()
+                exception = task.exception()
+                yield exception if exception is not None else task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,170 @@
+import math
+import threading
+from typing import Any, Optional, TextIO
+
+# seconds, for the latency histograms
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+COUNTERS = [
+    "calls",
+    "errors",
+    "cache_hits",
+    "retries",
+    "repairs",
+    "tool_calls",
+    "packed_calls",
+    # attempts sent besides the first by hedging, the calls they won, and the tokens of unused answers
+    "hedged_attempts",
+    "hedge_wins",
+    "hedge_tokens",
+    # calls whose answer from this model failed, so that a model cascade moved on to the next model
+    "escalations",
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+]
+
+class Histogram():
+    """
+    Counts observations into fixed buckets, like a prometheus histogram.
+    """
+    def __init__(self, buckets: tuple = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> list[int]:
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+class FunctionMetrics():
+    """
+    The counters and per-phase latency histograms of one LLM function with one model.
+    Phases are chain_of_thought, completion, tools, retry, parse and call (the whole call).
+    """
+    def __init__(self, function: str, model: str):
+        self.function = function
+        self.model = model
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def increment(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def observe(self, phase: str, seconds: float):
+        with self._lock:
+            histogram = self.latencies.get(phase)
+            if histogram is None:
+                histogram = self.latencies[phase] = Histogram()
+            histogram.observe(seconds)
+
+    def record_usage(self, usage: Any):
+        """
+        Adds the token counts of an openai usage object, if the backend sent one.
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        with self._lock:
+            self.counters["prompt_tokens"] += getattr(usage, "prompt_tokens", None) or 0
+            self.counters["completion_tokens"] += getattr(usage, "completion_tokens", None) or 0
+            self.counters["cached_tokens"] += getattr(details, "cached_tokens", None) or 0
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "function": self.function,
+                "model": self.model,
+                "counters": dict(self.counters),
+                "latency": {
+                    phase: {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": dict(zip(histogram.buckets, histogram.cumulative_counts())),
+                    }
+                    for phase, histogram in self.latencies.items()
+                },
+            }
+
+def _label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{name}="{_label_value(value)}"' for name, value in labels.items()) + "}"
+
+def _bound(bound: float) -> str:
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+class MetricsRegistry():
+    """
+    Collects FunctionMetrics keyed by (function, model). Fructose records into the process-wide `registry`
+    unless given another one.
+
+    Usage:
+        from fructose.metrics import registry
+        registry.snapshot()
+        registry.write_prometheus(open("metrics.prom", "w"))
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def get(self, function: str, model: str) -> FunctionMetrics:
+        key = (function, model)
+        metrics = self._metrics.get(key)
+        if metrics is None:
+            with self._lock:
+                metrics = self._metrics.setdefault(key, FunctionMetrics(function, model))
+        return metrics
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: (m.function, m.model))
+        return [m.snapshot() for m in metrics]
+
+    def reset(self):
+        with self._lock:
+            self._metrics = {}
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the metrics in the prometheus text exposition format.
+        """
+        snapshots = self.snapshot()
+        lines = []
+        for counter in COUNTERS:
+            name = f"fructose_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            for snapshot in snapshots:
+                labels = _labels(function=snapshot["function"], model=snapshot["model"])
+                lines.append(f"{name}{labels} {snapshot['counters'][counter]}")
+
+        lines.append("# TYPE fructose_phase_seconds histogram")
+        for snapshot in snapshots:
+            for phase, latency in sorted(snapshot["latency"].items()):
+                labels = dict(function=snapshot["function"], model=snapshot["model"], phase=phase)
+                for bound, count in latency["buckets"].items():
+                    lines.append(f"fructose_phase_seconds_bucket{_labels(**labels, le=_bound(bound))} {count}")
+                lines.append(f"fructose_phase_seconds_sum{_labels(**labels)} {latency['sum']}")
+                lines.append(f"fructose_phase_seconds_count{_labels(**labels)} {latency['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file: TextIO):
+        file.write(self.to_prometheus())
+
+registry = MetricsRegistry()
@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from openai.types.chat import ChatCompletionSystemMessageParam, ChatCompletionUserMessageParam
+from . import function_helpers, serializer
+from .llm_function_handler import JSON_OBJECT_RESPONSE_FORMAT, random_seed_message
+
+DEFAULT_MAX_PACK_TOKENS = 2048
+DEFAULT_MAX_PACK_ITEMS = 32
+# seconds the first call of a pack waits for others to join
+DEFAULT_PACK_WINDOW = 0.01
+PACKED_TEMPLATE = "packed_prompt.jinja"
+
+class PackingPolicy():
+    """
+    How calls are packed together: at most max_items per request and about max_tokens of arguments,
+    gathered for up to `window` seconds.
+    """
+    def __init__(self, max_tokens: int = DEFAULT_MAX_PACK_TOKENS, max_items: int = DEFAULT_MAX_PACK_ITEMS, window: float = DEFAULT_PACK_WINDOW):
+        self.max_tokens = max_tokens
+        self.max_items = max_items
+        self.window = window
+
+class _PackedCall():
+    def __init__(self, args, kwargs, rendered_arguments):
+        self.args = args
+        self.kwargs = kwargs
+        self.rendered_arguments = rendered_arguments
+        # the response cache key, shared with the same call unpacked
+        self.cache_key = None
+        self.tokens = len(rendered_arguments) // serializer.CHARS_PER_TOKEN + 1
+        self.done = False
+        # set when the packed answer for this call was missing or invalid, so it's re-run on its own
+        self.unpacked = False
+        self.result = None
+
+class Packer():
+    """
+    Packs concurrent calls of one LLM function into a single completion typed as dict[str, return_type],
+    keyed by item index, and hands each caller its own answer. Missing or invalid answers are re-run one by one.
+
+    The first caller without a pack in progress becomes the leader: it waits `window` seconds for others to
+    join (or until the token budget is full), sends the packed request, then hands leadership on.
+    """
+    def __init__(self, handler, system_template, policy: PackingPolicy):
+        if len(handler._tool_registry) > 0 or "chain_of_thought" in handler._flavors:
+            raise ValueError(f"{handler._func.__name__} uses tools or chain_of_thought, which can't be packed")
+        self._handler = handler
+        self._system_template = system_template
+        self._policy = policy
+        self._system_message = None
+        self._queue = []
+        self._leading = False
+        self._condition = threading.Condition()
+
+    def _prepare(self):
+        handler = self._handler
+        if handler._system_message is None:
+            handler._prepare()
+        system_message = self._system_template.render(
+            func_doc_string=handler._func.__doc__,
+            return_type_string=handler._return_type_string
+        ).strip()
+        if 'random' in handler._flavors:
+            system_message += random_seed_message()
+        self._system_message = system_message
+
+    def __call__(self, *args, **kwargs):
+        if self._system_message is None:
+            self._prepare()
+        labeled_arguments = function_helpers.collect_arguments(self._handler._func, args, kwargs)
+        call = _PackedCall(args, kwargs, serializer.serialize_arguments(labeled_arguments, self._handler._max_argument_tokens))
+        call.cache_key = self._handler._cache_key(call.rendered_arguments)
+        if call.cache_key is not None:
+            hit, result = self._handler._cache_lookup(call.cache_key)
+            if hit:
+                return result
+
+        with self._condition:
+            self._queue.append(call)
+            self._condition.notify_all()
+        while True:
+            with self._condition:
+                # wait until this call is answered, or is still queued while nobody leads
+                while not call.done and (self._leading or call not in self._queue):
+                    self._condition.wait()
+                if call.done:
+                    break
+                self._leading = True
+            self._lead()
+
+        if call.unpacked:
+            return self._handler(*args, **kwargs)
+        return call.result
+
+    def _queued_tokens(self) -> int:
+        return sum(call.tokens for call in self._queue)
+
+    def _take_pack(self) -> list[_PackedCall]:
+        pack = []
+        tokens = 0
+        while self._queue and len(pack) < self._policy.max_items:
+            call = self._queue[0]
+            if pack and tokens + call.tokens > self._policy.max_tokens:
+                break
+            pack.append(self._queue.pop(0))
+            tokens += call.tokens
+        return pack
+
+    def _lead(self):
+        deadline = time.monotonic() + self._policy.window
+        with self._condition:
+            while (len(self._queue) < self._policy.max_items and self._queued_tokens() < self._policy.max_tokens
+                    and time.monotonic() < deadline):
+                self._condition.wait(deadline - time.monotonic())
+            pack = self._take_pack()
+            # let another waiting call lead the next pack while this one is in flight
+            self._leading = False
+            self._condition.notify_all()
+
+        if len(pack) == 1:
+            pack[0].unpacked = True
+        else:
+            self._run_pack(pack)
+
+        with self._condition:
+            for call in pack:
+                call.done = True
+            self._condition.notify_all()
+
+    def _messages(self, pack: list[_PackedCall]):
+        items = ",".join(f"{json.dumps(str(i))}:{call.rendered_arguments}" for i, call in enumerate(pack))
+        return [
+            ChatCompletionSystemMessageParam(role="system", content=self._system_message),
+            ChatCompletionUserMessageParam(role="user", content="{" + items + "}"),
+        ]
+
+    def _packed_steps(self, pack: list[_PackedCall]):
+        handler = self._handler
+        with handler._span("packed_call", items=len(pack)):
+            chat_completion = yield from handler._request(phase="packed", messages=self._messages(pack), response_format=JSON_OBJECT_RESPONSE_FORMAT)
+        return chat_completion.choices[0].message.content
+
+    def _run_pack(self, pack: list[_PackedCall]):
+        handler = self._handler
+        try:
+            content = handler._drive(self._packed_steps(pack))
+            answers = json.loads(content)["response"]
+            if type(answers) != dict:
+                raise ValueError("response is not an object")
+        except Exception as e:
+            if handler._debug:
+                print(f"\033[91mPacked call failed, running {len(pack)} calls one by one: {e}\033[0m")
+            for call in pack:
+                call.unpacked = True
+            return
+
+        for i, call in enumerate(pack):
+            try:
+                raw_result = json.dumps({"response": answers[str(i)]})
+                call.result = handler._parse_raw_result(raw_result)
+            except (KeyError, ValueError, TypeError):
+                call.unpacked = True
+                continue
+            if call.cache_key is not None:
+                handler._response_cache.set(call.cache_key, raw_result)
+        unpacked = sum(call.unpacked for call in pack)
+        handler.metrics.increment("packed_calls", len(pack) - unpacked)
+        if handler._debug and unpacked:
+            print(f"\033[93mRe-running {unpacked} of {len(pack)} packed calls one by one\033[0m")
@@ -0,0 +1,165 @@
+import dataclasses
+import json
+import re
+from typing import Any, Literal, Union, get_args, get_origin
+from . import type_parser
+
+RepairLevel = Union[Literal['strict'], Literal['lenient'], Literal['repair']]
+REPAIR_LEVELS = ['strict', 'lenient', 'repair']
+
+_CODE_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*\n?(.*?)\n?\s*```\s*$", re.DOTALL)
+_TRUE_STRINGS = {"true", "yes", "1"}
+_FALSE_STRINGS = {"false", "no", "0"}
+
+def _strip_code_fence(text: str, repairs: list[str]) -> str:
+    match = _CODE_FENCE.match(text)
+    if match is None:
+        return text
+    repairs.append("code_fence")
+    return match.group(1)
+
+def _remove_trailing_commas(text: str, repairs: list[str]) -> str:
+    result = []
+    in_string = False
+    escaped = False
+    removed = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ',':
+            rest = text[i + 1:].lstrip()
+            if rest[:1] in ('}', ']'):
+                removed = True
+                continue
+        result.append(char)
+
+    if removed:
+        repairs.append("trailing_comma")
+    return "".join(result)
+
+def _extract_json(text: str, repairs: list[str]) -> str:
+    # drop prose around the outermost JSON object
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start or (start == 0 and end == len(text) - 1):
+        return text
+    repairs.append("surrounding_text")
+    return text[start:end + 1]
+
+_TEXT_REPAIRS = [_strip_code_fence, _remove_trailing_commas, _extract_json, _remove_trailing_commas]
+
+def _load_json(raw_result: str, level: RepairLevel, repairs: list[str]) -> Any:
+    try:
+        return json.loads(raw_result)
+    except json.JSONDecodeError as e:
+        if level != 'repair':
+            raise
+        error = e
+
+    text = raw_result.strip()
+    for text_repair in _TEXT_REPAIRS:
+        repaired_text = text_repair(text, repairs)
+        if repaired_text == text:
+            continue
+        text = repaired_text
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            pass
+
+    raise error
+
+def _unwrap_envelope(json_result: Any, level: RepairLevel, repairs: list[str]) -> Any:
+    if type(json_result) == dict and 'response' in json_result:
+        return json_result['response']
+    if level != 'repair':
+        raise ValueError("response not in json_result")
+
+    # a bare value, without the {"response": ...} envelope
+    repairs.append("missing_envelope")
+    return json_result
+
+def _coerce(value: Any, return_type: Any, repairs: list[str]) -> Any:
+    """
+    Coerces common near-misses to the shapes type_parser expects, recording each coercion applied.
+    Values it can't fix are returned as-is, for type_parser to reject.
+    """
+    if value is None:
+        return value
+
+    if type_parser._is_optional(return_type):
+        sub_type = next(arg for arg in get_args(return_type) if arg is not type(None))
+        return _coerce(value, sub_type, repairs)
+
+    if type_parser._is_enum(return_type):
+        if type(value) == str and value not in return_type.__members__:
+            for member in return_type:
+                if member.value == value or member.name.lower() == value.lower():
+                    repairs.append("enum_value")
+                    return member.name
+        return value
+
+    if dataclasses.is_dataclass(return_type):
+        if type(value) != dict:
+            return value
+        fields = {field.name: field.type for field in dataclasses.fields(return_type)}
+        return {key: _coerce(val, fields[key], repairs) if key in fields else val for key, val in value.items()}
+
+    origin = get_origin(return_type)
+    args = get_args(return_type)
+    if origin == list and type(value) == list:
+        return [_coerce(item, args[0], repairs) for item in value]
+    if origin == tuple and type(value) == list:
+        return [_coerce(item, sub_type, repairs) for item, sub_type in zip(value, args)] + value[len(args):]
+    if origin == dict and type(value) == dict:
+        return {key: _coerce(val, args[1], repairs) for key, val in value.items()}
+
+    if return_type == bool and type(value) == str:
+        if value.strip().lower() in _TRUE_STRINGS:
+            repairs.append("string_to_bool")
+            return True
+        if value.strip().lower() in _FALSE_STRINGS:
+            repairs.append("string_to_bool")
+            return False
+    if return_type in (int, float) and type(value) == str:
+        try:
+            number = json.loads(value.strip())
+        except json.JSONDecodeError:
+            return value
+        if type(number) in (int, float):
+            repairs.append("string_to_number")
+            value = number
+    if return_type == int and type(value) == float and value.is_integer():
+        repairs.append("float_to_int")
+        return int(value)
+    if return_type == str and type(value) in (int, float) and type(value) != bool:
+        repairs.append("number_to_string")
+        return json.dumps(value)
+
+    return value
+
+def repair_llm_result(raw_result: str, return_type: Any, level: RepairLevel) -> tuple[Any, list[str]]:
+    """
+    Parses a raw LLM result into return_type, fixing what can be fixed locally instead of spending a retry.
+
+    - strict: no repairs, the same as the regular parser
+    - lenient: also coerce values, e.g. numbers and bools sent as strings, enum values given instead of names
+    - repair: also fix the JSON text, e.g. code fences, trailing commas and a missing "response" envelope
+
+    Returns the parsed result and the names of the repairs applied. Raises ValueError if it can't be repaired.
+    """
+    if level not in REPAIR_LEVELS:
+        raise ValueError(f"Unknown repair level {level}, expected one of {REPAIR_LEVELS}")
+
+    repairs = []
+    json_result = _load_json(raw_result, level, repairs)
+    value = _unwrap_envelope(json_result, level, repairs)
+    if level != 'strict':
+        value = _coerce(value, return_type, repairs)
+    return type_parser.compile_parser(return_type)(value), repairs
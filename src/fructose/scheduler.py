@@ -0,0 +1,535 @@
+import asyncio
+import bisect
+from contextlib import contextmanager
+import contextvars
+from functools import partial, wraps
+import inspect
+import itertools
+import json
+import threading
+import time
+from typing import Any, Callable, Optional
+import openai
+from . import serializer
+from .concurrency import AdaptiveLimit, ConcurrencyPolicy
+
+INTERACTIVE_PRIORITY = 0
+# map and imap calls, so that interactive calls jump ahead of them
+BATCH_PRIORITY = 10
+DEFAULT_BURST_SECONDS = 10.0
+# tokens a completion is assumed to produce when the request doesn't set max_tokens
+DEFAULT_COMPLETION_TOKENS_ESTIMATE = 256
+DEFAULT_RATE_LIMIT_RETRIES = 3
+# seconds a model is paused after a 429 without a Retry-After header
+DEFAULT_RATE_LIMIT_PAUSE = 1.0
+# seconds by which a wake-up time must move before the waiters are woken again
+WAKEUP_TOLERANCE = 0.001
+
+_priority = contextvars.ContextVar("fructose_priority", default=INTERACTIVE_PRIORITY)
+
+@contextmanager
+def priority(level: int):
+    """
+    Schedules the LLM function calls made inside the block with this priority, lower runs first.
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def with_priority(func: Callable, level: int) -> Callable:
+    """
+    Wraps func so that its LLM function calls are scheduled with this priority.
+    """
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with priority(level):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with priority(level):
+            return func(*args, **kwargs)
+    return wrapper
+
+def estimate_tokens(request: dict[str, Any]) -> int:
+    """
+    A rough token count of a completion request: its messages plus the completion it may produce.
+    """
+    prompt_chars = len(json.dumps(request.get("messages", []), default=str))
+    completion_tokens = request.get("max_tokens") or DEFAULT_COMPLETION_TOKENS_ESTIMATE
+    return prompt_chars // serializer.CHARS_PER_TOKEN + completion_tokens
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    The seconds to wait that a 429 or 503 response asked for in its retry-after-ms or Retry-After header.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # Retry-After may also be an HTTP date, which we don't bother with
+        pass
+    return None
+
+def without_retries(client: Any) -> Any:
+    """
+    A copy of an openai client that doesn't retry failed requests itself, so that 429s reach the scheduler
+    instead of being retried inside create() while the call holds its slot. Other clients are returned as is.
+    """
+    with_options = getattr(client, "with_options", None)
+    return client if with_options is None else with_options(max_retries=0)
+
+def _total_tokens(chat_completion: Any) -> Optional[int]:
+    usage = getattr(chat_completion, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+def _is_stream(result: Any) -> bool:
+    return hasattr(result, "__next__") or hasattr(result, "__anext__")
+
+class _ScheduledStream():
+    """
+    A streamed completion holding its call's ticket until the stream is exhausted, fails or is closed, so that
+    streams count against the bulkheads for as long as their tokens arrive. done(tokens_used, error) is called
+    once, with the exception the stream raised, if any.
+    """
+    # until __init__ completes, so __del__ and __getattr__ have nothing to do
+    _stream = None
+    _finished = True
+
+    def __init__(self, stream: Any, done: Callable[[Optional[int], Optional[BaseException]], None]):
+        self._stream = stream
+        self._done = done
+        self._tokens_used = None
+        self._finished = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._stream)
+        except StopIteration:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+        # with include_usage, the last chunk carries the usage of the whole completion
+        self._tokens_used = _total_tokens(chunk) or self._tokens_used
+        return chunk
+
+    def close(self):
+        try:
+            return self._stream.close()
+        finally:
+            self._finish()
+
+    def _finish(self, error: Optional[BaseException] = None):
+        if not self._finished:
+            self._finished = True
+            self._done(self._tokens_used, error)
+
+    def __del__(self):
+        # a stream dropped without being read to the end or closed still gives back its slot
+        self._finish()
+
+class _ScheduledAsyncStream(_ScheduledStream):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._tokens_used = _total_tokens(chunk) or self._tokens_used
+        return chunk
+
+    async def close(self):
+        try:
+            return await self._stream.close()
+        finally:
+            self._finish()
+
+class RateLimits():
+    """
+    A model's quota in requests and tokens per minute, None for no limit. Buckets hold burst_seconds worth of
+    quota, so a full bucket can't overshoot the provider's window by much.
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None, burst_seconds: float = DEFAULT_BURST_SECONDS):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst_seconds = burst_seconds
+
+class TokenBucket():
+    """
+    Refills at rate_per_minute up to its capacity. A take larger than the capacity is let through once the
+    bucket is full, leaving it in debt.
+    """
+    def __init__(self, rate_per_minute: float, burst_seconds: float = DEFAULT_BURST_SECONDS):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, rate_per_minute * burst_seconds / 60)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def adjust(self, amount: float):
+        """
+        Takes amount out of the bucket, or gives it back if negative.
+        """
+        self.level = min(self.capacity, self.level - amount)
+
+class _Ticket():
+    def __init__(self, model: str, function: str, max_concurrency: Optional[int], tokens: int, priority: int):
+        self.model = model
+        self.function = function
+        self.max_concurrency = max_concurrency
+        self.tokens = tokens
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.started = None
+        self.wake = None
+
+class Scheduler():
+    """
+    Queues the completions of every function of a Fructose instance. Each model gets token buckets for its
+    requests and estimated tokens per minute, each function an optional cap on its in-flight calls (a bulkhead),
+    and waiting calls are granted in priority order. A 429 pauses the model for its Retry-After and the call is
+    retried, up to rate_limit_retries times.
+
+    With a ConcurrencyPolicy, each model also gets an AdaptiveLimit on its in-flight calls, which grows while
+    latency stays near its baseline and backs off on 429s, 5xx errors and rising latency.
+
+    Usage:
+        scheduler = Scheduler({"gpt-4o": RateLimits(requests_per_minute=500, tokens_per_minute=30000)})
+        ai = Fructose(scheduler=scheduler)
+        scheduler.stats()
+    """
+    def __init__(self, rate_limits: Optional[dict[str, RateLimits]] = None, default_rate_limits: Optional[RateLimits] = None, rate_limit_retries: int = DEFAULT_RATE_LIMIT_RETRIES, concurrency: Optional[ConcurrencyPolicy] = None):
+        self._rate_limits = rate_limits or {}
+        self._default_rate_limits = default_rate_limits or RateLimits()
+        self._rate_limit_retries = rate_limit_retries
+        self._buckets = {}
+        self._paused_until = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._concurrency = concurrency
+        self._adaptive_limits = {}
+        self._in_flight = {}
+        self._model_in_flight = {}
+        self._waits = {}
+        self._rate_limited = 0
+        # when the earliest blocked call may run, so that waiters can be woken to re-check at that time
+        self._wakeup_at = None
+        self._lock = threading.Lock()
+
+    def _model_buckets(self, model: str) -> tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            limits = self._rate_limits.get(model, self._default_rate_limits)
+            buckets = self._buckets[model] = (
+                TokenBucket(limits.requests_per_minute, limits.burst_seconds) if limits.requests_per_minute else None,
+                TokenBucket(limits.tokens_per_minute, limits.burst_seconds) if limits.tokens_per_minute else None,
+            )
+        return buckets
+
+    def _adaptive_limit(self, model: str) -> Optional[AdaptiveLimit]:
+        if self._concurrency is None:
+            return None
+        limit = self._adaptive_limits.get(model)
+        if limit is None:
+            limit = self._adaptive_limits[model] = AdaptiveLimit(self._concurrency)
+        return limit
+
+    def _wait_time(self, ticket: _Ticket, now: float) -> float:
+        requests, tokens = self._model_buckets(ticket.model)
+        wait = self._paused_until.get(ticket.model, now) - now
+        if requests is not None:
+            wait = max(wait, requests.wait_time(1, now))
+        if tokens is not None:
+            wait = max(wait, tokens.wait_time(ticket.tokens, now))
+        return wait
+
+    def _grant(self, ticket: _Ticket, now: float):
+        requests, tokens = self._model_buckets(ticket.model)
+        if requests is not None:
+            requests.adjust(1)
+        if tokens is not None:
+            tokens.adjust(ticket.tokens)
+        self._in_flight[ticket.function] = self._in_flight.get(ticket.function, 0) + 1
+        self._model_in_flight[ticket.model] = self._model_in_flight.get(ticket.model, 0) + 1
+        ticket.started = now
+        waits = self._waits.setdefault(ticket.priority, {"count": 0, "sum": 0.0, "max": 0.0})
+        wait = now - ticket.enqueued
+        waits["count"] += 1
+        waits["sum"] += wait
+        waits["max"] = max(waits["max"], wait)
+        ticket.granted = True
+        ticket.wake()
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        Grants every queued call that may run now, in priority order. Returns the seconds until a blocked call
+        may run, or None if they all wait for a bulkhead.
+        """
+        now = time.monotonic()
+        next_check = None
+        blocked_models = set()
+        with self._lock:
+            queue = []
+            for entry in self._queue:
+                ticket = entry[2]
+                if ticket.model in blocked_models:
+                    queue.append(entry)
+                    continue
+                if ticket.max_concurrency is not None and self._in_flight.get(ticket.function, 0) >= ticket.max_concurrency:
+                    queue.append(entry)
+                    continue
+                limit = self._adaptive_limit(ticket.model)
+                if limit is not None and self._model_in_flight.get(ticket.model, 0) >= limit.limit:
+                    blocked_models.add(ticket.model)
+                    queue.append(entry)
+                    continue
+                wait = self._wait_time(ticket, now)
+                if wait > 0:
+                    # later calls of the model wait behind this one, so lower priorities can't starve it
+                    blocked_models.add(ticket.model)
+                    next_check = wait if next_check is None else min(next_check, wait)
+                    queue.append(entry)
+                    continue
+                self._grant(ticket, now)
+            self._queue = queue
+
+            wakeup_at = None if next_check is None else now + next_check
+            # waiters blocked on a bulkhead sleep without a timeout, and the thread that found a pause may not be
+            # waiting at all, so wake them to re-check with the new timeout
+            if wakeup_at is not None and (self._wakeup_at is None or self._wakeup_at <= now or wakeup_at < self._wakeup_at - WAKEUP_TOLERANCE):
+                for entry in queue:
+                    entry[2].wake()
+            self._wakeup_at = wakeup_at
+        return next_check
+
+    def _enqueue(self, model: str, function: str, tokens: int, max_concurrency: Optional[int], wake: Callable[[], None]) -> _Ticket:
+        ticket = _Ticket(model, function, max_concurrency, tokens, _priority.get())
+        ticket.wake = wake
+        with self._lock:
+            bisect.insort(self._queue, (ticket.priority, next(self._sequence), ticket))
+        return ticket
+
+    def _cancel(self, ticket: _Ticket):
+        with self._lock:
+            self._queue = [entry for entry in self._queue if entry[2] is not ticket]
+        if ticket.granted:
+            self.release(ticket)
+
+    def acquire(self, model: str, function: str, tokens: int, max_concurrency: Optional[int] = None) -> _Ticket:
+        """
+        Blocks until a call may run. Pass the ticket to release once it's done.
+        """
+        event = threading.Event()
+        ticket = self._enqueue(model, function, tokens, max_concurrency, event.set)
+        try:
+            while True:
+                next_check = self._dispatch()
+                if ticket.granted:
+                    return ticket
+                event.wait(next_check)
+                event.clear()
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    async def aacquire(self, model: str, function: str, tokens: int, max_concurrency: Optional[int] = None) -> _Ticket:
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        ticket = self._enqueue(model, function, tokens, max_concurrency, lambda: loop.call_soon_threadsafe(event.set))
+        try:
+            while True:
+                next_check = self._dispatch()
+                if ticket.granted:
+                    return ticket
+                try:
+                    await asyncio.wait_for(event.wait(), next_check)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    def release(self, ticket: _Ticket, tokens_used: Optional[int] = None):
+        """
+        Frees the call's bulkhead slot and corrects the token bucket with the tokens it actually used.
+        """
+        with self._lock:
+            self._in_flight[ticket.function] -= 1
+            self._model_in_flight[ticket.model] -= 1
+            _, tokens = self._model_buckets(ticket.model)
+            if tokens is not None and tokens_used is not None:
+                tokens.adjust(tokens_used - ticket.tokens)
+        self._dispatch()
+
+    def _pause(self, model: str, seconds: float):
+        self._paused_until[model] = max(self._paused_until.get(model, 0.0), time.monotonic() + seconds)
+
+    def rate_limited(self, model: str, seconds: Optional[float] = None):
+        """
+        Pauses every call of the model for seconds, after the provider answered with a 429.
+        """
+        with self._lock:
+            self._rate_limited += 1
+            self._pause(model, DEFAULT_RATE_LIMIT_PAUSE if seconds is None else seconds)
+            requests, _ = self._model_buckets(model)
+            if requests is not None:
+                # we were ahead of the provider's count, so restart from an empty bucket
+                requests.level = min(requests.level, 0.0)
+
+    def _observe(self, ticket: _Ticket, error: Optional[Exception] = None):
+        """
+        Feeds the outcome of a granted call to the model's adaptive limit, and honors the Retry-After of 429s
+        and 5xx errors.
+        """
+        status = getattr(error, "status_code", None)
+        if status == 429:
+            self.rate_limited(ticket.model, retry_after(error))
+        with self._lock:
+            if status is not None and status >= 500 and retry_after(error) is not None:
+                self._pause(ticket.model, retry_after(error))
+            limit = self._adaptive_limit(ticket.model)
+            if limit is None:
+                return
+            now = time.monotonic()
+            if error is None:
+                limit.on_success(now - ticket.started, self._model_in_flight[ticket.model], now)
+            elif status == 429 or (status is not None and status >= 500):
+                limit.on_overload(f"status {status}", now)
+
+    def _stream_finished(self, ticket: _Ticket, tokens_used: Optional[int], error: Optional[BaseException]):
+        """
+        Observes a streamed call once its whole completion arrived, so that streamed and regular calls feed the
+        adaptive limit comparable latencies, then releases it.
+        """
+        if error is None or isinstance(error, openai.APIStatusError):
+            self._observe(ticket, error)
+        self.release(ticket, tokens_used)
+
+    def call(self, create: Callable[[], Any], model: str, function: str, tokens: int, max_concurrency: Optional[int] = None) -> Any:
+        """
+        Runs create once the model's quota and the function's bulkhead allow it, retrying on 429s.
+        A streamed completion keeps its slot until it is read to the end or closed.
+        """
+        for attempt in range(self._rate_limit_retries + 1):
+            ticket = self.acquire(model, function, tokens, max_concurrency)
+            tokens_used = None
+            streaming = False
+            try:
+                result = create()
+                if _is_stream(result):
+                    # the slot is held, and the latency measured, until the stream is read to the end or closed
+                    streaming = True
+                    return _ScheduledStream(result, partial(self._stream_finished, ticket))
+                tokens_used = _total_tokens(result)
+                self._observe(ticket)
+                return result
+            except openai.RateLimitError as e:
+                self._observe(ticket, e)
+                if attempt == self._rate_limit_retries:
+                    raise
+            except openai.APIStatusError as e:
+                self._observe(ticket, e)
+                raise
+            finally:
+                if not streaming:
+                    self.release(ticket, tokens_used)
+
+    async def acall(self, create: Callable[[], Any], model: str, function: str, tokens: int, max_concurrency: Optional[int] = None) -> Any:
+        for attempt in range(self._rate_limit_retries + 1):
+            ticket = await self.aacquire(model, function, tokens, max_concurrency)
+            tokens_used = None
+            streaming = False
+            try:
+                result = await create()
+                if _is_stream(result):
+                    streaming = True
+                    return _ScheduledAsyncStream(result, partial(self._stream_finished, ticket))
+                tokens_used = _total_tokens(result)
+                self._observe(ticket)
+                return result
+            except openai.RateLimitError as e:
+                self._observe(ticket, e)
+                if attempt == self._rate_limit_retries:
+                    raise
+            except openai.APIStatusError as e:
+                self._observe(ticket, e)
+                raise
+            finally:
+                if not streaming:
+                    self.release(ticket, tokens_used)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def concurrency_limits(self) -> dict[str, dict[str, Any]]:
+        """
+        Each model's adaptive limit, smoothed and baseline latency, and in-flight calls.
+        """
+        with self._lock:
+            return {
+                model: dict(limit.snapshot(), in_flight=self._model_in_flight.get(model, 0))
+                for model, limit in sorted(self._adaptive_limits.items())
+            }
+
+    def decisions(self) -> list[dict[str, Any]]:
+        """
+        The recent increases and decreases of the adaptive limits, oldest first.
+        """
+        with self._lock:
+            decisions = [
+                dict(decision, model=model)
+                for model, limit in self._adaptive_limits.items()
+                for decision in limit.decisions
+            ]
+        return sorted(decisions, key=lambda decision: decision["time"])
+
+    def stats(self) -> dict[str, Any]:
+        """
+        The queue depth, in-flight calls per function, queue waits per priority, the number of 429s and the
+        adaptive concurrency limits.
+        """
+        limits = self.concurrency_limits()
+        with self._lock:
+            return {
+                "queue_depth": len(self._queue),
+                "in_flight": {function: count for function, count in self._in_flight.items() if count},
+                "waits": {
+                    level: dict(waits, mean=waits["sum"] / waits["count"])
+                    for level, waits in sorted(self._waits.items())
+                },
+                "rate_limited": self._rate_limited,
+                "concurrency": limits,
+            }
@@ -0,0 +1,86 @@
+import dataclasses
+import enum
+import json
+from typing import Any, Optional
+
+# a rough token estimate, good enough for budgeting prompts
+CHARS_PER_TOKEN = 4
+
+def to_jsonable(value: Any) -> Any:
+    """
+    Converts a value to plain JSON types: dataclasses become objects, enums their names, tuples and sets arrays.
+    Dict keys and set members are sorted so that equal inputs serialize identically.
+    """
+    if value is None or type(value) in (str, int, float, bool):
+        return value
+    if isinstance(value, enum.Enum):
+        return value.name
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {field.name: to_jsonable(getattr(value, field.name)) for field in dataclasses.fields(value)}
+    if isinstance(value, dict):
+        items = [(str(to_jsonable(key)), to_jsonable(val)) for key, val in value.items()]
+        return dict(sorted(items, key=lambda item: item[0]))
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((to_jsonable(item) for item in value), key=dumps)
+    if isinstance(value, (str, int, float)):
+        # subclasses, e.g. str enums mixed in without Enum
+        return value
+    return repr(value)
+
+def dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+def _fit(value: Any, max_chars: int) -> Any:
+    """
+    Shrinks a JSON value to roughly max_chars, cutting long strings and eliding the tail of long arrays and
+    objects, with a marker saying how much was left out.
+    """
+    if type(value) == str:
+        if len(value) <= max_chars:
+            return value
+        return value[:max_chars] + f"…[{len(value) - max_chars} more chars]"
+
+    if type(value) == list:
+        if len(dumps(value)) <= max_chars:
+            return value
+        fitted = []
+        remaining = max_chars
+        for i, item in enumerate(value):
+            if remaining <= 0:
+                fitted.append(f"…[{len(value) - i} more items]")
+                break
+            item = _fit(item, remaining)
+            fitted.append(item)
+            remaining -= len(dumps(item)) + 1
+        return fitted
+
+    if type(value) == dict:
+        if len(dumps(value)) <= max_chars:
+            return value
+        fitted = {}
+        remaining = max_chars
+        for i, (key, val) in enumerate(value.items()):
+            if remaining <= 0:
+                fitted["…"] = f"[{len(value) - i} more keys]"
+                break
+            val = _fit(val, remaining)
+            fitted[key] = val
+            remaining -= len(dumps(key)) + len(dumps(val)) + 2
+        return fitted
+
+    return value
+
+def serialize_arguments(arguments: dict[str, Any], max_tokens_per_argument: Optional[int] = None) -> str:
+    """
+    Serializes function arguments to compact, deterministic JSON for the prompt.
+    Each argument is limited to about max_tokens_per_argument tokens when given, and sent whole otherwise.
+    """
+    serialized = {}
+    for name, value in arguments.items():
+        value = to_jsonable(value)
+        if max_tokens_per_argument is not None:
+            value = _fit(value, max_tokens_per_argument * CHARS_PER_TOKEN)
+        serialized[name] = value
+    return dumps(serialized)
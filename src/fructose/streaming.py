@@ -0,0 +1,427 @@
+import dataclasses
+import json
+from typing import Any, Optional, Union, get_args, get_origin
+from . import type_parser
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = "+-0123456789.eE"
+_LITERALS = {"true": True, "false": False, "null": None}
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+# parser states
+_VALUE = "value"
+_VALUE_OR_END = "value_or_end"
+_KEY = "key"
+_KEY_OR_END = "key_or_end"
+_COLON = "colon"
+_COMMA_OR_END = "comma_or_end"
+_STRING = "string"
+_NUMBER = "number"
+_LITERAL = "literal"
+_DONE = "done"
+
+class _Frame():
+    def __init__(self, kind: str, path: tuple, value: Union[dict, list]):
+        self.kind = kind
+        self.path = path
+        self.value = value
+        self.key = None
+
+    def child_path(self) -> tuple:
+        if self.kind == "object":
+            return (*self.path, self.key)
+        return (*self.path, len(self.value))
+
+class IncrementalJSONParser():
+    """
+    Parses a JSON document fed to it in arbitrary chunks, as it arrives.
+
+    feed() returns the events completed by the chunk, each a tuple of (event, path, payload), where path is the
+    tuple of object keys and array indices leading to the value:
+        ("begin", path, "object" | "array")  a container was opened
+        ("key", path, key)                   an object key was read; path is the object's path
+        ("chunk", path, text)                decoded text of a string value that is still being read
+        ("value", path, value)               a value (scalar or container) is complete
+    """
+    def __init__(self):
+        self._stack: list[_Frame] = []
+        self._state = _VALUE
+        self._token = []
+        self._string_is_key = False
+        self._escape = None
+        self._high_surrogate = None
+        self._offset = 0
+        self._events = []
+        self._pending_chunk = []
+
+    @property
+    def done(self) -> bool:
+        return self._state == _DONE
+
+    def feed(self, text: str) -> list[tuple]:
+        self._events = []
+        for char in text:
+            self._feed_char(char)
+            self._offset += 1
+
+        if self._state == _STRING and self._pending_chunk and not self._string_is_key:
+            self._events.append(("chunk", self._current_path(), "".join(self._pending_chunk)))
+            self._pending_chunk = []
+        return self._events
+
+    def close(self) -> list[tuple]:
+        """
+        Signals the end of the document, raising ValueError if it is incomplete.
+        """
+        self._events = []
+        if self._state in (_NUMBER, _LITERAL):
+            self._finish_token()
+        if self._state != _DONE:
+            raise ValueError("Incomplete JSON document")
+        return self._events
+
+    def _error(self, message: str):
+        raise ValueError(f"Invalid JSON at offset {self._offset}: {message}")
+
+    def _current_path(self) -> tuple:
+        return self._stack[-1].child_path() if self._stack else ()
+
+    def _complete_value(self, value: Any):
+        path = self._current_path()
+        self._events.append(("value", path, value))
+        if not self._stack:
+            self._state = _DONE
+            return
+
+        frame = self._stack[-1]
+        if frame.kind == "object":
+            frame.value[frame.key] = value
+        else:
+            frame.value.append(value)
+        self._state = _COMMA_OR_END
+
+    def _open(self, kind: str):
+        path = self._current_path()
+        self._events.append(("begin", path, kind))
+        self._stack.append(_Frame(kind, path, {} if kind == "object" else []))
+        self._state = _KEY_OR_END if kind == "object" else _VALUE_OR_END
+
+    def _close(self, kind: str):
+        frame = self._stack[-1]
+        if frame.kind != kind:
+            self._error(f"unexpected closing {kind}")
+        self._stack.pop()
+        self._complete_value(frame.value)
+
+    def _finish_token(self):
+        token = "".join(self._token)
+        self._token = []
+        if self._state == _NUMBER:
+            try:
+                value = json.loads(token)
+            except json.JSONDecodeError:
+                self._error(f"invalid number {token}")
+        else:
+            if token not in _LITERALS:
+                self._error(f"invalid literal {token}")
+            value = _LITERALS[token]
+        self._complete_value(value)
+
+    def _start_value(self, char: str):
+        if char == '{':
+            self._open("object")
+        elif char == '[':
+            self._open("array")
+        elif char == '"':
+            self._state = _STRING
+            self._string_is_key = False
+        elif char == '-' or char.isdigit():
+            self._state = _NUMBER
+            self._token = [char]
+        elif char in "tfn":
+            self._state = _LITERAL
+            self._token = [char]
+        else:
+            self._error(f"unexpected character {char!r}")
+
+    def _feed_string_char(self, char: str):
+        if self._escape is not None:
+            self._escape.append(char)
+            if self._escape[0] == 'u':
+                if len(self._escape) < 5:
+                    return
+                code = int("".join(self._escape[1:]), 16)
+                self._escape = None
+                if 0xD800 <= code < 0xDC00:
+                    self._high_surrogate = code
+                    return
+                if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+                    code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                self._high_surrogate = None
+                self._token.append(chr(code))
+                self._pending_chunk.append(chr(code))
+                return
+            escaped = _ESCAPES.get(self._escape[0])
+            if escaped is None:
+                self._error(f"invalid escape \\{self._escape[0]}")
+            self._escape = None
+            self._token.append(escaped)
+            self._pending_chunk.append(escaped)
+        elif char == '\\':
+            self._escape = []
+        elif char == '"':
+            value = "".join(self._token)
+            self._token = []
+            if self._pending_chunk and not self._string_is_key:
+                self._events.append(("chunk", self._current_path(), "".join(self._pending_chunk)))
+            self._pending_chunk = []
+            if self._string_is_key:
+                frame = self._stack[-1]
+                frame.key = value
+                self._events.append(("key", frame.path, value))
+                self._state = _COLON
+            else:
+                self._complete_value(value)
+        else:
+            self._token.append(char)
+            self._pending_chunk.append(char)
+
+    def _feed_char(self, char: str):
+        state = self._state
+
+        if state == _STRING:
+            self._feed_string_char(char)
+            return
+
+        if state in (_NUMBER, _LITERAL):
+            if (state == _NUMBER and char in _NUMBER_CHARS) or (state == _LITERAL and char.isalpha()):
+                self._token.append(char)
+                return
+            self._finish_token()
+            state = self._state
+
+        if char in _WHITESPACE:
+            return
+
+        if state == _DONE:
+            self._error(f"unexpected character {char!r} after the end of the document")
+        elif state == _VALUE:
+            self._start_value(char)
+        elif state == _VALUE_OR_END:
+            if char == ']':
+                self._close("array")
+            else:
+                self._start_value(char)
+        elif state in (_KEY, _KEY_OR_END):
+            if char == '}' and state == _KEY_OR_END:
+                self._close("object")
+            elif char == '"':
+                self._state = _STRING
+                self._string_is_key = True
+            else:
+                self._error(f"expected an object key, got {char!r}")
+        elif state == _COLON:
+            if char != ':':
+                self._error(f"expected ':', got {char!r}")
+            self._state = _VALUE
+        elif state == _COMMA_OR_END:
+            frame = self._stack[-1]
+            if char == ',':
+                self._state = _KEY if frame.kind == "object" else _VALUE
+            elif char == '}' and frame.kind == "object":
+                self._close("object")
+            elif char == ']' and frame.kind == "array":
+                self._close("array")
+            else:
+                self._error(f"expected ',' or the end of the {frame.kind}, got {char!r}")
+
+def _is_list_type(return_type) -> bool:
+    return get_origin(return_type) == list
+
+class ResponseStreamParser():
+    """
+    Parses a streamed {"response": ...} envelope, producing typed results as soon as they are complete:
+    - for list[T] returns, each element, parsed to T
+    - for str returns, the text of the response as it arrives
+    - for any other return type, the whole parsed response once it is complete
+    """
+    def __init__(self, return_type: Any):
+        self._return_type = return_type
+        self._parser = IncrementalJSONParser()
+        self._response = None
+        self._has_response = False
+
+        if _is_list_type(return_type):
+            self._parse_item = type_parser.compile_parser(get_args(return_type)[0])
+        else:
+            self._parse_item = None
+        self._parse_response = type_parser.compile_parser(return_type)
+
+    @property
+    def response(self) -> Any:
+        if not self._has_response:
+            raise ValueError("response not in json_result")
+        return self._response
+
+    def feed(self, text: str) -> list[Any]:
+        return self._handle(self._parser.feed(text))
+
+    def close(self) -> list[Any]:
+        results = self._handle(self._parser.close())
+        if not self._has_response:
+            raise ValueError("response not in json_result")
+        return results
+
+    def _handle(self, events: list[tuple]) -> list[Any]:
+        results = []
+        for event, path, payload in events:
+            if not path or path[0] != "response":
+                if event == "begin" and path == () and payload != "object":
+                    raise ValueError("response not in json_result")
+                continue
+
+            if event == "value" and len(path) == 1:
+                self._response = self._parse_response(payload)
+                self._has_response = True
+                if self._parse_item is None and self._return_type is not str:
+                    results.append(self._response)
+            elif self._parse_item is not None and event == "value" and len(path) == 2:
+                results.append(self._parse_item(payload))
+            elif self._return_type is str and event == "chunk" and len(path) == 1:
+                results.append(payload)
+
+        return results
+
+class StreamValidationError(ValueError):
+    pass
+
+_ANY = object()
+_ENVELOPE = object()
+
+def _unwrap_optional(expected):
+    if type_parser._is_optional(expected):
+        return next(arg for arg in get_args(expected) if arg is not type(None)), True
+    return expected, False
+
+class StreamValidator():
+    """
+    Checks a streamed {"response": ...} envelope against a return type as it arrives, so a bad generation can be
+    cancelled at the first violation: a wrong JSON type, an unknown enum name, a missing dataclass field,
+    or an output longer than max_length characters. feed() raises StreamValidationError on the first violation.
+    """
+    def __init__(self, return_type: Any, max_length: Optional[int] = None):
+        self._return_type = return_type
+        self._max_length = max_length
+        self._length = 0
+        self._parser = IncrementalJSONParser()
+        self._expected = {(): _ENVELOPE}
+        self._string_prefixes = {}
+        self._has_response = False
+
+    def feed(self, text: str) -> list[Any]:
+        self._length += len(text)
+        if self._max_length is not None and self._length > self._max_length:
+            raise StreamValidationError(f"Output is longer than {self._max_length} characters")
+
+        try:
+            events = self._parser.feed(text)
+        except StreamValidationError:
+            raise
+        except ValueError as e:
+            raise StreamValidationError(str(e))
+
+        for event, path, payload in events:
+            self._check(event, path, payload)
+        return []
+
+    def close(self):
+        try:
+            self._parser.close()
+        except ValueError as e:
+            raise StreamValidationError(str(e))
+        if not self._has_response:
+            raise StreamValidationError("response not in json_result")
+
+    def _expected_type(self, path: tuple):
+        if path in self._expected:
+            return self._expected[path]
+
+        parent = self._expected_type(path[:-1])
+        parent, _ = _unwrap_optional(parent)
+        step = path[-1]
+        if parent is _ENVELOPE:
+            expected = self._return_type if step == "response" else _ANY
+        elif parent is _ANY:
+            expected = _ANY
+        elif dataclasses.is_dataclass(parent):
+            fields = {field.name: field.type for field in dataclasses.fields(parent)}
+            expected = fields.get(step, _ANY)
+        else:
+            origin = get_origin(parent)
+            args = get_args(parent)
+            if origin == list:
+                expected = args[0]
+            elif origin == dict:
+                expected = args[1]
+            elif origin == tuple:
+                if step >= len(args):
+                    raise StreamValidationError(f"{type_parser.format_json_path(path)} is past the end of {type_parser.type_to_string(parent)}")
+                expected = args[step]
+            else:
+                expected = _ANY
+
+        self._expected[path] = expected
+        return expected
+
+    def _violation(self, path: tuple, expected, found: str):
+        expected_string = type_parser.type_to_string(expected)
+        raise StreamValidationError(f"{type_parser.format_json_path(path)} should be {expected_string}, found {found}")
+
+    def _check(self, event: str, path: tuple, payload: Any):
+        if event == "key":
+            return
+
+        expected = self._expected_type(path)
+        if expected is _ANY:
+            return
+        if expected is _ENVELOPE:
+            if event == "begin" and payload != "object":
+                raise StreamValidationError("response should be wrapped in a JSON object")
+            return
+
+        expected, optional = _unwrap_optional(expected)
+        origin = get_origin(expected) or expected
+
+        if event == "begin":
+            if payload == "array" and origin not in (list, tuple):
+                self._violation(path, expected, "an array")
+            if payload == "object" and origin != dict and not dataclasses.is_dataclass(expected):
+                self._violation(path, expected, "an object")
+        elif event == "chunk":
+            if type_parser._is_enum(expected):
+                prefix = self._string_prefixes.get(path, "") + payload
+                self._string_prefixes[path] = prefix
+                if not any(member.name.startswith(prefix) for member in expected):
+                    self._violation(path, expected, f"a string starting with {prefix!r}")
+        elif event == "value":
+            if path == ("response",):
+                self._has_response = True
+            if payload is None:
+                if not optional:
+                    self._violation(path, expected, "null")
+            elif isinstance(payload, (list, dict)):
+                if dataclasses.is_dataclass(expected):
+                    for field in dataclasses.fields(expected):
+                        if field.name not in payload:
+                            raise StreamValidationError(f"Field {field.name} is missing from {type_parser.format_json_path(path)}")
+            elif type_parser._is_enum(expected):
+                if type(payload) != str or payload not in expected.__members__:
+                    self._violation(path, expected, repr(payload))
+            elif expected in (int, float):
+                if type(payload) not in (int, float) or (expected == int and payload != int(payload)):
+                    self._violation(path, expected, repr(payload))
+            elif expected in (str, bool):
+                if type(payload) != expected:
+                    self._violation(path, expected, repr(payload))
+            elif origin in (list, tuple, dict) or dataclasses.is_dataclass(expected):
+                self._violation(path, expected, repr(payload))
@@ -0,0 +1,177 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Optional, Union
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+DEFAULT_CHUNK_SIZE = 16
+
+# a scripted response: a message content, a ChatCompletion, or a function of the request kwargs returning either
+Response = Union[str, ChatCompletion, Callable[[dict[str, Any]], Union[str, ChatCompletion]]]
+
+def tool_call(id: str, name: str, arguments: dict[str, Any]) -> dict[str, Any]:
+    return {"id": id, "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+
+def completion(content: Optional[str] = None, tool_calls: Optional[list[dict[str, Any]]] = None, model: str = "fake-model", prompt_tokens: int = 0, completion_tokens: int = 0) -> ChatCompletion:
+    """
+    Builds a ChatCompletion with one choice, e.g. completion('{"response": 3}') or
+    completion(tool_calls=[tool_call("call_1", "add", {"a": 1})]).
+    """
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "tool_calls" if tool_calls else "stop",
+            "message": message,
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    })
+
+def _chunk(delta: dict[str, Any], model: str, finish_reason: Optional[str] = None) -> ChatCompletionChunk:
+    return ChatCompletionChunk.model_validate({
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    })
+
+def to_chunks(chat_completion: ChatCompletion, chunk_size: int = DEFAULT_CHUNK_SIZE) -> list[ChatCompletionChunk]:
+    """
+    Splits a completion into the chunks a streamed request would receive. Like the real API, a tool call's
+    arguments arrive in pieces after the chunk carrying its id and name.
+    """
+    message = chat_completion.choices[0].message
+    model = chat_completion.model
+    chunks = []
+    content = message.content or ""
+    for start in range(0, len(content), chunk_size):
+        chunks.append(_chunk({"content": content[start:start + chunk_size]}, model))
+    for index, call in enumerate(message.tool_calls or []):
+        arguments = call.function.arguments
+        chunks.append(_chunk({"tool_calls": [{
+            "index": index,
+            "id": call.id,
+            "type": "function",
+            "function": {"name": call.function.name, "arguments": arguments[:chunk_size]},
+        }]}, model))
+        for start in range(chunk_size, len(arguments), chunk_size):
+            chunks.append(_chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[start:start + chunk_size]}}]}, model))
+    chunks.append(_chunk({}, model, chat_completion.choices[0].finish_reason))
+    return chunks
+
+class _FakeStream():
+    def __init__(self, chunks: list[ChatCompletionChunk]):
+        self._chunks = iter(chunks)
+        self.closed = False
+        # chunks handed out so far
+        self.consumed = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        chunk = next(self._chunks)
+        self.consumed += 1
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+class _FakeAsyncStream(_FakeStream):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return self.__next__()
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+class FakeClient():
+    """
+    An in-process stand-in for openai.Client, for tests and benchmarks that shouldn't need an API key.
+    It implements chat.completions.create by replaying responses in order, after sleeping `latency` seconds.
+    Once the script is exhausted, `default` answers every request, or a RuntimeError is raised if it is None.
+    Every request's kwargs are kept in `requests`, and the fake streams returned for streamed requests in `streams`.
+
+    Usage:
+        ai = Fructose(client=FakeClient(['{"response": 3}'], latency=0.2))
+    """
+    def __init__(self, responses: Optional[list[Response]] = None, latency: float = 0.0, default: Optional[Response] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.requests = []
+        self.streams = []
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self._responses = iter(responses or [])
+        self._default = default
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=self)
+
+    def _next_response(self, kwargs: dict[str, Any]) -> ChatCompletion:
+        with self._lock:
+            self.requests.append(kwargs)
+            response = next(self._responses, None)
+        if response is None:
+            response = self._default
+        if response is None:
+            raise RuntimeError(f"FakeClient has no response left for request {len(self.requests)}")
+        if callable(response):
+            response = response(kwargs)
+        if isinstance(response, str):
+            response = completion(response, model=kwargs.get("model", "fake-model"))
+        return response
+
+    def create(self, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        response = self._next_response(kwargs)
+        if kwargs.get("stream"):
+            stream = _FakeStream(to_chunks(response, self.chunk_size))
+            self.streams.append(stream)
+            return stream
+        return response
+
+class FakeAsyncClient(FakeClient):
+    """
+    The async version of FakeClient, sleeping on the event loop.
+    """
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        response = self._next_response(kwargs)
+        if kwargs.get("stream"):
+            stream = _FakeAsyncStream(to_chunks(response, self.chunk_size))
+            self.streams.append(stream)
+            return stream
+        return response
+
+def cycle(responses: list[Response]) -> Callable[[dict[str, Any]], Union[str, ChatCompletion]]:
+    """
+    A default response that repeats the given responses forever, for benchmarks.
+    """
+    responses = itertools.cycle(responses)
+    lock = threading.Lock()
+
+    def next_response(kwargs):
+        with lock:
+            response = next(responses)
+        return response(kwargs) if callable(response) else response
+    return next_response
@@ -0,0 +1,170 @@
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+import functools
+import inspect
+import json
+import threading
+import time
+import typing
+from typing import Any, Callable, Optional
+from . import function_helpers, type_parser
+
+DEFAULT_TOOL_WORKERS = 32
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+def get_default_executor() -> Executor:
+    """
+    The thread pool shared by all handlers to run tool calls of the same turn concurrently.
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(max_workers=DEFAULT_TOOL_WORKERS, thread_name_prefix="fructose-tool")
+        return _default_executor
+
+def _tool_error(tool_call, error: BaseException) -> dict[str, str]:
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return {"error": f"Tool {tool_call.function.name} timed out"}
+    return {"error": f"Tool {tool_call.function.name} raised {type(error).__name__}: {error}"}
+
+def _identity(value):
+    return value
+
+def _compile_argument_decoder(type_: Any) -> Callable[[Any], Any]:
+    if type_ is inspect.Parameter.empty or not type_parser.is_supported_return_type(type_):
+        return _identity
+    return type_parser.compile_parser(type_)
+
+class Tool():
+    """
+    A function the LLM can call, with its OpenAI schema and argument decoders built once.
+    """
+    def __init__(self, func: Callable[..., Any]):
+        self.func = func
+        self.name = func.__name__
+        self.schema = function_helpers.convert_function_to_openai_function(func)
+
+        type_hints = typing.get_type_hints(func)
+        self._decoders = {
+            name: _compile_argument_decoder(type_hints.get(name, param.annotation))
+            for name, param in inspect.signature(func).parameters.items()
+        }
+
+    def decode_arguments(self, arguments: str) -> dict[str, Any]:
+        """
+        Decodes the JSON arguments of a tool call into typed python values.
+        """
+        json_arguments = json.loads(arguments) if arguments else {}
+        if type(json_arguments) != dict:
+            raise ValueError(f"Arguments {arguments} for tool {self.name} are not a JSON object")
+
+        decoded = {}
+        for name, value in json_arguments.items():
+            if name not in self._decoders:
+                raise ValueError(f"Unknown argument {name} for tool {self.name}")
+            decoded[name] = self._decoders[name](value)
+        return decoded
+
+    @property
+    def is_async(self) -> bool:
+        return inspect.iscoroutinefunction(self.func)
+
+    def __call__(self, arguments: str) -> Any:
+        return self.func(**self.decode_arguments(arguments))
+
+def _timed_call(func: Callable[..., Any], arguments: dict[str, Any]) -> tuple[Any, float]:
+    # module level, so that it can be pickled for a ProcessPoolExecutor
+    start = time.perf_counter()
+    result = func(**arguments)
+    return result, time.perf_counter() - start
+
+class ToolRegistry():
+    """
+    The tools available to an LLM function, built once per handler.
+    """
+    def __init__(self, funcs: Optional[list[Callable[..., Any]]]):
+        self._tools = {func.__name__: Tool(func) for func in funcs or []}
+        self.schemas = [tool.schema for tool in self._tools.values()] or None
+
+    def __getitem__(self, name: str) -> Tool:
+        return self._tools[name]
+
+    def __len__(self):
+        return len(self._tools)
+
+    def call(self, tool_call) -> Any:
+        return self._tools[tool_call.function.name](tool_call.function.arguments)
+
+    def run(self, tool_calls: list, executor: Optional[Executor] = None, timeout: Optional[float] = None, on_done: Optional[Callable[[int, float, Any], None]] = None) -> list[Any]:
+        """
+        Runs the tool calls of one model turn concurrently on an executor (a thread pool by default,
+        or e.g. a ProcessPoolExecutor for CPU-heavy tools) and returns their results in tool_calls order.
+        A tool that raises or exceeds `timeout` seconds returns an error object for the model instead.
+        on_done, if given, is called with the index, duration in seconds and result of each tool call.
+        """
+        start = time.perf_counter()
+        # a lone call runs inline, unless it has to go to the configured executor or be timed out
+        if len(tool_calls) == 1 and timeout is None and executor is None:
+            result = self._run_one(tool_calls[0])
+            if on_done is not None:
+                on_done(0, time.perf_counter() - start, result)
+            return [result]
+
+        executor = executor or get_default_executor()
+        futures = []
+        for tool_call in tool_calls:
+            try:
+                tool = self._tools[tool_call.function.name]
+                futures.append(executor.submit(_timed_call, tool.func, tool.decode_arguments(tool_call.function.arguments)))
+            except Exception as e:
+                futures.append(e)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        results = []
+        for i, (tool_call, future) in enumerate(zip(tool_calls, futures)):
+            duration = None
+            if isinstance(future, Exception):
+                result = _tool_error(tool_call, future)
+            else:
+                try:
+                    remaining = None if deadline is None else max(0, deadline - time.monotonic())
+                    result, duration = future.result(timeout=remaining)
+                except Exception as e:
+                    future.cancel()
+                    result = _tool_error(tool_call, e)
+            if on_done is not None:
+                on_done(i, duration if duration is not None else time.perf_counter() - start, result)
+            results.append(result)
+        return results
+
+    def _run_one(self, tool_call) -> Any:
+        try:
+            return self.call(tool_call)
+        except Exception as e:
+            return _tool_error(tool_call, e)
+
+    async def arun(self, tool_calls: list, executor: Optional[Executor] = None, timeout: Optional[float] = None, on_done: Optional[Callable[[int, float, Any], None]] = None) -> list[Any]:
+        """
+        Async version of run. async def tools are awaited on the event loop, other tools run on the executor.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def run_one(i, tool_call):
+            start = time.perf_counter()
+            try:
+                tool = self._tools[tool_call.function.name]
+                arguments = tool.decode_arguments(tool_call.function.arguments)
+                if tool.is_async:
+                    pending = tool.func(**arguments)
+                else:
+                    pending = loop.run_in_executor(executor or get_default_executor(), functools.partial(tool.func, **arguments))
+                result = await asyncio.wait_for(pending, timeout)
+            except Exception as e:
+                result = _tool_error(tool_call, e)
+            if on_done is not None:
+                on_done(i, time.perf_counter() - start, result)
+            return result
+
+        return list(await asyncio.gather(*[run_one(i, tool_call) for i, tool_call in enumerate(tool_calls)]))
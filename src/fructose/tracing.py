@@ -0,0 +1,145 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Any, Optional
+
+# the open spans of the LLM function call currently being stepped, set by the handler's drivers
+active_spans = contextvars.ContextVar("fructose_active_spans", default=None)
+
+class Span():
+    """
+    A timed phase of an LLM function call. Spans of one call share a trace_id and point to their parent.
+    The outcome is "ok", "error" (with the error in attributes) or "cancelled".
+    """
+    def __init__(self, tracer: 'Tracer', name: str, parent: Optional['Span'] = None, start_time: Optional[float] = None, **attributes: Any):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_time = start_time if start_time is not None else time.time()
+        self.end_time = None
+        self.outcome = "ok"
+        self.attributes = attributes
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self, end_time: Optional[float] = None):
+        self.end_time = end_time if end_time is not None else time.time()
+        self._tracer.export(self)
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end_time is None else self.end_time - self.start_time
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is GeneratorExit:
+            self.outcome = "cancelled"
+        elif exc is not None:
+            self.outcome = "error"
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        self.end()
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.duration,
+            "outcome": self.outcome,
+            "attributes": self.attributes,
+        }
+
+class _NoopSpan():
+    """
+    Stands in for spans when no tracer is installed, so instrumented code doesn't need to check.
+    """
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Tracer():
+    """
+    Creates spans and hands finished ones to its exporters. Subclass it and override start_span or export
+    to bridge to another tracing system.
+
+    Usage:
+        ai = Fructose(tracer=Tracer(JSONLExporter("traces.jsonl")))
+    """
+    def __init__(self, *exporters):
+        self.exporters = list(exporters)
+
+    def start_span(self, name: str, parent: Optional[Span] = None, start_time: Optional[float] = None, **attributes: Any) -> Span:
+        return Span(self, name, parent, start_time, **attributes)
+
+    def export(self, span: Span):
+        for exporter in self.exporters:
+            exporter.export(span)
+
+class InMemoryExporter():
+    """
+    Keeps finished spans in a list, for tests.
+    """
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def find(self, name: str) -> list[Span]:
+        return [span for span in self.spans if span.name == name]
+
+class JSONLExporter():
+    """
+    Appends finished spans to a file, one JSON object per line.
+    """
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=repr)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+@contextlib.contextmanager
+def start_active_span(tracer: Tracer, name: str, **attributes: Any):
+    """
+    Opens a span as a child of the innermost open span of the current call, if any, and makes it the innermost.
+    """
+    stack = active_spans.get()
+    parent = stack[-1] if stack else None
+    with tracer.start_span(name, parent, **attributes) as span:
+        if stack is None:
+            yield span
+            return
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.remove(span)
@@ -1,6 +1,8 @@
 from enum import Enum
+import functools
+import re
 import types
-from typing import Union, get_origin, get_type_hints, Any, get_args
+from typing import Callable, Optional, Union, get_origin, get_type_hints, Any, get_args
 import dataclasses
 
 _primitive_types = set([int, str, float, bool])
@@ -12,6 +14,33 @@ class InvalidTypeException(Exception):
 class EmptyReturnException(Exception):
     pass
 
+class ParseError(ValueError):
+    """
+    A value doesn't match the expected type. path locates it inside the response, as object keys and array indices.
+    """
+    def __init__(self, message: str, path: tuple = ()):
+        super().__init__(message)
+        self.message = message
+        self.path = path
+
+    def __str__(self):
+        if not self.path:
+            return self.message
+        return f"{format_json_path(('response', *self.path))}: {self.message}"
+
+def _with_path(error: ValueError, step) -> ParseError:
+    if isinstance(error, ParseError):
+        return ParseError(error.message, (step, *error.path))
+    return ParseError(str(error), (step,))
+
+def _locate_error(items, parse_item):
+    # only called once parsing failed, so the happy path doesn't pay for tracking positions
+    for step, item in items:
+        try:
+            parse_item(step, item)
+        except ValueError as e:
+            raise _with_path(e, step) from None
+
 def _is_supported_dataclass(cls):
     if not dataclasses.is_dataclass(cls):
         return False
@@ -82,106 +111,183 @@ def is_supported_return_type(return_type):
         _is_supported_wrapper_type(return_type),
     ])
 
-def _parse_tuple(json_result, return_type: type[tuple]):
-    if type(json_result) != list:
-        raise ValueError(f"Value {json_result} is not of type {list}")
-    typed_tuple = []
-    sub_types = get_args(return_type)
-    if not sub_types:
-        return tuple(json_result)
-    for item, sub_type in zip(json_result, sub_types):
-        item = parse_json_to_type(item, sub_type)
-        typed_tuple.append(item)
-
-    return tuple(typed_tuple)
-
-def _parse_list(json_result, return_type: type[list]):
-    if type(json_result) != list:
-        raise ValueError(f"Value {json_result} is not of type {list}")
-    typed_list = []
-    sub_type = get_args(return_type)[0]
-    for item in json_result:
-        item = parse_json_to_type(item, sub_type)
-        typed_list.append(item)
-
-    return typed_list
-
-def _parse_dict(json_result, return_type: type[dict]):
+def format_json_path(path: tuple) -> str:
+    """
+    Formats a path of object keys and array indices, e.g. ("response", 3, "name") -> response[3].name
+    """
+    formatted = ""
+    for step in path:
+        if isinstance(step, int):
+            formatted += f"[{step}]"
+        else:
+            formatted += f".{step}" if formatted else str(step)
+    return formatted or "$"
+
+def type_at_path(return_type: Any, path: tuple) -> Any:
+    """
+    Returns the type expected at a path inside a value of return_type.
+    """
+    for step in path:
+        if _is_optional(return_type):
+            return_type = next(arg for arg in get_args(return_type) if arg is not type(None))
+        origin = get_origin(return_type)
+        args = get_args(return_type)
+        if dataclasses.is_dataclass(return_type):
+            return_type = {field.name: field.type for field in dataclasses.fields(return_type)}[step]
+        elif origin == list:
+            return_type = args[0]
+        elif origin == dict:
+            return_type = args[1]
+        elif origin == tuple:
+            return_type = args[step]
+        else:
+            raise InvalidTypeException(f"Type {return_type} has no element at {step}")
+    return return_type
+
+def _check_json_type(json_result, json_type):
+    if type(json_result) != json_type:
+        raise ValueError(f"Value {json_result} is not of type {json_type}")
+
+def _compile_primitive(return_type):
+    def parse(json_result):
+        try:
+            casted_result = return_type(json_result)
+        except TypeError:
+            raise ValueError(f"Value {json_result} is not of type {return_type}")
+        if casted_result != json_result:
+            raise ValueError(f"Value {json_result} is not of type {return_type}")
+        # bool is a special case since it's a subclass of int
+        if bool in [return_type, type(json_result)] and type(json_result) != return_type:
+            raise ValueError(f"Value {json_result} is not of type {return_type}")
+        return casted_result
+
+    return parse
+
+def _compile_tuple(return_type: type[tuple]):
+    sub_parsers = [_compile(sub_type) for sub_type in get_args(return_type)]
+
+    def parse(json_result):
+        _check_json_type(json_result, list)
+        if not sub_parsers:
+            return tuple(json_result)
+        try:
+            return tuple(sub_parser(item) for item, sub_parser in zip(json_result, sub_parsers))
+        except ValueError:
+            _locate_error(enumerate(json_result[:len(sub_parsers)]), lambda i, item: sub_parsers[i](item))
+            raise
+
+    return parse
+
+def _compile_list(return_type: type[list]):
+    parse_item = _compile(get_args(return_type)[0])
+
+    def parse(json_result):
+        _check_json_type(json_result, list)
+        try:
+            return [parse_item(item) for item in json_result]
+        except ValueError:
+            _locate_error(enumerate(json_result), lambda i, item: parse_item(item))
+            raise
+
+    return parse
+
+def _compile_dict(return_type: type[dict]):
     key_type, val_type = get_args(return_type)
-    typed_dict = {}
-    for key, val in json_result.items():
-        typed_key = parse_json_to_type(key, key_type)
-        typed_val = parse_json_to_type(val, val_type)
-        typed_dict[typed_key] = typed_val
+    parse_key = _compile(key_type)
+    parse_val = _compile(val_type)
 
-    return typed_dict
+    def parse(json_result):
+        _check_json_type(json_result, dict)
+        try:
+            return {parse_key(key): parse_val(val) for key, val in json_result.items()}
+        except ValueError:
+            _locate_error(json_result.items(), lambda key, val: (parse_key(key), parse_val(val)))
+            raise
 
-def _parse_enum(json_result, enum):
-    if type(json_result) != str:
-        raise ValueError(f"Value {json_result} is not of type {str}")
+    return parse
 
+def _compile_enum(enum):
     # match enum on name
-    for member in enum:
-        if member.name == json_result:
-            return member
+    members = {member.name: member for member in enum}
+
+    def parse(json_result):
+        _check_json_type(json_result, str)
+        try:
+            return members[json_result]
+        except KeyError:
+            raise ValueError(f"Value {json_result} is not a valid member of {enum}")
 
-    raise ValueError(f"Value {json_result} is not a valid member of {enum}")
+    return parse
 
-def _parse_optional(json_result, return_type: type[Union]):
+def _compile_optional(return_type: type[Union]):
     args = get_args(return_type)
     if len(args) != 2 or not any(arg is type(None) for arg in args) or all(arg is type(None) for arg in args):
         raise ValueError(f"Union type {return_type} is not supported by Fructose.")
 
-    if json_result is None:
-        return None
-
     sub_type = next(arg for arg in args if arg is not type(None))
-    return parse_json_to_type(json_result, sub_type)
-
-_json_type_parser_lookup = {
-    list: _parse_list,
-    dict: _parse_dict,
-    tuple: _parse_tuple,
-    Union: _parse_optional,
+    parse_sub_type = _compile(sub_type)
+
+    def parse(json_result):
+        if json_result is None:
+            return None
+        return parse_sub_type(json_result)
+
+    return parse
+
+def _compile_dataclass(return_type):
+    field_parsers = [(field.name, _compile(field.type)) for field in dataclasses.fields(return_type)]
+
+    def parse(json_result):
+        _check_json_type(json_result, dict)
+        args = {}
+        for field_name, parse_field in field_parsers:
+            if field_name not in json_result:
+                raise ValueError(f"Field {field_name} is missing from the JSON object representing {return_type}")
+            try:
+                args[field_name] = parse_field(json_result[field_name])
+            except ValueError as e:
+                raise _with_path(e, field_name) from None
+
+        return return_type(**args)
+
+    return parse
+
+_json_type_compiler_lookup = {
+    list: _compile_list,
+    dict: _compile_dict,
+    tuple: _compile_tuple,
+    Union: _compile_optional,
 }
 
-def _parse_dataclass(json_result, return_type):
-    if type(json_result) != dict:
-        raise ValueError(f"Value {json_result} is not of type {dict}")
-    args = {}
-    for field in dataclasses.fields(return_type):
-        field_name = field.name
-        field_type = field.type
-        if field_name not in json_result:
-            raise ValueError(f"Field {field_name} is missing from the JSON object representing {return_type}")
-        args[field_name] = parse_json_to_type(json_result[field_name], field_type)
-
-    return return_type(**args)
-
-def parse_json_to_type(json_result: dict, return_type: Any) -> Any:
-    """
-    Parse a JSON object to a given type.
-    """
-    assert is_supported_return_type(return_type), f"Type {return_type} is not supported by Fructose."
+def _compile(return_type):
     origin = get_origin(return_type) or return_type
 
-    if origin in _json_type_parser_lookup:
-        return _json_type_parser_lookup[origin](json_result, return_type)
+    if origin in _json_type_compiler_lookup:
+        return _json_type_compiler_lookup[origin](return_type)
     elif _is_enum(return_type):
-        return _parse_enum(json_result, return_type)
+        return _compile_enum(return_type)
     elif dataclasses.is_dataclass(return_type):
-        return _parse_dataclass(json_result, return_type)
+        return _compile_dataclass(return_type)
     elif return_type in _primitive_types:
-        casted_result = return_type(json_result)
-        if casted_result != json_result:
-            raise ValueError(f"Value {json_result} is not of type {return_type}")
-        # bool is a special case since it's a subclass of int
-        if bool in [return_type, type(json_result)] and type(json_result) != return_type:
-            raise ValueError(f"Value {json_result} is not of type {return_type}")
-        return casted_result
+        return _compile_primitive(return_type)
 
     raise InvalidTypeException(f"Type {return_type} is not supported by Fructose")
 
+@functools.lru_cache(maxsize=None)
+def compile_parser(return_type: Any) -> Callable[[Any], Any]:
+    """
+    Validates a return type once and builds a parser specialized for it.
+    The parser converts a JSON value to the return type, raising ValueError if it doesn't match.
+    """
+    assert is_supported_return_type(return_type), f"Type {return_type} is not supported by Fructose."
+    return _compile(return_type)
+
+def parse_json_to_type(json_result: dict, return_type: Any) -> Any:
+    """
+    Parse a JSON object to a given type.
+    """
+    return compile_parser(return_type)(json_result)
+
 
 def _describe_dataclass_as_dict(cls) -> dict:
     if not dataclasses.is_dataclass(cls):
@@ -237,3 +343,117 @@ def type_to_string(my_type) -> str:
         return _wrapper_to_string(my_type)
 
     raise InvalidTypeException(f"Invalid type: {my_type}")
+
+
+_json_schema_primitive_lookup = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+}
+
+def _def_name(tp, defs: dict, names: dict) -> tuple[str, bool]:
+    """
+    The $defs key of an enum or dataclass and whether it is new. That's the class name, qualified with its module
+    when a different class of the same name already took it.
+    """
+    if tp in names:
+        return names[tp], False
+    name = tp.__name__
+    if name in defs:
+        name = re.sub(r"[^A-Za-z0-9_]", "_", f"{tp.__module__}.{tp.__qualname__}")
+        base, suffix = name, 2
+        while name in defs:
+            name, suffix = f"{base}_{suffix}", suffix + 1
+    names[tp] = name
+    return name, True
+
+def _json_schema(tp, defs: dict, names: dict) -> dict:
+    if _is_optional(tp):
+        sub_type = next(arg for arg in get_args(tp) if arg is not type(None))
+        return {"anyOf": [_json_schema(sub_type, defs, names), {"type": "null"}]}
+    if _is_enum(tp):
+        name, new = _def_name(tp, defs, names)
+        if new:
+            defs[name] = {"type": "string", "enum": [member.name for member in tp]}
+        return {"$ref": f"#/$defs/{name}"}
+    if dataclasses.is_dataclass(tp):
+        name, new = _def_name(tp, defs, names)
+        if new:
+            # reserve the name first, so self-referencing dataclasses terminate
+            defs[name] = {}
+            type_hints = get_type_hints(tp)
+            fields = dataclasses.fields(tp)
+            defs[name] = {
+                "type": "object",
+                "properties": {field.name: _json_schema(type_hints[field.name], defs, names) for field in fields},
+                "required": [field.name for field in fields],
+                "additionalProperties": False,
+            }
+        return {"$ref": f"#/$defs/{name}"}
+    if tp in _primitive_types:
+        return {"type": _json_schema_primitive_lookup[tp]}
+
+    origin = get_origin(tp)
+    args = get_args(tp)
+    if origin == list:
+        return {"type": "array", "items": _json_schema(args[0], defs, names)}
+    if origin == dict:
+        return {"type": "object", "additionalProperties": _json_schema(args[1], defs, names)}
+    if origin == tuple:
+        return {
+            "type": "array",
+            "prefixItems": [_json_schema(arg, defs, names) for arg in args],
+            "items": False,
+            "minItems": len(args),
+            "maxItems": len(args),
+        }
+
+    raise InvalidTypeException(f"Invalid type: {tp}")
+
+def type_to_json_schema(my_type) -> dict:
+    """
+    Returns a JSON Schema describing a supported type. Dataclasses and enums are
+    placed in $defs and referenced by name, qualified with their module if two share a name.
+    """
+    defs = {}
+    schema = _json_schema(my_type, defs, {})
+    if defs:
+        schema["$defs"] = defs
+    return schema
+
+def object_json_schema(field_types: dict[str, Any], required: Optional[list[str]] = None) -> dict:
+    """
+    Returns the JSON Schema of an object with the given field types, all required unless `required` lists them.
+    The dataclasses and enums of every field share one $defs.
+    """
+    defs = {}
+    names = {}
+    schema = {
+        "type": "object",
+        "properties": {name: _json_schema(field_type, defs, names) for name, field_type in field_types.items()},
+        "required": list(field_types) if required is None else required,
+        "additionalProperties": False,
+    }
+    if defs:
+        schema["$defs"] = defs
+    return schema
+
+def response_json_schema(return_type) -> dict:
+    """
+    Returns the JSON Schema of the {"response": ...} envelope the LLM answers with.
+    """
+    return object_json_schema({"response": return_type})
+
+def is_strict_json_schema(schema: Any) -> bool:
+    """
+    Whether a schema stays within the subset of JSON Schema that strict structured outputs accept,
+    which has no free-form dict keys or tuples.
+    """
+    if isinstance(schema, list):
+        return all(is_strict_json_schema(item) for item in schema)
+    if not isinstance(schema, dict):
+        return True
+    if "prefixItems" in schema or schema.get("additionalProperties", False) is not False:
+        return False
+    return all(is_strict_json_schema(value) for value in schema.values())
@@ -1,8 +1,11 @@
 from dataclasses import dataclass
+import os
 import re
 from typing import Optional
-from fructose import Fructose
-ai = Fructose()
+from fructose import Fructose, cassette
+
+# set FRUCTOSE_CASSETTE=replay to run against recorded responses, offline (see fructose.cassette)
+ai = Fructose(client=cassette.client_from_env(os.path.join(os.path.dirname(__file__), "cassettes", "test_ai_e2e.json")))
 
 # In all cases, we assert the return type
 
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+from fructose import Fructose
+from fructose.batch import BatchItemError, LocalBatchProvider
+from fructose.testing import FakeClient
+
+
+def _is_even(ai):
+    @ai
+    def is_even(n: int) -> bool:
+        """
+        Return whether n is even.
+        """
+    return is_even
+
+def test_batch_round_trip(tmp_path):
+    requests_path, results_path, retry_path = (str(tmp_path / name) for name in ["requests.jsonl", "results.jsonl", "retry.jsonl"])
+    is_even = _is_even(Fructose(client=FakeClient(), model="test-model"))
+    assert is_even.batch_submit(range(4), requests_path) == 4
+
+    lines = [json.loads(line) for line in open(requests_path)]
+    assert [line["custom_id"] for line in lines] == ["is_even-0", "is_even-1", "is_even-2", "is_even-3"]
+    assert lines[1]["url"] == "/v1/chat/completions" and lines[1]["body"]["model"] == "test-model"
+    assert [message["role"] for message in lines[1]["body"]["messages"]] == ["system", "user"]
+    assert lines[1]["body"]["messages"][1]["content"] == '{"n":1}'
+
+    def answer(request):
+        n = json.loads(request["messages"][1]["content"])["n"]
+        if n == 3:
+            raise RuntimeError("overloaded")
+        return '{"response": "maybe"}' if n == 2 else json.dumps({"response": n % 2 == 0})
+
+    LocalBatchProvider(FakeClient(default=answer)).run(requests_path, results_path)
+    results = dict(is_even.batch_collect(results_path, requests_path, retry_path))
+
+    assert results["is_even-0"] is True and results["is_even-1"] is False
+    assert isinstance(results["is_even-2"], BatchItemError) and isinstance(results["is_even-3"], BatchItemError)
+    assert sorted(json.loads(line)["custom_id"] for line in open(retry_path)) == ["is_even-2", "is_even-3"]
+
+def test_batch_collect_in_a_fresh_process(tmp_path):
+    results_path = tmp_path / "results.jsonl"
+    body = {"choices": [{"message": {"role": "assistant", "content": '{"response": true}'}}]}
+    results_path.write_text(json.dumps({"custom_id": "is_even-0", "response": {"status_code": 200, "body": body}}) + "\n")
+    # a function that was never called or submitted, like after a restart
+    is_even = _is_even(Fructose(client=FakeClient()))
+    assert list(is_even.batch_collect(str(results_path))) == [("is_even-0", True)]
+
+def test_batch_rejects_multi_turn_functions(tmp_path):
+    ai = Fructose(client=FakeClient())
+
+    @ai(flavors=["chain_of_thought"])
+    def think(n: int) -> int:
+        """
+        Think about n.
+        """
+
+    with pytest.raises(ValueError):
+        think.batch_submit([1], str(tmp_path / "requests.jsonl"))
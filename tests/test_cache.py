@@ -0,0 +1,71 @@
+import time
+
+from fructose import Fructose
+from fructose.cache import MemoryCache, ResponseCache, SQLiteCache, fingerprint
+from fructose.testing import FakeClient, completion
+
+
+def test_fingerprint_is_stable():
+    assert fingerprint(a=1, b=[1, 2]) == fingerprint(b=[1, 2], a=1)
+    assert fingerprint(a=1) != fingerprint(a=2)
+
+def test_memory_cache_lru():
+    memory = MemoryCache(max_entries=2)
+    memory.set("a", "1")
+    memory.set("b", "2")
+    assert memory.get("a") == "1"
+    memory.set("c", "3")
+    assert memory.get("b") is None
+    assert memory.get("a") == "1"
+    assert memory.get("c") == "3"
+
+def test_sqlite_cache_ttl_and_eviction(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    disk = SQLiteCache(path, max_entries=2)
+    disk.set("a", "1")
+    disk.set("b", "2")
+    disk.set("c", "3")
+    assert len(disk) == 2
+    assert disk.get("a") is None
+
+    # a second instance (e.g. another process) sees the same entries
+    assert SQLiteCache(path).get("c") == "3"
+
+    expiring = SQLiteCache(str(tmp_path / "ttl.sqlite"), ttl=0.01)
+    expiring.set("a", "1")
+    time.sleep(0.02)
+    assert expiring.get("a") is None
+
+def test_handler_uses_cache(tmp_path):
+    response_cache = ResponseCache(path=str(tmp_path / "cache.sqlite"))
+    client = FakeClient([completion('{"response": 3}'), completion('{"response": 5}')])
+    ai = Fructose(client=client, cache=response_cache)
+
+    @ai
+    def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    assert add(1, 2) == 3
+    assert add(1, 2) == 3
+    assert len(client.requests) == 1
+    assert response_cache.stats()["hits"] == 1
+
+    assert add(2, 3) == 5
+    assert response_cache.stats()["misses"] == 2
+
+def test_handler_bypasses_cache_for_random():
+    response_cache = ResponseCache()
+    client = FakeClient([completion('{"response": "a"}'), completion('{"response": "b"}')])
+    ai = Fructose(client=client, cache=response_cache)
+
+    @ai(flavors=["random"])
+    def pick_word() -> str:
+        """
+        Pick a random word.
+        """
+
+    assert pick_word() == "a"
+    assert pick_word() == "b"
+    assert response_cache.stats()["hits"] == 0
@@ -0,0 +1,113 @@
+import asyncio
+from typing import Optional
+
+import pytest
+
+from fructose import AsyncFructose, Fructose
+from fructose.cascade import CascadePolicy, CascadeValidationError
+from fructose.metrics import MetricsRegistry
+from fructose.testing import FakeAsyncClient, FakeClient
+
+
+def _by_model(answers):
+    return lambda request: answers[request["model"]]
+
+def test_escalates_when_parsing_fails():
+    client = FakeClient(default=_by_model({"fast": '{"response": "two"}', "strong": '{"response": 2}'}))
+    metrics = MetricsRegistry()
+    ai = Fructose(client=client, metrics=metrics)
+
+    @ai(model=["fast", "strong"])
+    def two() -> int:
+        """
+        Return 2.
+        """
+
+    assert two() == 2
+    # the fast model doesn't retry, escalating replaces its retries
+    assert [request["model"] for request in client.requests] == ["fast", "strong"]
+    assert two.cascade_stats()["fast"] == {"calls": 1, "escalations": 1, "skipped": 0, "escalation_rate": 1.0}
+    assert two.cascade_stats()["strong"]["escalations"] == 0
+    fast = next(snapshot for snapshot in metrics.snapshot() if snapshot["model"] == "fast")
+    assert fast["counters"]["escalations"] == 1
+
+def test_optional_results_escalate_instead_of_returning_none():
+    client = FakeClient(default=_by_model({"fast": '{"response": "two"}', "strong": '{"response": "two"}'}))
+    ai = Fructose(client=client, model=["fast", "strong"])
+
+    @ai
+    def two() -> Optional[int]:
+        """
+        Return 2.
+        """
+
+    assert two() is None
+    # the last model still gives up with None, like the function would without a cascade
+    assert [request["model"] for request in client.requests] == ["fast", "strong", "strong", "strong", "strong"]
+    assert two.cascade_stats()["fast"]["escalations"] == 1
+
+def test_validator_rejection_escalates():
+    client = FakeClient(default=_by_model({"fast": '{"response": 1}', "strong": '{"response": 2}'}))
+    ai = Fructose(client=client, model=["fast", "strong"])
+
+    @ai(validator=lambda n: n % 2 == 0)
+    def even() -> int:
+        """
+        Return an even number.
+        """
+
+    assert even() == 2
+
+    @ai(model="strong", validator=lambda n: n > 2)
+    def big() -> int:
+        """
+        Return a number above 2.
+        """
+
+    with pytest.raises(CascadeValidationError):
+        big()
+
+def test_skips_a_model_that_almost_always_fails():
+    client = FakeClient(default=_by_model({"fast": '{"response": "x"}', "strong": '{"response": 2}'}))
+    ai = Fructose(client=client)
+
+    @ai(model=["fast", "strong"], cascade=CascadePolicy(min_samples=3, probe_every=3))
+    def two() -> int:
+        """
+        Return 2.
+        """
+
+    for _ in range(6):
+        assert two() == 2
+    # after 3 failures, 2 calls go straight to the strong model and the third probes the fast one again
+    assert [request["model"] for request in client.requests].count("fast") == 4
+    assert two.cascade_stats()["fast"]["skipped"] == 2
+
+def test_async_cascade():
+    client = FakeAsyncClient(default=_by_model({"fast": '{"response": "x"}', "strong": '{"response": 2}'}))
+    ai = AsyncFructose(client=client, model=["fast", "strong"])
+
+    @ai
+    def two() -> int:
+        """
+        Return 2.
+        """
+
+    assert asyncio.run(two()) == 2
+    assert two.cascade_stats()["fast"]["escalations"] == 1
+
+def test_stream_and_batch_jobs_reject_cascades(tmp_path):
+    ai = Fructose(client=FakeClient(), model=["fast", "strong"])
+
+    @ai
+    def two() -> int:
+        """
+        Return 2.
+        """
+
+    with pytest.raises(ValueError):
+        list(two.stream())
+    with pytest.raises(ValueError):
+        two.batch_submit([1], str(tmp_path / "requests.jsonl"))
+    with pytest.raises(ValueError):
+        two.batch_collect(str(tmp_path / "results.jsonl"))
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from fructose import Fructose
+from fructose.cassette import AsyncRecordingClient, CassetteMissError, RecordingClient, request_key
+from fructose.testing import FakeAsyncClient, FakeClient
+
+
+def _define(ai):
+    @ai(flavors=["random"])
+    def pick(options: list[str]) -> str:
+        """
+        Pick one of the options at random.
+        """
+
+    @ai
+    def count(words: list[str]) -> int:
+        """
+        Count the words.
+        """
+
+    return pick, count
+
+def test_record_then_replay(tmp_path):
+    path = str(tmp_path / "cassette.json")
+    upstream = FakeClient(['{"response": "b"}', '{"response": 2}'])
+    pick, count = _define(Fructose(client=RecordingClient(upstream, path, mode='record')))
+    assert pick(["a", "b"]) == "b" and count(["a", "b"]) == 2
+
+    replaying = RecordingClient(None, path, mode='replay')
+    pick, count = _define(Fructose(client=replaying))
+    # the random seed differs between runs, but the recording still matches
+    assert pick(["a", "b"]) == "b" and pick(["a", "b"]) == "b"
+    assert count(["a", "b"]) == 2
+    with pytest.raises(CassetteMissError):
+        count(["something", "else"])
+    assert len(upstream.requests) == 2
+
+def test_replay_streams(tmp_path):
+    path = str(tmp_path / "cassette.json")
+    ai = Fructose(client=RecordingClient(FakeClient(['{"response": ["x", "y"]}'], chunk_size=4), path, mode='auto'))
+
+    @ai
+    def letters(n: int) -> list[str]:
+        """
+        Return n letters.
+        """
+
+    assert list(letters.stream(2)) == ["x", "y"]
+    ai = Fructose(client=RecordingClient(None, path, mode='replay'))
+    letters = ai(letters.__wrapped__)
+    assert list(letters.stream(2)) == ["x", "y"]
+
+def test_async_auto_mode(tmp_path):
+    path = str(tmp_path / "cassette.json")
+    upstream = FakeAsyncClient(['{"response": 3}'])
+    ai = Fructose(client=FakeClient(), async_client=AsyncRecordingClient(upstream, path, mode='auto'))
+
+    @ai
+    async def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    assert asyncio.run(add(1, 2)) == 3
+    assert asyncio.run(add(1, 2)) == 3
+    assert len(upstream.requests) == 1
+
+def test_request_key_ignores_random_seed():
+    request = {"model": "m", "messages": [{"role": "system", "content": "Pick one.\n\nRandom seed: b'\\x01'\n\n"}]}
+    other = {"model": "m", "messages": [{"role": "system", "content": "Pick one.\n\nRandom seed: b'\\x02'\n\n"}]}
+    assert request_key(request) == request_key(other)
+    assert request_key(request) != request_key({**other, "model": "n"})
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from fructose import AsyncFructose, Fructose
+from fructose.client_pool import ClientPool, resolve, use_client
+from fructose.testing import FakeAsyncClient, FakeClient
+
+
+def test_pool_shares_clients_per_key_and_base_url():
+    pool = ClientPool(max_connections=10, keepalive_expiry=60, http2=False)
+    client = pool.get(api_key="key-a")
+    assert pool.get(api_key="key-a") is client
+    assert pool.get(api_key="key-b") is not client
+    assert pool.get(api_key="key-a", base_url="http://localhost:8000/v1") is not client
+    assert pool.get_async(api_key="key-a") is not client
+    assert len(pool) == 4
+    assert pool.limits().max_connections == 10 and pool.limits().keepalive_expiry == 60
+
+    # every instance without its own client uses the pool's
+    assert Fructose(client_pool=pool)._client is pool.get()
+    assert Fructose(client_pool=pool)._client is Fructose(client_pool=pool)._client
+    pool.close()
+    assert len(pool) == 0
+
+def test_use_client_overrides_per_call():
+    default_client = FakeClient(default='{"response": "default"}')
+    tenant_client = FakeClient(default='{"response": "tenant"}')
+    ai = Fructose(client=default_client)
+
+    @ai
+    def whoami() -> str:
+        """
+        Say who you are.
+        """
+
+    with use_client(tenant_client):
+        assert whoami() == "tenant"
+    assert whoami() == "default"
+    assert len(tenant_client.requests) == 1
+
+    pool = ClientPool(http2=False)
+    with use_client(api_key="tenant-key", pool=pool):
+        assert resolve(default_client) is pool.get(api_key="tenant-key")
+        assert resolve(default_client, is_async=True) is pool.get_async(api_key="tenant-key")
+    assert resolve(default_client) is default_client
+
+    with pytest.raises(ValueError):
+        with use_client(tenant_client, api_key="key"):
+            pass
+
+def test_use_client_follows_map_and_tasks():
+    tenant_client = FakeClient(default='{"response": 1}')
+    ai = Fructose(client=FakeClient())
+
+    @ai
+    def one(x: int) -> int:
+        """
+        Return 1.
+        """
+
+    with use_client(tenant_client):
+        assert list(one.map([1, 2, 3])) == [1, 1, 1]
+    assert len(tenant_client.requests) == 3
+
+    async_client = FakeAsyncClient(default='{"response": 1}')
+    async_ai = AsyncFructose(client=FakeAsyncClient())
+
+    @async_ai
+    def async_one(x: int) -> int:
+        """
+        Return 1.
+        """
+
+    async def main():
+        with use_client(async_client):
+            return await asyncio.gather(async_one(1), async_one(2))
+
+    assert asyncio.run(main()) == [1, 1]
+    assert len(async_client.requests) == 2
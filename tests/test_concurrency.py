@@ -0,0 +1,96 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from fructose import Fructose
+from fructose.ai import DEFAULT_MODEL
+from fructose.concurrency import AdaptiveLimit, ConcurrencyPolicy
+from fructose.scheduler import Scheduler
+from fructose.testing import FakeClient
+
+
+def test_additive_increase_multiplicative_decrease():
+    limit = AdaptiveLimit(ConcurrencyPolicy(initial_limit=4, max_limit=8))
+    # a limit's worth of healthy calls at the limit adds one
+    for i in range(5):
+        limit.on_success(0.1, in_flight=4, now=i)
+    assert limit.limit == 5
+    # unused headroom doesn't grow the limit
+    for i in range(10):
+        limit.on_success(0.1, in_flight=1, now=10 + i)
+    assert limit.limit == 5
+
+    limit.on_overload("status 429", now=20)
+    assert limit.limit == 2
+    # failures of calls sent together only back off once
+    limit.on_overload("status 429", now=20.01)
+    assert limit.limit == 2
+    assert [decision["action"] for decision in limit.decisions] == ["increase", "decrease"]
+
+def test_latency_backoff():
+    limit = AdaptiveLimit(ConcurrencyPolicy(initial_limit=16, latency_tolerance=2.0, smoothing=1.0))
+    limit.on_success(0.1, in_flight=1, now=0)
+    limit.on_success(0.5, in_flight=1, now=1)
+    assert limit.limit == 8
+    assert limit.decisions[-1]["reason"].startswith("latency")
+
+    with pytest.raises(ValueError):
+        ConcurrencyPolicy(initial_limit=0)
+
+def test_scheduler_enforces_the_limit_and_retry_after():
+    entries = []
+    failures = []
+    in_flight = []
+    lock = threading.Lock()
+
+    def respond(request):
+        with lock:
+            entries.append((time.perf_counter(), len(in_flight) + 1))
+            in_flight.append(1)
+            first = len(entries) == 1
+        time.sleep(0.02)
+        with lock:
+            in_flight.pop()
+        if first:
+            failures.append(time.perf_counter())
+            response = SimpleNamespace(request=None, status_code=503, headers={"retry-after": "0.05"})
+            raise openai.InternalServerError("overloaded", response=response, body=None)
+        return '{"response": 1}'
+
+    scheduler = Scheduler(concurrency=ConcurrencyPolicy(initial_limit=2, max_limit=2))
+    ai = Fructose(client=FakeClient(default=respond), scheduler=scheduler)
+
+    @ai
+    def one(x: int) -> int:
+        """
+        Return 1.
+        """
+
+    results = list(one.map(range(6), concurrency=6))
+    assert sum(isinstance(result, openai.InternalServerError) for result in results) == 1
+    assert max(concurrent for _, concurrent in entries) <= 2
+    # nothing was sent while the 503's Retry-After lasted
+    assert all(entered >= failures[0] + 0.05 for entered, _ in entries if entered > failures[0])
+
+    limits = scheduler.concurrency_limits()[DEFAULT_MODEL]
+    assert limits["in_flight"] == 0
+    decision = scheduler.decisions()[0]
+    assert decision["action"] == "decrease" and decision["reason"] == "status 503" and decision["limit"] == 1
+    assert scheduler.stats()["concurrency"] == scheduler.concurrency_limits()
+
+def test_streams_are_observed_once_read():
+    scheduler = Scheduler(concurrency=ConcurrencyPolicy(smoothing=1.0))
+
+    def stream():
+        for _ in range(3):
+            time.sleep(0.02)
+            yield SimpleNamespace(usage=None)
+
+    chunks = scheduler.call(stream, "model", "f", 1)
+    assert scheduler.concurrency_limits()["model"]["latency"] is None
+    assert len(list(chunks)) == 3
+    # the whole stream, not the time to its first byte
+    assert scheduler.concurrency_limits()["model"]["latency"] >= 0.06
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from fructose import AsyncFructose, Fructose
+from fructose.hedging import HedgePolicy, LatencyWindow, SpeculativePolicy
+from fructose.metrics import MetricsRegistry
+from fructose.testing import FakeAsyncClient, FakeClient, completion
+
+
+def _responder(responses):
+    # hands out the responses in order, whichever attempt asks first
+    responses = iter(responses)
+    lock = threading.Lock()
+
+    def respond(request):
+        with lock:
+            return next(responses)
+    return respond
+
+def test_speculative_attempts_take_the_first_valid_answer():
+    invalid = completion('{"response": "three"}', prompt_tokens=10, completion_tokens=2)
+    valid = completion('{"response": 3}', prompt_tokens=10, completion_tokens=1)
+    client = FakeClient(default=_responder([invalid, invalid, valid]))
+    metrics = MetricsRegistry()
+    ai = Fructose(client=client, metrics=metrics, hedging=SpeculativePolicy(attempts=3))
+
+    @ai
+    def three() -> int:
+        """
+        Return 3.
+        """
+
+    assert three() == 3
+    counters = metrics.snapshot()[0]["counters"]
+    assert counters["retries"] == 0
+    assert counters["hedged_attempts"] == 2
+    # every attempt's tokens are counted, the unused ones also as hedge_tokens
+    assert counters["hedge_tokens"] == 24
+    assert counters["prompt_tokens"] == 30 and counters["completion_tokens"] == 5
+
+def test_hedge_after_the_latency_percentile():
+    slow_calls = []
+
+    def respond(request):
+        if len(client.requests) == 4:
+            slow_calls.append(time.perf_counter())
+            time.sleep(0.5)
+        else:
+            time.sleep(0.01)
+        return '{"response": 1}'
+
+    client = FakeClient(default=respond)
+    metrics = MetricsRegistry()
+    ai = Fructose(client=client, metrics=metrics)
+
+    @ai(hedging=HedgePolicy(percentile=50, min_samples=3))
+    def one() -> int:
+        """
+        Return 1.
+        """
+
+    for _ in range(3):
+        assert one() == 1
+    start = time.perf_counter()
+    assert one() == 1
+    assert time.perf_counter() - start < 0.3
+    assert len(slow_calls) == 1 and len(client.requests) == 5
+    counters = metrics.snapshot()[0]["counters"]
+    assert counters["hedged_attempts"] == 1 and counters["hedge_wins"] == 1
+
+def test_async_speculative_attempts():
+    client = FakeAsyncClient(default=_responder(['{"response": "x"}', '{"response": 2}']))
+    ai = AsyncFructose(client=client, hedging=SpeculativePolicy(attempts=2))
+
+    @ai
+    def two() -> int:
+        """
+        Return 2.
+        """
+
+    assert asyncio.run(two()) == 2
+    assert len(client.requests) == 2
+
+def test_latency_window_percentile():
+    window = LatencyWindow(size=3)
+    assert window.percentile(50) is None
+    for seconds in [5.0, 1.0, 2.0, 3.0]:
+        window.observe(seconds)
+    assert len(window) == 3 and window.percentile(50) == 2.0 and window.percentile(100) == 3.0
+    assert HedgePolicy(percentile=100, min_samples=3, max_attempts=3).delays(window) == [0.0, 3.0, 6.0]
+
+def test_policies_reject_invalid_settings():
+    with pytest.raises(ValueError):
+        HedgePolicy(max_attempts=0)
+    with pytest.raises(ValueError):
+        HedgePolicy(percentile=-1)
+    with pytest.raises(ValueError):
+        HedgePolicy(percentile=101)
+    with pytest.raises(ValueError):
+        SpeculativePolicy(attempts=0)
@@ -0,0 +1,185 @@
+import asyncio
+import json
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from fructose import AsyncFructose, Fructose
+from fructose.testing import FakeAsyncClient, FakeClient, completion, tool_call
+
+
+def test_sync_call():
+    client = FakeClient([completion('{"response": 3}')])
+    ai = Fructose(client=client)
+
+    @ai
+    def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    assert add(1, 2) == 3
+    assert len(client.requests) == 1
+
+def test_sync_parse_retry():
+    client = FakeClient([completion('{"response": "three"}'), completion('{"response": 3}')])
+    ai = Fructose(client=client)
+
+    @ai
+    def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    assert add(1, 2) == 3
+    assert client.requests[-1]['messages'][-1]['content'].startswith("Parse Error")
+
+def test_async_def_uses_async_client():
+    async_client = FakeAsyncClient([completion('{"response": true}')])
+    ai = Fructose(client=FakeClient([]), async_client=async_client)
+
+    @ai
+    async def is_even(n: int) -> bool:
+        """
+        Return whether n is even.
+        """
+
+    assert asyncio.run(is_even(4)) == True
+    assert len(async_client.requests) == 1
+
+def test_async_def_needs_an_async_client_with_a_custom_client():
+    ai = Fructose(client=FakeClient([]))
+
+    async def is_even(n: int) -> bool:
+        """
+        Return whether n is even.
+        """
+
+    with pytest.raises(ValueError):
+        ai(is_even)
+
+def test_async_fructose_tools_and_chain_of_thought():
+    client = FakeAsyncClient([
+        completion("I should call add."),
+        completion(tool_calls=[tool_call("call_1", "add", {"a": 1, "b": 2})]),
+        completion("I have the answer."),
+        completion('{"response": 3}'),
+    ])
+    ai = AsyncFructose(client=client)
+
+    async def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+        return a + b
+
+    @ai(uses=[add], flavors=["chain_of_thought"])
+    def add_two_numbers(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    assert asyncio.run(add_two_numbers(1, 2)) == 3
+    tool_messages = [m for m in client.requests[3]['messages'] if m['role'] == "tool"]
+    assert [m['content'] for m in tool_messages] == ["3"]
+
+def test_structured_outputs_with_fallback():
+
+    class RejectingClient(FakeClient):
+        def create(self, **kwargs):
+            if kwargs["response_format"]["type"] == "json_schema":
+                self.requests.append(kwargs)
+                raise openai.BadRequestError("json_schema is not supported", response=SimpleNamespace(request=None, status_code=400, headers={}), body=None)
+            return super().create(**kwargs)
+
+    client = FakeClient([completion('{"response": [1, 2]}')])
+    ai = Fructose(client=client, structured_outputs=True)
+
+    @ai
+    def first_two() -> list[int]:
+        """
+        Return the first two positive integers.
+        """
+
+    assert first_two() == [1, 2]
+    response_format = client.requests[0]["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["strict"] == True
+    assert response_format["json_schema"]["schema"]["properties"]["response"] == {"type": "array", "items": {"type": "integer"}}
+
+    client = RejectingClient([completion('{"response": [1, 2]}'), completion('{"response": [3, 4]}')])
+    ai = Fructose(client=client, structured_outputs=True)
+
+    @ai
+    def first_two() -> list[int]:
+        """
+        Return the first two positive integers.
+        """
+
+    assert first_two() == [1, 2]
+    assert first_two() == [3, 4]
+    assert [r["response_format"]["type"] for r in client.requests] == ["json_schema", "json_object", "json_object"]
+
+def test_other_bad_requests_keep_structured_outputs():
+    def too_long(request):
+        body = {"code": "context_length_exceeded", "param": "messages", "message": "maximum context length"}
+        raise openai.BadRequestError("maximum context length", response=SimpleNamespace(request=None, status_code=400, headers={}), body=body)
+
+    client = FakeClient(default=too_long)
+    ai = Fructose(client=client, structured_outputs=True)
+
+    @ai
+    def first_two() -> list[int]:
+        """
+        Return the first two positive integers.
+        """
+
+    with pytest.raises(openai.BadRequestError):
+        first_two()
+    assert [r["response_format"]["type"] for r in client.requests] == ["json_schema"]
+    assert first_two.stream.__self__._response_format["type"] == "json_schema"
+
+def test_compact_retry_splices_failing_element():
+    @dataclass
+    class Person:
+        name: str
+        age: int
+
+    people = [{"name": "Ann", "age": 31}, {"name": "Bob", "age": "unknown"}, {"name": "Cy", "age": 7}]
+    client = FakeClient([
+        completion(None, [tool_call("call_1", "lookup", {"query": "people"})]),
+        completion(json.dumps({"response": people})),
+        completion('{"response": {"name": "Bob", "age": 52}}'),
+    ])
+    ai = Fructose(client=client)
+
+    def lookup(query: str) -> str:
+        return "Ann 31, Bob 52, Cy 7"
+
+    @ai(uses=[lookup])
+    def find_people(query: str) -> list[Person]:
+        """
+        Find the people matching the query.
+        """
+
+    assert [person.age for person in find_people("everyone")] == [31, 52, 7]
+
+    retry_messages = client.requests[-1]['messages']
+    assert [message['role'] for message in retry_messages] == ["system", "user", "assistant", "user"]
+    assert "response[1].age" in retry_messages[-1]['content']
+    assert 'tools' not in client.requests[-1]
+
+def test_full_retry_keeps_conversation():
+    client = FakeClient([completion('{"response": "three"}'), completion('{"response": "3"}'), completion('{"response": 3}')])
+    ai = Fructose(client=client, retry_strategy='full')
+
+    @ai
+    def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    assert add(1, 2) == 3
+    assert [message['role'] for message in client.requests[-1]['messages']] == ["system", "user", "assistant", "user", "assistant", "user"]
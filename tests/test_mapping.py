@@ -0,0 +1,57 @@
+import asyncio
+import itertools
+import threading
+import time
+
+import pytest
+from fructose.mapping import amap_calls, map_calls
+
+
+def test_map_calls_ordered_with_exceptions():
+    def invert(x):
+        time.sleep(0.01 * (5 - x))
+        return 1 / x
+
+    results = list(map_calls(invert, range(5), concurrency=3))
+    assert isinstance(results[0], ZeroDivisionError)
+    assert results[1:] == [1, 1 / 2, 1 / 3, 1 / 4]
+
+def test_map_calls_bounded_and_lazy():
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def work(x):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.005)
+        with lock:
+            in_flight -= 1
+        return x
+
+    # an infinite generator must still work, since inputs are pulled lazily
+    results = list(itertools.islice(map_calls(work, itertools.count(), concurrency=4, ordered=False), 20))
+    assert len(results) == 20
+    assert max_in_flight <= 4
+
+def test_map_calls_rejects_bad_concurrency():
+    with pytest.raises(ValueError):
+        list(map_calls(str, [1], concurrency=0))
+
+def test_amap_calls():
+    async def double(x):
+        await asyncio.sleep(0.001 * (3 - x))
+        if x == 2:
+            raise ValueError("bad")
+        return x * 2
+
+    async def collect(ordered):
+        return [r async for r in amap_calls(double, range(4), concurrency=2, ordered=ordered)]
+
+    results = asyncio.run(collect(True))
+    assert results[:2] == [0, 2] and isinstance(results[2], ValueError) and results[3] == 6
+
+    results = asyncio.run(collect(False))
+    assert sorted(r for r in results if not isinstance(r, Exception)) == [0, 2, 6]
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+from fructose import Fructose
+from fructose.metrics import MetricsRegistry
+from fructose.testing import FakeClient, completion, tool_call
+
+
+def _usage(prompt_tokens, completion_tokens, cached_tokens=0):
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+
+def test_metrics_per_function_and_model():
+    responses = [
+        completion(None, [tool_call("call_1", "double", {"n": 2}), tool_call("call_2", "double", {"n": 3})]),
+        completion('{"response": "ten"}'),
+        completion('{"response": 10}'),
+    ]
+    for response, usage in zip(responses, [_usage(100, 10, 64), _usage(120, 5), _usage(50, 5)]):
+        response.usage = usage
+    registry = MetricsRegistry()
+    ai = Fructose(client=FakeClient(responses), model="test-model", metrics=registry)
+
+    def double(n: int) -> int:
+        return n * 2
+
+    @ai(uses=[double])
+    def add_doubles(a: int, b: int) -> int:
+        """
+        Return the sum of the doubled inputs.
+        """
+
+    assert add_doubles(2, 3) == 10
+
+    [snapshot] = registry.snapshot()
+    assert snapshot["function"].endswith("add_doubles") and snapshot["model"] == "test-model"
+    counters = snapshot["counters"]
+    assert counters["calls"] == 1 and counters["errors"] == 0
+    assert counters["tool_calls"] == 2 and counters["retries"] == 1
+    assert (counters["prompt_tokens"], counters["completion_tokens"], counters["cached_tokens"]) == (270, 20, 64)
+    assert {phase: latency["count"] for phase, latency in snapshot["latency"].items()} == {
+        "completion": 2, "tools": 1, "retry": 1, "parse": 2, "call": 1,
+    }
+
+    exposition = registry.to_prometheus()
+    assert '# TYPE fructose_retries_total counter' in exposition
+    assert 'fructose_tool_calls_total{function="' in exposition
+    assert 'phase="call",le="+Inf"} 1' in exposition
+    assert 'fructose_phase_seconds_count{function=' in exposition
+
+def test_metrics_count_errors():
+    registry = MetricsRegistry()
+    ai = Fructose(client=FakeClient([completion('{"response": "x"}')] * 4), metrics=registry)
+
+    @ai
+    def count(text: str) -> int:
+        """
+        Count the words in the text.
+        """
+
+    try:
+        count("a b")
+    except ValueError:
+        pass
+    [snapshot] = registry.snapshot()
+    assert snapshot["counters"]["errors"] == 1 and snapshot["counters"]["retries"] == 3
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from fructose import Fructose
+from fructose.cache import ResponseCache
+from fructose.packing import PackingPolicy
+from fructose.testing import FakeClient
+
+
+def _answer(request):
+    # packed requests map item ids to arguments, single requests are the arguments themselves
+    arguments = json.loads(request["messages"][-1]["content"])
+    if "n" in arguments:
+        return json.dumps({"response": arguments["n"] % 2 == 0})
+    answers = {item_id: item["n"] % 2 == 0 for item_id, item in arguments.items() if item["n"] != 3}
+    if "5" in answers:
+        answers["5"] = "not a bool"
+    return json.dumps({"response": answers})
+
+def test_packed_map():
+    client = FakeClient(default=_answer)
+    ai = Fructose(client=client, pack=PackingPolicy(window=0.2))
+
+    @ai
+    def is_even(n: int) -> bool:
+        """
+        Return whether n is even.
+        """
+
+    assert list(is_even.map(range(8), concurrency=8)) == [n % 2 == 0 for n in range(8)]
+
+    packed = [request for request in client.requests if '"0":' in request["messages"][-1]["content"]]
+    assert len(packed) == 1
+    assert "mapping item ids" in packed[0]["messages"][0]["content"]
+    # the missing answer and the invalid one are re-run on their own
+    assert len(client.requests) == 3
+
+def test_pack_token_budget():
+    client = FakeClient(default=_answer)
+    ai = Fructose(client=client, pack=PackingPolicy(max_tokens=4, window=0.2))
+
+    @ai
+    def is_even(n: int) -> bool:
+        """
+        Return whether n is even.
+        """
+
+    assert list(is_even.map([0, 2, 4, 6], concurrency=4)) == [True] * 4
+    # each item is about 2 tokens, so at most 2 fit a pack
+    assert all(len(json.loads(request["messages"][-1]["content"])) <= 2 for request in client.requests)
+
+def test_packed_calls_use_the_response_cache():
+    client = FakeClient(default=_answer)
+    ai = Fructose(client=client, pack=PackingPolicy(window=0.2), cache=ResponseCache())
+
+    @ai
+    def is_even(n: int) -> bool:
+        """
+        Return whether n is even.
+        """
+
+    assert list(is_even.map([0, 1], concurrency=2)) == [True, False]
+    assert len(client.requests) == 1
+    # answered from the cache, packed or not
+    assert list(is_even.map([0, 1], concurrency=2)) == [True, False]
+    assert is_even(1) is False
+    assert len(client.requests) == 1
+
+def test_packed_random_functions_get_a_seed():
+    client = FakeClient(default=_answer)
+    ai = Fructose(client=client, pack=PackingPolicy(window=0.2))
+
+    @ai(flavors=["random"])
+    def is_even(n: int) -> bool:
+        """
+        Return whether n is even.
+        """
+
+    assert list(is_even.map([0, 1], concurrency=2)) == [True, False]
+    assert "Random seed" in client.requests[0]["messages"][0]["content"]
+
+def test_single_call_is_not_packed():
+    client = FakeClient(default=_answer)
+    ai = Fructose(client=client, pack=True)
+
+    @ai
+    def is_even(n: int) -> bool:
+        """
+        Return whether n is even.
+        """
+
+    assert is_even(4) is True
+    assert client.requests[0]["messages"][-1]["content"] == '{"n":4}'
+
+def test_pack_rejects_tools():
+    ai = Fructose(client=FakeClient(), pack=True)
+
+    def lookup(n: int) -> int:
+        return n
+
+    with pytest.raises(ValueError):
+        @ai(uses=[lookup])
+        def is_even(n: int) -> bool:
+            """
+            Return whether n is even.
+            """
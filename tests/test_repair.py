@@ -0,0 +1,74 @@
+from dataclasses import dataclass
+from enum import Enum
+
+import pytest
+from fructose import Fructose
+from fructose.repair import repair_llm_result
+from fructose.testing import FakeClient, completion
+
+class Color(Enum):
+    LAVENDER = "lavender"
+    INDIGO = "indigo"
+
+@dataclass
+class House:
+    color: Color
+    size: int
+    is_occupied: bool
+
+
+def test_strict():
+    assert repair_llm_result('{"response": 3}', int, 'strict') == (3, [])
+    with pytest.raises(ValueError):
+        repair_llm_result('{"response": "3"}', int, 'strict')
+
+def test_lenient_coercions():
+    result, repairs = repair_llm_result('{"response": {"color": "indigo", "size": "3", "is_occupied": "true"}}', House, 'lenient')
+    assert result == House(Color.INDIGO, 3, True)
+    assert sorted(repairs) == ["enum_value", "string_to_bool", "string_to_number"]
+
+    assert repair_llm_result('{"response": ["1", 2.0]}', list[int], 'lenient') == ([1, 2], ["string_to_number", "float_to_int"])
+    assert repair_llm_result('{"response": 42}', str, 'lenient') == ("42", ["number_to_string"])
+
+    with pytest.raises(ValueError):
+        repair_llm_result('{"response": "three"}', int, 'lenient')
+    with pytest.raises(ValueError):
+        repair_llm_result('```json\n{"response": 3}\n```', int, 'lenient')
+
+def test_text_repairs():
+    assert repair_llm_result('```json\n{"response": [1, 2,]}\n```', list[int], 'repair') == ([1, 2], ["code_fence", "trailing_comma"])
+    assert repair_llm_result('Sure! {"response": "a, ]"} Hope this helps', str, 'repair') == ("a, ]", ["surrounding_text"])
+    assert repair_llm_result('{"color": "LAVENDER", "size": 1, "is_occupied": false}', House, 'repair') == (House(Color.LAVENDER, 1, False), ["missing_envelope"])
+
+    with pytest.raises(ValueError):
+        repair_llm_result('not json at all', int, 'repair')
+    with pytest.raises(ValueError):
+        repair_llm_result('{"response": 3}', int, 'unknown')
+
+def test_handler_repairs_before_retrying():
+    client = FakeClient([completion('{"response": "3"}')])
+    ai = Fructose(client=client, repair='lenient')
+
+    @ai
+    def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    assert add(1, 2) == 3
+    assert len(client.requests) == 1
+    assert add.repairs == {"string_to_number": 1}
+
+def test_handler_repairs_a_bare_scalar():
+    client = FakeClient([completion('3')])
+    ai = Fructose(client=client, repair='repair')
+
+    @ai
+    def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    assert add(1, 2) == 3
+    assert len(client.requests) == 1
+    assert add.repairs == {"missing_envelope": 1}
@@ -0,0 +1,169 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from fructose import Fructose
+from fructose.metrics import MetricsRegistry
+from fructose.scheduler import BATCH_PRIORITY, RateLimits, Scheduler, priority
+from fructose.testing import FakeClient
+
+
+def _rate_limit_error(retry_after_ms: str):
+    response = SimpleNamespace(request=None, status_code=429, headers={"retry-after-ms": retry_after_ms})
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+def test_requests_per_minute():
+    # a bucket of one request, refilling ten times a second
+    scheduler = Scheduler(default_rate_limits=RateLimits(requests_per_minute=600, burst_seconds=0.1))
+    ai = Fructose(client=FakeClient(default='{"response": 1}'), scheduler=scheduler)
+
+    @ai
+    def one() -> int:
+        """
+        Return 1.
+        """
+
+    start = time.perf_counter()
+    assert [one() for _ in range(3)] == [1, 1, 1]
+    assert time.perf_counter() - start >= 0.18
+    assert scheduler.stats()["waits"][0]["count"] == 3
+
+def test_priority_and_bulkhead():
+    scheduler = Scheduler()
+    order = []
+    running = scheduler.acquire("model", "f", 1, max_concurrency=1)
+
+    def call(name, level):
+        with priority(level):
+            ticket = scheduler.acquire("model", "f", 1, max_concurrency=1)
+        order.append(name)
+        scheduler.release(ticket)
+
+    batch = threading.Thread(target=call, args=("batch", BATCH_PRIORITY))
+    batch.start()
+    while scheduler.queue_depth < 1:
+        time.sleep(0.001)
+    interactive = threading.Thread(target=call, args=("interactive", 0))
+    interactive.start()
+    while scheduler.queue_depth < 2:
+        time.sleep(0.001)
+    assert scheduler.stats()["in_flight"] == {"f": 1}
+
+    scheduler.release(running)
+    batch.join()
+    interactive.join()
+    assert order == ["interactive", "batch"]
+    assert scheduler.stats()["queue_depth"] == 0
+
+def test_rate_limit_errors_are_retried():
+    attempts = []
+
+    def respond(request):
+        attempts.append(time.perf_counter())
+        if len(attempts) == 1:
+            raise _rate_limit_error("50")
+        return '{"response": 2}'
+
+    scheduler = Scheduler()
+    ai = Fructose(client=FakeClient(default=respond), scheduler=scheduler)
+
+    @ai
+    def two() -> int:
+        """
+        Return 2.
+        """
+
+    assert two() == 2
+    assert attempts[1] - attempts[0] >= 0.05
+    assert scheduler.stats()["rate_limited"] == 1
+
+def test_max_concurrency_needs_a_scheduler():
+    with pytest.raises(ValueError):
+        Fructose(client=FakeClient())(max_concurrency=2)
+
+def test_bulkhead_waiter_wakes_after_a_failed_call_pauses_the_model():
+    scheduler = Scheduler(rate_limit_retries=0)
+    calls = []
+
+    def create():
+        calls.append(time.perf_counter())
+        if len(calls) == 1:
+            time.sleep(0.02)
+            raise _rate_limit_error("50")
+        return "ok"
+
+    def call():
+        try:
+            return scheduler.call(create, "model", "f", 1, max_concurrency=1)
+        except openai.RateLimitError:
+            return "rate limited"
+
+    first = threading.Thread(target=call, daemon=True)
+    first.start()
+    while not calls:
+        time.sleep(0.001)
+    second_result = []
+    second = threading.Thread(target=lambda: second_result.append(call()), daemon=True)
+    second.start()
+    first.join()
+    second.join(2)
+    assert not second.is_alive() and second_result == ["ok"]
+    assert calls[1] - calls[0] >= 0.05
+    assert scheduler.queue_depth == 0
+
+def test_scheduled_clients_dont_retry_themselves():
+    client = openai.Client(api_key="key")
+    ai = Fructose(client=client, scheduler=Scheduler())
+    assert ai._client.max_retries == 0 and client.max_retries == 2
+
+def test_streams_hold_their_slot_until_read():
+    scheduler = Scheduler()
+    client = FakeClient(default='{"response": [1, 2, 3]}', chunk_size=4)
+    ai = Fructose(client=client, scheduler=scheduler)
+
+    @ai(max_concurrency=1)
+    def numbers() -> list[int]:
+        """
+        Return 1, 2 and 3.
+        """
+
+    stream = numbers.stream()
+    assert next(stream) == 1
+    assert list(scheduler.stats()["in_flight"].values()) == [1]
+
+    second = threading.Thread(target=numbers, daemon=True)
+    second.start()
+    time.sleep(0.05)
+    assert second.is_alive() and scheduler.queue_depth == 1
+
+    assert list(stream) == [2, 3]
+    second.join(2)
+    assert not second.is_alive()
+    assert sum(scheduler.stats()["in_flight"].values()) == 0
+
+def test_same_named_functions_of_different_modules_have_their_own_bulkhead():
+    scheduler = Scheduler()
+    metrics = MetricsRegistry()
+    ai = Fructose(client=FakeClient(default='{"response": 1}'), scheduler=scheduler, metrics=metrics)
+
+    def define(module):
+        def one() -> int:
+            """
+            Return 1.
+            """
+        one.__module__ = module
+        return ai(max_concurrency=1)(one)
+
+    first, second = define("reports"), define("billing")
+    handler = first.stream.__self__
+    held = scheduler.acquire(handler._model, handler._function_key, 1, max_concurrency=1)
+    call = threading.Thread(target=second, daemon=True)
+    call.start()
+    call.join(2)
+    assert not call.is_alive()
+    scheduler.release(held)
+    assert first() == 1
+    assert sorted(snapshot["function"].split(".")[0] for snapshot in metrics.snapshot()) == ["billing", "reports"]
@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+from enum import Enum
+
+from fructose import Fructose
+from fructose.serializer import serialize_arguments, to_jsonable
+from fructose.testing import FakeClient
+
+
+class Color(Enum):
+    RED = "red"
+    INDIGO = "indigo"
+
+@dataclass
+class Person:
+    name: str
+    favorite: Color
+    scores: tuple[int, int]
+
+def test_to_jsonable():
+    person = Person("Ann", Color.INDIGO, (1, 2))
+    assert to_jsonable(person) == {"name": "Ann", "favorite": "INDIGO", "scores": [1, 2]}
+    assert to_jsonable({"b": 1, "a": {3, 1, 2}}) == {"a": [1, 2, 3], "b": 1}
+    assert to_jsonable({Color.RED: None}) == {"RED": None}
+
+def test_serialize_arguments_is_compact_and_deterministic():
+    first = serialize_arguments({"people": [Person("Ann", Color.RED, (1, 2))], "tags": {"x", "y"}})
+    second = serialize_arguments({"people": [Person("Ann", Color.RED, (1, 2))], "tags": {"y", "x"}})
+    assert first == second == '{"people":[{"name":"Ann","favorite":"RED","scores":[1,2]}],"tags":["x","y"]}'
+
+def test_serialize_arguments_budget():
+    serialized = serialize_arguments({"text": "a" * 100, "short": "ok", "items": list(range(100))}, max_tokens_per_argument=5)
+    assert '"text":"aaaaaaaaaaaaaaaaaaaa…[80 more chars]"' in serialized
+    assert '"short":"ok"' in serialized
+    assert "more items]" in serialized
+    assert "…" not in serialize_arguments({"text": "a" * 100}, max_tokens_per_argument=None)
+
+def test_arguments_are_only_budgeted_on_request():
+    client = FakeClient(default='{"response": 1}')
+    ai = Fructose(client=client)
+
+    @ai
+    def count(text: str) -> int:
+        """
+        Count the words.
+        """
+
+    @ai(max_argument_tokens=5)
+    def count_briefly(text: str) -> int:
+        """
+        Count the words.
+        """
+
+    count("a" * 100_000)
+    count_briefly("a" * 100)
+    assert "…" not in client.requests[0]["messages"][-1]["content"]
+    assert "…[80 more chars]" in client.requests[1]["messages"][-1]["content"]
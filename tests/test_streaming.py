@@ -0,0 +1,148 @@
+import asyncio
+from dataclasses import dataclass
+from enum import Enum
+import json
+from typing import Optional
+
+import pytest
+from fructose import AsyncFructose, Fructose
+from fructose.streaming import IncrementalJSONParser, ResponseStreamParser, StreamValidationError, StreamValidator
+from fructose.testing import FakeAsyncClient, FakeClient, completion, tool_call
+
+class Color(Enum):
+    RED = "red"
+    BLUE = "blue"
+
+@dataclass
+class Comment:
+    username: str
+    comment: str
+
+
+def test_incremental_parser_events():
+    document = json.dumps({"response": [{"a": [1, 2.5, -3e2]}, "xé\U0001F600\"", None, True]})
+    parser = IncrementalJSONParser()
+    events = []
+    for i in range(0, len(document), 3):
+        events += parser.feed(document[i:i + 3])
+    events += parser.close()
+
+    assert events[-1] == ("value", (), json.loads(document))
+    assert ("begin", ("response", 0, "a"), "array") in events
+    assert ("key", ("response", 0), "a") in events
+    assert ("value", ("response", 0, "a", 1), 2.5) in events
+
+def test_incremental_parser_errors():
+    with pytest.raises(ValueError):
+        IncrementalJSONParser().feed('{"a": tru}')
+    with pytest.raises(ValueError):
+        IncrementalJSONParser().feed('[1 2]')
+    with pytest.raises(ValueError):
+        parser = IncrementalJSONParser()
+        parser.feed('{"a": [1, 2')
+        parser.close()
+
+def test_response_stream_parser():
+    parser = ResponseStreamParser(list[int])
+    assert parser.feed('{"response": [1, 2') == [1]
+    assert parser.feed(', 3]}') == [2, 3]
+    assert parser.close() == []
+    assert parser.response == [1, 2, 3]
+
+    parser = ResponseStreamParser(str)
+    assert parser.feed('{"response": "hel') == ["hel"]
+    assert parser.feed('lo\\n"}') == ["lo\n"]
+
+    parser = ResponseStreamParser(int)
+    assert parser.feed('{"response": 4}') == [4]
+
+    with pytest.raises(ValueError):
+        ResponseStreamParser(list[int]).feed('{"response": ["a"]}')
+    with pytest.raises(ValueError):
+        parser = ResponseStreamParser(int)
+        parser.feed('{"answer": 4}')
+        parser.close()
+
+def test_stream_list_elements():
+    payload = json.dumps({"response": [{"username": "a", "comment": "first"}, {"username": "b", "comment": "second"}]})
+    client = FakeClient([payload], chunk_size=4)
+    ai = Fructose(client=client)
+
+    @ai
+    def get_comments(uri: str) -> list[Comment]:
+        """
+        Gets all base comments from a hacker news post
+        """
+
+    stream = get_comments.stream("https://news.ycombinator.com/item?id=1")
+    assert next(stream) == Comment("a", "first")
+    assert list(stream) == [Comment("b", "second")]
+    assert client.requests[0]["stream"] == True
+
+def test_stream_with_tool_calls():
+    def double(n: int) -> int:
+        """
+        Doubles n.
+        """
+        return n * 2
+
+    # the arguments arrive split over several chunks
+    client = FakeAsyncClient([
+        completion(tool_calls=[tool_call("call_1", "double", {"n": 2})]),
+        '{"response": "four"}',
+    ], chunk_size=4)
+    ai = AsyncFructose(client=client)
+
+    @ai(uses=[double])
+    def spell_double(n: int) -> str:
+        """
+        Spell out double n in english
+        """
+
+    async def collect():
+        return [text async for text in spell_double.stream(2)]
+
+    assert "".join(asyncio.run(collect())) == "four"
+    tool_message = client.requests[1]["messages"][-1]
+    assert tool_message["role"] == "tool" and tool_message["content"] == "4"
+    assert client.requests[1]["messages"][-2]["tool_calls"][0]["function"]["arguments"] == '{"n": 2}'
+
+def _validate(return_type, document, max_length=None):
+    validator = StreamValidator(return_type, max_length)
+    for char in document:
+        validator.feed(char)
+    validator.close()
+
+def test_stream_validator():
+    _validate(list[Comment], '{"response": [{"username": "a", "comment": "b"}]}')
+    _validate(Optional[int], '{"response": null}')
+
+    with pytest.raises(StreamValidationError, match="response\\[0\\].username should be str"):
+        _validate(list[Comment], '{"response": [{"username": 1, "comment": "b"}]}')
+    with pytest.raises(StreamValidationError, match="Field comment is missing from response\\[0\\]"):
+        _validate(list[Comment], '{"response": [{"username": "a"}]}')
+    with pytest.raises(StreamValidationError, match="starting with 'G'"):
+        _validate(Color, '{"response": "GREEN"}')
+    with pytest.raises(StreamValidationError, match="should be int"):
+        _validate(int, '{"response": 1.5}')
+    with pytest.raises(StreamValidationError, match="longer than 10"):
+        _validate(str, '{"response": "a long answer"}', max_length=10)
+    with pytest.raises(StreamValidationError):
+        _validate(list[int], '{"response": [1, 2')
+
+def test_fail_fast_cancels_and_retries():
+    client = FakeClient(['{"response": "PURPLE, which is a lovely color"}', '{"response": "RED"}'], chunk_size=2)
+    ai = Fructose(client=client, fail_fast=True)
+
+    @ai
+    def pick_color() -> Color:
+        """
+        Pick a color.
+        """
+
+    assert pick_color() == Color.RED
+    bad_stream = client.streams[0]
+    assert bad_stream.closed
+    assert bad_stream.consumed < 10
+    retry_message = client.requests[1]["messages"][-1]["content"]
+    assert "response should be" in retry_message and "starting with 'P" in retry_message
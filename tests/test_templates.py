@@ -0,0 +1,57 @@
+import threading
+
+from fructose import Fructose, configure_templates, get_base_template_env, get_local_template_loader
+from fructose.testing import FakeClient
+
+
+def test_template_env_is_shared_and_finds_user_templates(tmp_path):
+    assert get_base_template_env() is get_base_template_env()
+    (tmp_path / "mine.jinja").write_text("Custom: {{ func_doc_string }} {{ return_type_string }}")
+    configure_templates(template_dirs=[tmp_path], bytecode_cache_dir=tmp_path / "cache")
+    try:
+        client = FakeClient(default='{"response": 1}')
+        ai = Fructose(client=client)
+
+        @ai(system_template_path="mine.jinja")
+        def one() -> int:
+            """Return 1."""
+
+        assert one() == 1
+        assert client.requests[0]["messages"][0]["content"].startswith("Custom: Return 1.")
+        assert list((tmp_path / "cache").iterdir())
+    finally:
+        configure_templates()
+
+def test_warmup_prepares_every_function():
+    ai = Fructose(client=FakeClient(default='{"response": 1}'))
+
+    @ai
+    def one() -> int:
+        """
+        Return 1.
+        """
+
+    @ai(model=["small", "large"])
+    def two() -> int:
+        """
+        Return 2.
+        """
+
+    assert ai.warmup() == 3
+    assert one.stream.__self__._system_message is not None
+    assert ai.warmup() == 0
+    # calls racing the warmup find a fully prepared handler
+    threads = [threading.Thread(target=one) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert one() == 1
+
+def test_local_template_loader_is_an_environment(tmp_path):
+    (tmp_path / "mine.jinja").write_text("{{ x }}")
+    configure_templates(template_dirs=[tmp_path])
+    try:
+        assert get_local_template_loader().get_template("mine.jinja").render(x=1) == "1"
+    finally:
+        configure_templates()
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+from fructose import Fructose
+from fructose.testing import FakeAsyncClient, FakeClient, completion, cycle, tool_call
+
+
+def test_fake_client_round_trip():
+    client = FakeClient([
+        completion(tool_calls=[tool_call("call_1", "double", {"n": 2})], prompt_tokens=10),
+        '{"response": 4}',
+    ])
+    ai = Fructose(client=client)
+
+    def double(n: int) -> int:
+        return n * 2
+
+    @ai(uses=[double])
+    def double_it(n: int) -> int:
+        """
+        Double n using the tool.
+        """
+
+    assert double_it(2) == 4
+    assert len(client.requests) == 2 and client.requests[1]['messages'][-1]['role'] == "tool"
+
+def test_fake_client_default_and_streaming():
+    client = FakeClient(default=cycle(['{"response": ["a", "b"]}']), chunk_size=3)
+    ai = Fructose(client=client)
+
+    @ai
+    def letters(n: int) -> list[str]:
+        """
+        Return n letters.
+        """
+
+    assert letters(2) == ["a", "b"]
+    assert list(letters.stream(2)) == ["a", "b"]
+    assert client.requests[-1]["stream"] == True
+
+def test_fake_async_client_latency():
+    async_client = FakeAsyncClient(default='{"response": 3}', latency=0.05)
+    ai = Fructose(client=FakeClient(), async_client=async_client)
+
+    @ai
+    async def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    async def main():
+        return await asyncio.gather(*[add(1, 2) for _ in range(10)])
+
+    start = time.perf_counter()
+    assert asyncio.run(main()) == [3] * 10
+    assert len(async_client.requests) == 10
+    # the latency is simulated concurrently, like real requests
+    assert time.perf_counter() - start < 0.4
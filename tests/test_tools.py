@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+
+import pytest
+from fructose import type_parser
+from fructose.tools import ToolRegistry
+from fructose.testing import tool_call
+from openai.types.chat import ChatCompletionMessageToolCall
+
+class Color(Enum):
+    RED = "red"
+    BLUE = "blue"
+
+@dataclass
+class Point:
+    x: int
+    y: int
+
+def paint(point: Point, color: Color, label: Optional[str] = None) -> str:
+    """
+    Paint a point.
+    """
+    return f"{point.x},{point.y} {color.value} {label}"
+
+def _tool_call(id, name, arguments):
+    # the registry runs the typed tool calls of a ChatCompletion
+    return ChatCompletionMessageToolCall.model_validate(tool_call(id, name, arguments))
+
+def test_schemas_are_built_once():
+    registry = ToolRegistry([paint])
+    assert registry.schemas is registry.schemas
+    parameters = registry.schemas[0]["function"]["parameters"]
+    assert parameters["properties"]["color"] == {"$ref": "#/$defs/Color"}
+    assert parameters["$defs"]["Color"] == {"type": "string", "enum": ["RED", "BLUE"]}
+    # the same schema as a structured output of that type
+    assert parameters["$defs"]["Point"] == type_parser.type_to_json_schema(Point)["$defs"]["Point"]
+    assert parameters["$defs"]["Point"]["properties"]["x"] == {"type": "integer"}
+    assert parameters["properties"]["label"]["anyOf"][1] == {"type": "null"}
+    assert parameters["required"] == ["point", "color"]
+    assert parameters["required"] == ["point", "color"]
+
+    assert ToolRegistry([]).schemas is None
+
+def test_typed_argument_decoding():
+    registry = ToolRegistry([paint])
+    arguments = registry["paint"].decode_arguments('{"point": {"x": 1, "y": 2}, "color": "BLUE"}')
+    assert arguments == {"point": Point(1, 2), "color": Color.BLUE}
+
+    result = registry.call(_tool_call("call_1", "paint", {"point": {"x": 1, "y": 2}, "color": "RED", "label": "a"}))
+    assert result == "1,2 red a"
+
+    with pytest.raises(ValueError):
+        registry["paint"].decode_arguments('{"point": {"x": 1, "y": 2}, "color": "GREEN"}')
+    with pytest.raises(ValueError):
+        registry["paint"].decode_arguments('{"size": 3}')
+
+def test_run_is_concurrent_ordered_and_captures_errors():
+    import asyncio
+    import time
+
+    def slow(n: int) -> int:
+        """
+        Sleep then return n.
+        """
+        time.sleep(0.05 * n)
+        return n
+
+    def broken() -> int:
+        """
+        Always fails.
+        """
+        raise RuntimeError("boom")
+
+    registry = ToolRegistry([slow, broken])
+    calls = [
+        _tool_call("call_1", "slow", {"n": 2}),
+        _tool_call("call_2", "slow", {"n": 1}),
+        _tool_call("call_3", "broken", {}),
+        _tool_call("call_4", "missing", {}),
+    ]
+
+    start = time.monotonic()
+    results = registry.run(calls)
+    assert time.monotonic() - start < 0.14
+    assert results[:2] == [2, 1]
+    assert "RuntimeError: boom" in results[2]["error"]
+    assert "error" in results[3]
+
+    results = registry.run(calls[:2], timeout=0.07)
+    assert results[1] == 1 and "timed out" in results[0]["error"]
+
+    async def sleepy(n: int) -> int:
+        """
+        Sleep then return n.
+        """
+        await asyncio.sleep(0.05 * n)
+        return n
+
+    registry = ToolRegistry([slow, sleepy])
+    calls = [_tool_call("call_1", "sleepy", {"n": 2}), _tool_call("call_2", "slow", {"n": 1})]
+    assert asyncio.run(registry.arun(calls)) == [2, 1]
+    results = asyncio.run(registry.arun(calls, timeout=0.07))
+    assert "timed out" in results[0]["error"] and results[1] == 1
+
+def test_a_single_call_uses_the_configured_executor():
+    from concurrent.futures import ThreadPoolExecutor
+
+    submitted = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            submitted.append(fn)
+            return super().submit(fn, *args, **kwargs)
+
+    registry = ToolRegistry([paint])
+    call = _tool_call("call_1", "paint", {"point": {"x": 1, "y": 2}, "color": "RED"})
+    with RecordingExecutor(max_workers=1) as executor:
+        assert registry.run([call], executor=executor) == ["1,2 red None"]
+    assert len(submitted) == 1
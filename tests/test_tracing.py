@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+from fructose import Fructose
+from fructose.tracing import InMemoryExporter, JSONLExporter, Tracer
+from fructose.testing import FakeAsyncClient, FakeClient, completion, tool_call
+
+
+def _add_doubles(ai):
+    def double(n: int) -> int:
+        if n < 0:
+            raise ValueError("negative")
+        return n * 2
+
+    @ai(uses=[double], flavors=["chain_of_thought"])
+    def add_doubles(a: int, b: int) -> int:
+        """
+        Return the sum of the doubled inputs.
+        """
+
+    return add_doubles
+
+def _responses():
+    return [
+        completion("double both, then add"),
+        completion(None, [tool_call("call_1", "double", {"n": 2}), tool_call("call_2", "double", {"n": -3})]),
+        completion("still thinking"),
+        completion('{"response": "ten"}'),
+        completion('{"response": 10}'),
+    ]
+
+def _children(spans, parent):
+    return [span.name for span in spans if span.parent_id == parent.span_id]
+
+def test_spans_for_each_phase(tmp_path):
+    exporter = InMemoryExporter()
+    path = tmp_path / "traces.jsonl"
+    jsonl_exporter = JSONLExporter(str(path))
+    ai = Fructose(client=FakeClient(_responses()), model="test-model", tracer=Tracer(exporter, jsonl_exporter))
+
+    assert _add_doubles(ai)(2, -3) == 10
+    jsonl_exporter.close()
+
+    spans = exporter.spans
+    [call] = exporter.find("call")
+    assert call.parent_id is None and call.attributes["model"] == "test-model" and call.outcome == "ok"
+    assert all(span.trace_id == call.trace_id for span in spans)
+    assert _children(spans, call) == [
+        "prepare", "collect_arguments", "chain_of_thought", "completion", "tools",
+        "chain_of_thought", "completion", "parse", "retry", "parse",
+    ]
+
+    [tools] = exporter.find("tools")
+    tool_spans = sorted(exporter.find("tool"), key=lambda span: span.attributes["tool_call_id"])
+    assert [span.parent_id for span in tool_spans] == [tools.span_id] * 2
+    assert [span.outcome for span in tool_spans] == ["ok", "error"]
+
+    [retry] = exporter.find("retry")
+    assert retry.attributes["attempt"] == 1 and "ten" in retry.attributes["error"]
+    assert _children(spans, retry) == ["completion"]
+    assert [span.outcome for span in exporter.find("parse")] == ["error", "ok"]
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["name"] for line in lines] == [span.name for span in spans]
+
+def test_async_spans():
+    exporter = InMemoryExporter()
+    ai = Fructose(client=FakeClient([]), async_client=FakeAsyncClient([completion('{"response": 3}')] * 2), tracer=Tracer(exporter))
+
+    @ai
+    async def add(a: int, b: int) -> int:
+        """
+        Return the sum of the two input integers.
+        """
+
+    async def main():
+        return await asyncio.gather(add(1, 2), add(2, 1))
+
+    assert asyncio.run(main()) == [3, 3]
+    calls = exporter.find("call")
+    assert len(calls) == 2 and calls[0].trace_id != calls[1].trace_id
+    for call in calls:
+        assert "completion" in _children(exporter.spans, call)
@@ -172,3 +172,63 @@ def test_parse_json_to_type():
 
 
     
+
+def test_compile_parser():
+    parse = type_parser.compile_parser(list[Company])
+    assert type_parser.compile_parser(list[Company]) is parse
+
+    json = [{"name": "a", "employees": [{"name": "a", "age": 1, "items": [["a", 1]]}]}]
+    assert parse(json) == [Company(name="a", employees=[Person(name="a", age=1, items=[("a", 1)])])]
+
+    with pytest.raises(ValueError):
+        parse([{"name": "a"}])
+    with pytest.raises(ValueError):
+        type_parser.compile_parser(dict[str, int])([1, 2])
+    with pytest.raises(ValueError):
+        type_parser.compile_parser(Optional[Color])("PURPLE")
+    assert type_parser.compile_parser(Optional[Color])(None) is None
+
+    with pytest.raises(AssertionError):
+        type_parser.compile_parser(list[object])
+
+def test_json_schema():
+    assert type_parser.type_to_json_schema(int) == {"type": "integer"}
+    assert type_parser.type_to_json_schema(Optional[str]) == {"anyOf": [{"type": "string"}, {"type": "null"}]}
+    assert type_parser.type_to_json_schema(tuple[str, int]) == {
+        "type": "array",
+        "prefixItems": [{"type": "string"}, {"type": "integer"}],
+        "items": False,
+        "minItems": 2,
+        "maxItems": 2,
+    }
+
+    schema = type_parser.type_to_json_schema(list[Company])
+    assert schema["items"] == {"$ref": "#/$defs/Company"}
+    assert schema["$defs"]["Company"]["properties"]["employees"] == {"type": "array", "items": {"$ref": "#/$defs/Person"}}
+    assert schema["$defs"]["Person"]["required"] == ["name", "age", "items"]
+    assert type_parser.type_to_json_schema(Color) == {"$ref": "#/$defs/Color", "$defs": {"Color": {"type": "string", "enum": ["RED", "GREEN", "BLUE"]}}}
+
+    envelope = type_parser.response_json_schema(list[Color])
+    assert envelope["required"] == ["response"] and "Color" in envelope["$defs"]
+    assert type_parser.is_strict_json_schema(envelope)
+    assert not type_parser.is_strict_json_schema(type_parser.response_json_schema(Person))
+    assert not type_parser.is_strict_json_schema(type_parser.response_json_schema(dict[str, int]))
+
+def test_parse_error_path():
+    with pytest.raises(type_parser.ParseError) as error:
+        type_parser.parse_json_to_type([{"name": "a", "age": 1, "items": []}, {"name": "b", "age": 2, "items": [["x", "1"]]}], list[Person])
+    assert error.value.path == (1, "items", 0, 1)
+    assert str(error.value).startswith("response[1].items[0][1]: ")
+    assert type_parser.type_at_path(list[Person], (1, "items", 0, 1)) == int
+    assert type_parser.type_at_path(Optional[dict[str, Person]], ("x",)) == Person
+
+def test_json_schema_keeps_same_named_classes_apart():
+    @dataclass
+    class Person:
+        nickname: str
+
+    schema = type_parser.object_json_schema({"owner": globals()["Person"], "pet_sitter": Person})
+    owner, sitter = schema["properties"]["owner"]["$ref"], schema["properties"]["pet_sitter"]["$ref"]
+    assert owner == "#/$defs/Person" and sitter != owner
+    assert schema["$defs"][sitter.split("/")[-1]]["properties"] == {"nickname": {"type": "string"}}
+    assert "age" in schema["$defs"]["Person"]["properties"]